@@ -191,6 +191,7 @@ class FinesseMeasurementGUI(GuiBase):
         self._mw.do_fit_PushButton.clicked.disconnect()
         self._finesse.sig_fit_updated.disconnect()
         self._finesse.sig_Parameter_Updated.disconnect()
+        self.plot1.sigXRangeChanged.disconnect()
         
         self._mw.close()
         return
@@ -212,6 +213,9 @@ class FinesseMeasurementGUI(GuiBase):
         self._curve2 = pg.PlotDataItem(pen=pg.mkPen(palette.c3), symbol=None)
         self.plot1.addItem(self._curve1, clear=True)
         self.plot1.addItem(self._curve2, clear=True)
+        # the fit curve is evaluated for the visible range only, again after zooming
+        self._fit_curve = None
+        self.plot1.sigXRangeChanged.connect(self._update_fit_curve)
 
     def updateScopeSettings(self):
         if self._mw.action_stop.setEnabled is True:
@@ -226,7 +230,11 @@ class FinesseMeasurementGUI(GuiBase):
         self._finesse.eom_frequency = self._mw.doubleSpinBox_EOM.value()
 
     def update_gui(self):
-        self._curve1.setData(x=self._finesse.time_axis, y=self._finesse._current_trace, clear=True)
+        trace = self._finesse.get_current_trace()
+        if trace is None:
+            # overwritten by the acquisition, the next update shows a newer trace
+            return
+        self._curve1.setData(x=self._finesse.time_axis, y=trace, clear=True)
         if self._mw.checkBox_Fit.isChecked():
             self.doFit()
 
@@ -253,11 +261,17 @@ class FinesseMeasurementGUI(GuiBase):
         self.sigFitChanged.emit(fit_function)
         self.sigDoFit.emit(fit_function, None, None, self._mw.doubleSpinBox_chi.value(), self._mw.checkBox_PreFit.isChecked())
 
-    @QtCore.Slot()
-    def updateFit(self):
-        """ Update the shown fit. """
-        current_fit = self._finesse.fc.current_fit
-        result_str_dict = self._finesse.result_str_dict
+    @QtCore.Slot(int, dict)
+    def updateFit(self, trace_id, fit_result):
+        """ Update the shown fit.
+
+        @param int trace_id: id of the fitted trace
+        @param dict fit_result: fit curve, fit results and finesse delivered by the logic
+        """
+        current_fit = fit_result['fit_function']
+        result_str_dict = fit_result['result_str_dict']
+        finesse = fit_result['finesse']
+        finesse_error = fit_result['finesse_error']
         #fit_param = self._wm_logger_logic.fc.current_fit_param
         if current_fit != 'No Fit':
             # display results as formatted text
@@ -273,22 +287,31 @@ class FinesseMeasurementGUI(GuiBase):
             self._mw.fit_methods_ComboBox.setCurrentFit(current_fit)
             self._mw.fit_methods_ComboBox.blockSignals(False)
         
-        self._curve2.setData(x=self._finesse.cavity_fit_x, y=self._finesse.cavity_fit_y, clear=True)
+        self._fit_curve = fit_result['fit_y'].curve
+        self._update_fit_curve()
         if self._mw.checkBox_average.isChecked() is True:
-            if self._finesse.cavity_finesse > 0:
-                self.finesse_average.append(self._finesse.cavity_finesse)
+            if finesse > 0:
+                self.finesse_average.append(finesse)
                 if len(self.finesse_average) > self._mw.spinBox_numAverage.value():
                     del self.finesse_average[0]
                 self._mw.FinesseValue_Label.setText('<font color={0}>{1:,.1f} ± {2:,.1f}</font>'.format(palette.c4.name(), np.mean(self.finesse_average), np.std(self.finesse_average))) 
         else:
-            if math.isinf(self._finesse.cavity_finesse_error):
-                self._mw.FinesseValue_Label.setText('<font color=red>{1:,.1f} ± {2:,.1f}</font>'.format(palette.c4.name(), self._finesse.cavity_finesse, self._finesse.cavity_finesse_error))
+            if math.isinf(finesse_error):
+                self._mw.FinesseValue_Label.setText('<font color=red>{1:,.1f} ± {2:,.1f}</font>'.format(palette.c4.name(), finesse, finesse_error))
             else:
-                self._mw.FinesseValue_Label.setText('<font color={0}>{1:,.1f} ± {2:,.1f}</font>'.format(palette.c4.name(), self._finesse.cavity_finesse, self._finesse.cavity_finesse_error))
+                self._mw.FinesseValue_Label.setText('<font color={0}>{1:,.1f} ± {2:,.1f}</font>'.format(palette.c4.name(), finesse, finesse_error))
         self._mw.ready_label.setText('<font color=green>ready</font>')
 
 
 
+    def _update_fit_curve(self):
+        """ Evaluate the fit curve in the visible x range with two points per pixel. """
+        if self._fit_curve is None:
+            return
+        x, y = self._fit_curve.evaluate(num=2 * self._pw.width(),
+                                        x_range=self.plot1.viewRange()[0])
+        self._curve2.setData(x=x, y=y, clear=True)
+
     ###########################################################################
     #                    Main window related methods                          #
     ###########################################################################
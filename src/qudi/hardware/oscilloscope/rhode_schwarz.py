@@ -17,6 +17,7 @@ along with Qudi. If not, see <http://www.gnu.org/licenses/>.
 Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
 top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
 """
+import sys
 import numpy as np
 import pyvisa as visa
 from time import sleep
@@ -68,6 +69,15 @@ class OscilloscopeRS(OscilloscopeInterface):
     _visa_timeout = ConfigOption('visa_timeout', default=1000.)
     _opc_timeout = ConfigOption('opc_timeout', default=3000.)
     _measurement_timing = ConfigOption('measurement_timing', default=300.)
+    _transfer_format = ConfigOption('transfer_format', default='REAL,32')
+    _segment_timeout = ConfigOption('segment_timeout', default=60000.)
+    # number of traces after which the cached vertical settings are queried again, 0: never
+    _scaling_revalidation = ConfigOption('scaling_revalidation', default=100)
+
+    # sample dtype per waveform transfer format
+    _transfer_formats = {'REAL,32': np.float32, 'INT,16': np.int16, 'INT,8': np.int8}
+    # ADC levels per vertical division for the integer transfer formats (10 divisions)
+    _lsb_per_division = {'INT,16': 6476.8, 'INT,8': 25.3}
 
     sig_handle_timer = QtCore.Signal(bool, int)
 
@@ -78,9 +88,21 @@ class OscilloscopeRS(OscilloscopeInterface):
         self.threadlock = Mutex()
         
         self._current_trace = []
+        # memoized time axis per channel, see get_xaxis
+        self._xaxis_cache = dict()
+        # memoized (scale, offset) per channel, see get_scaling
+        self._scaling_cache = dict()
+        # number of scalings handed out per channel since the last query of the scope
+        self._scaling_uses = dict()
+        # reusable buffer for raw integer samples, see get_trace_into
+        self._raw_buffer = np.empty(0, dtype=np.int8)
 
     def on_activate(self):
         """ Startup the module """
+        if self._transfer_format not in self._transfer_formats:
+            self.log.error('Unknown transfer format "{0}" in config, falling back to REAL,32.'
+                           ''.format(self._transfer_format))
+            self._transfer_format = 'REAL,32'
         try:
             rm = visa.ResourceManager()
             rm.list_resources()
@@ -125,14 +147,310 @@ class OscilloscopeRS(OscilloscopeInterface):
 
     def getData_cont(self, channel):
         trace = self._rte.query_binary_values('FORM REAL,32;:CHAN{}:DATA?'.format(channel),
-                                              datatype='f', is_big_endian=True)
+                                              datatype='f', is_big_endian=True,
+                                              container=np.array)
         self._current_trace = trace
         return self._current_trace
 
+    def get_trace_into(self, buffer, channel=1):
+        """ Read the current trace of a channel in V straight into a preallocated buffer.
+
+        With the REAL,32 transfer format the IEEE 488.2 block sent by the scope is copied
+        chunk-wise into the memory of buffer, so neither a list of floats nor a new array is
+        created per trace. With the integer formats the raw samples are read into a reusable
+        internal buffer and converted to V in a single vectorized pass.
+
+        @param numpy.ndarray buffer: 1D, C-contiguous float32 array receiving the samples
+        @param int channel: channel to read from
+
+        @return int: number of samples written into buffer (-1: error)
+        """
+        if buffer.dtype != np.float32 or buffer.ndim != 1 or not buffer.flags.c_contiguous:
+            self.log.error('Trace buffer must be a 1D, C-contiguous float32 array.')
+            return -1
+
+        if self._transfer_format == 'REAL,32':
+            return self._query_trace_into(buffer, channel)
+
+        dtype = self._transfer_formats[self._transfer_format]
+        if self._raw_buffer.dtype != dtype or self._raw_buffer.size < buffer.size:
+            self._raw_buffer = np.empty(buffer.size, dtype=dtype)
+        n_samples = self._query_trace_into(self._raw_buffer[:buffer.size], channel)
+        if n_samples < 0:
+            return -1
+        gain, offset = self.get_scaling(channel)
+        np.multiply(self._raw_buffer[:n_samples], gain, out=buffer[:n_samples])
+        buffer[:n_samples] += offset
+        return n_samples
+
+    def get_raw_trace_into(self, buffer, channel=1):
+        """ Read the current trace of a channel without converting it to V.
+
+        Together with get_scaling this allows to defer the conversion, i.e. volts are
+        raw * gain + offset.
+
+        @param numpy.ndarray buffer: 1D, C-contiguous array with the dtype of the current
+                                     transfer format (float32, int16 or int8)
+        @param int channel: channel to read from
+
+        @return int: number of samples written into buffer (-1: error)
+        """
+        dtype = self._transfer_formats[self._transfer_format]
+        if buffer.dtype != dtype or buffer.ndim != 1 or not buffer.flags.c_contiguous:
+            self.log.error('Raw trace buffer must be a 1D, C-contiguous {0} array for transfer '
+                           'format {1}.'.format(np.dtype(dtype).name, self._transfer_format))
+            return -1
+        return self._query_trace_into(buffer, channel)
+
+    def get_scaling(self, channel=1):
+        """ Return the factors converting raw samples of the current transfer format into V.
+
+        The vertical settings are queried once per channel and cached. The cache is dropped by
+        SetVerticalScale, SetTimeBase, SetRecordLength, RunContinous and resync_settings.
+        Settings changed on the front panel of the scope are only noticed when the cache is
+        revalidated, which happens every scaling_revalidation calls (i.e. traces) of a channel.
+        Until then the integer formats are converted with the stale scaling, so up to
+        scaling_revalidation traces may be scaled wrongly.
+
+        @param int channel: channel the scaling is requested for
+
+        @return tuple(float, float): gain and offset, volts = raw * gain + offset
+        """
+        if self._transfer_format == 'REAL,32':
+            return 1.0, 0.0
+        uses = self._scaling_uses.get(channel, 0) + 1
+        if 0 < self._scaling_revalidation <= uses:
+            self._scaling_cache.pop(channel, None)
+        scaling = self._scaling_cache.get(channel)
+        if scaling is None:
+            uses = 0
+            with self.threadlock:
+                # pending setting changes have to be applied before they are read back
+                self._rte.query('*OPC?')
+                scale = float(self._rte.query('CHAN{}:SCAL?'.format(channel)))
+                position = float(self._rte.query('CHAN{}:POS?'.format(channel)))
+                offset = float(self._rte.query('CHAN{}:OFFS?'.format(channel)))
+            scaling = (scale, offset - position * scale)
+            self._scaling_cache[channel] = scaling
+        self._scaling_uses[channel] = uses
+        scale, offset = scaling
+        return scale / self._lsb_per_division[self._transfer_format], offset
+
+    def get_transfer_format(self):
+        """ Return the waveform transfer format.
+
+        @return str: one of 'REAL,32', 'INT,16' or 'INT,8'
+        """
+        return self._transfer_format
+
+    def set_transfer_format(self, transfer_format):
+        """ Set the waveform transfer format.
+
+        @param str transfer_format: one of 'REAL,32', 'INT,16' or 'INT,8'
+
+        @return str: the transfer format actually set
+        """
+        if transfer_format not in self._transfer_formats:
+            self.log.error('Unknown transfer format "{0}", valid formats are {1}.'
+                           ''.format(transfer_format, list(self._transfer_formats)))
+        else:
+            self._transfer_format = transfer_format
+        return self._transfer_format
+
+    def get_traces(self, channels, out=None):
+        """ Acquire several channels from the same trigger event in a single transaction.
+
+        A single acquisition is started and the data queries of all channels are sent in the
+        same message behind *WAI, so no round trip is needed between the channels. The scope is
+        set back to continuous acquisition afterwards.
+
+        @param list channels: channels to read, e.g. [1, 2, 3, 4]
+        @param numpy.ndarray out: optional, C-contiguous float32 array of shape
+                                  (len(channels), record length) receiving the traces in V
+
+        @return tuple(numpy.ndarray, numpy.ndarray): shared time axis and 2D array of traces
+                                                     (channels x samples); (None, None) on error
+        """
+        channels = list(channels)
+        time_axis = self.get_xaxis(channels[0])
+        shape = (len(channels), len(time_axis))
+        if out is None:
+            out = np.empty(shape, dtype=np.float32)
+        elif out.shape != shape or out.dtype != np.float32 or not out.flags.c_contiguous:
+            self.log.error('Trace array must be a C-contiguous float32 array of shape {0}.'
+                           ''.format(shape))
+            return None, None
+
+        if self._transfer_format == 'REAL,32':
+            raw = out
+        else:
+            dtype = self._transfer_formats[self._transfer_format]
+            if self._raw_buffer.dtype != dtype or self._raw_buffer.size < out.size:
+                self._raw_buffer = np.empty(out.size, dtype=dtype)
+            raw = self._raw_buffer[:out.size].reshape(shape)
+            scalings = [self.get_scaling(channel) for channel in channels]
+
+        queries = ';:'.join('CHAN{0:d}:DATA?'.format(channel) for channel in channels)
+        with self.threadlock:
+            try:
+                self._rte.write('SING;*WAI;:FORM {0};:{1}'.format(self._transfer_format,
+                                                                   queries))
+                # read all blocks, even after an error, to leave a clean buffer behind
+                lengths = [self._read_trace_block(row) for row in raw]
+            finally:
+                # the single acquisition leaves the scope stopped, the other acquisition
+                # methods read from the running scope
+                self._rte.write('RUNContinous')
+
+        if any(length != shape[1] for length in lengths):
+            self.log.error('Expected {0:d} samples for each of the channels {1}, got {2}.'
+                           ''.format(shape[1], channels, lengths))
+            return None, None
+
+        if raw is not out:
+            for row, (gain, offset) in enumerate(scalings):
+                np.multiply(raw[row], gain, out=out[row])
+                out[row] += offset
+        return time_axis, out
+
+    def get_segments(self, channel, n_segments, out=None):
+        """ Capture n_segments triggered acquisitions in fast segmentation mode and download
+        them from the history as one contiguous block.
+
+        Segmentation, acquisition count and history replay are restored afterwards, also on
+        errors, and the scope is set back to continuous acquisition.
+
+        @param int channel: channel to read
+        @param int n_segments: number of triggered segments to capture
+        @param numpy.ndarray out: optional, C-contiguous float32 array of shape
+                                  (n_segments, record length) receiving the segments in V
+
+        @return tuple(numpy.ndarray, numpy.ndarray): time axis of a segment and 2D array of
+                                                     segments; (None, None) on error
+        """
+        time_axis = self.get_xaxis(channel)
+        shape = (n_segments, len(time_axis))
+        if out is None:
+            out = np.empty(shape, dtype=np.float32)
+        elif out.shape != shape or out.dtype != np.float32 or not out.flags.c_contiguous:
+            self.log.error('Segment array must be a C-contiguous float32 array of shape {0}.'
+                           ''.format(shape))
+            return None, None
+
+        if self._transfer_format == 'REAL,32':
+            raw = out
+        else:
+            dtype = self._transfer_formats[self._transfer_format]
+            if self._raw_buffer.dtype != dtype or self._raw_buffer.size < out.size:
+                self._raw_buffer = np.empty(out.size, dtype=dtype)
+            raw = self._raw_buffer[:out.size].reshape(shape)
+            gain, offset = self.get_scaling(channel)
+
+        with self.threadlock:
+            visa_timeout = self._rte.timeout
+            # capturing all segments takes as long as the triggers need to arrive
+            self._rte.timeout = max(visa_timeout, self._segment_timeout)
+            segmentation = self._rte.query('ACQ:SEGM:STAT?').strip()
+            count = self._rte.query('ACQ:COUN?').strip()
+            try:
+                self._rte.write('ACQ:SEGM:STAT ON;:ACQ:COUN {0:d}'.format(n_segments))
+                self._rte.query('RUNS;*OPC?')
+                # replay the history with data logging so the export holds all segments
+                self._rte.write('CHAN{0:d}:HIST:STAT ON;:CHAN{0:d}:HIST:STAR {1:d};'
+                                ':CHAN{0:d}:HIST:STOP 0'.format(channel, 1 - n_segments))
+                self._rte.write('EXP:WAV:SOUR C{0:d}W1;:EXP:WAV:DLOG ON'.format(channel))
+                self._rte.query('CHAN{0:d}:HIST:PLAY;*OPC?'.format(channel))
+                self._rte.write('FORM {0};:CHAN{1:d}:DATA?'.format(self._transfer_format,
+                                                                   channel))
+                n_samples = self._read_trace_block(raw.reshape(-1))
+            finally:
+                # otherwise the next trace is read from the history instead of the live data
+                self._rte.write('EXP:WAV:DLOG OFF;:CHAN{0:d}:HIST:STAT OFF;'
+                                ':ACQ:SEGM:STAT {1};:ACQ:COUN {2}'.format(channel, segmentation,
+                                                                        count))
+                self._rte.write('RUNContinous')
+                self._rte.query('*OPC?')
+                self._rte.timeout = visa_timeout
+
+        if n_samples != out.size:
+            self.log.error('Expected {0:d} segments of {1:d} samples, got {2:d} samples.'
+                           ''.format(shape[0], shape[1], n_samples))
+            return None, None
+
+        if raw is not out:
+            np.multiply(raw, gain, out=out)
+            out += offset
+        return time_axis, out
+
+    def _query_trace_into(self, buffer, channel):
+        """ Request a trace in the current transfer format and copy the block into buffer.
+
+        @param numpy.ndarray buffer: 1D, C-contiguous array of the transfer format dtype
+        @param int channel: channel to read from
+
+        @return int: number of samples written into buffer (-1: error)
+        """
+        with self.threadlock:
+            self._rte.write('FORM {0};:CHAN{1}:DATA?'.format(self._transfer_format, channel))
+            return self._read_trace_block(buffer)
+
+    def _read_trace_block(self, buffer):
+        """ Copy the next block of the current response into buffer, including its terminator.
+
+        @param numpy.ndarray buffer: 1D, C-contiguous array of the transfer format dtype
+
+        @return int: number of samples written into buffer (-1: error)
+        """
+        n_bytes = self._read_block_header()
+        raw = memoryview(buffer.view(np.uint8))
+        n_fit = min(n_bytes, raw.nbytes)
+        self._read_block_into(raw[:n_fit])
+        if n_fit < n_bytes:
+            # drain the rest of the block so the next query starts on a clean buffer
+            self._rte.read_bytes(n_bytes - n_fit)
+        # blocks are separated by a semicolon, the last one is terminated by a line feed
+        self._rte.read_bytes(1)
+
+        if n_fit < n_bytes:
+            self.log.error('Trace of {0:d} samples does not fit into buffer of size {1:d}.'
+                           ''.format(n_bytes // buffer.itemsize, buffer.size))
+            return -1
+
+        n_samples = n_fit // buffer.itemsize
+        # the scope sends big endian data, swap in place on little endian hosts
+        if buffer.itemsize > 1 and sys.byteorder == 'little':
+            buffer[:n_samples].byteswap(inplace=True)
+        return n_samples
+
+    def _read_block_header(self):
+        """ Read the header of an IEEE 488.2 definite length block.
+
+        @return int: number of data bytes following the header
+        """
+        header = self._rte.read_bytes(2)
+        if header[:1] != b'#' or header[1:2] == b'0':
+            raise visa.errors.InvalidBinaryFormat('Expected definite length block, got {0!r}'
+                                                  ''.format(header))
+        n_digits = int(header[1:2])
+        return int(self._rte.read_bytes(n_digits))
+
+    def _read_block_into(self, view):
+        """ Fill a writable memoryview with the next bytes of the current response.
+
+        @param memoryview view: byte view of the destination memory
+        """
+        received = 0
+        while received < view.nbytes:
+            chunk = self._rte.read_bytes(min(self._rte.chunk_size, view.nbytes - received))
+            view[received:received + len(chunk)] = chunk
+            received += len(chunk)
+
     def RunContinous(self, channel=1, refreshrate=None):
         """ SimpleDataInterface function to get the power from the scope """
         self._rte.write('RUNContinous')
         self._rte.query('*OPC?')
+        # the vertical settings may have been changed while the acquisition was stopped
+        self._scaling_cache.clear()
         '''
         if refreshrate is not None:
             self._measurement_timing = refreshrate
@@ -146,18 +464,22 @@ class OscilloscopeRS(OscilloscopeInterface):
 
     def SetVerticalScale(self, channel=1, scale=10e-3):
         self._rte.write('CHAN{0}:SCAL {1}'.format(channel, scale))
+        self._scaling_cache.pop(channel, None)
 
     def SetTimeBase(self, timebase=5e-3):
         self._rte.write('TIMebase:RANGe {}'.format(timebase))
+        self.resync_settings()
 
     def SetRecordLength(self, recordlength=1000):
         self._rte.write('ACQ:POIN {}'.format(recordlength))
         sleep(0.1)
+        self.resync_settings()
 
     def RunSingle(self, channel=1):
         #self._rte.write('RUNSingle')
         trace = self._rte.query_binary_values('FORM REAL,32;:CHAN{}:DATA?'.format(channel),
-                                              datatype='f', is_big_endian=True)
+                                              datatype='f', is_big_endian=True,
+                                              container=np.array)
         return trace    
 
     def RunSTOP(self):
@@ -170,9 +492,29 @@ class OscilloscopeRS(OscilloscopeInterface):
         return 0
 
     def get_xaxis(self, channel=1):
-        timebase = float(self._rte.query('TIMebase:RANGe?'))
-        self._rte.query('*OPC?')
-        recordlength = int(self._rte.query('CHAN{}:DATA:POIN?'.format(channel))) # Trace must be active to get accurate value
-        self._rte.query('*OPC?')
-        xaxis = np.linspace(-timebase/2, timebase/2, recordlength)
+        """ Return the time axis of a channel.
+
+        The axis is only queried from the scope the first time it is requested for a channel and
+        memoized afterwards. The cache is dropped by SetTimeBase, SetRecordLength and
+        resync_settings, the latter has to be called if settings were changed on the scope itself.
+
+        @param int channel: channel the time axis is requested for
+
+        @return numpy.ndarray: read-only time axis in s
+        """
+        xaxis = self._xaxis_cache.get(channel)
+        if xaxis is None:
+            with self.threadlock:
+                timebase = float(self._rte.query('TIMebase:RANGe?'))
+                self._rte.query('*OPC?')
+                recordlength = int(self._rte.query('CHAN{}:DATA:POIN?'.format(channel))) # Trace must be active to get accurate value
+                self._rte.query('*OPC?')
+            xaxis = np.linspace(-timebase/2, timebase/2, recordlength)
+            xaxis.flags.writeable = False
+            self._xaxis_cache[channel] = xaxis
         return xaxis
+
+    def resync_settings(self):
+        """ Drop all cached scope settings so they are queried again on next use. """
+        self._xaxis_cache.clear()
+        self._scaling_cache.clear()
@@ -28,13 +28,55 @@ from qudi.interface.oscilloscope_interface import OscilloscopeInterface
 
 
 class OscilloscopeRS(OscilloscopeInterface):
+    """ Dummy of the R&S oscilloscope simulating cavity transmission traces.
+
+    The simulator synthesizes a Lorentzian carrier and, on all channels but channel 1, the two
+    EOM sidebands with configurable linewidth, noise and drift of the carrier. Transfer latency
+    and bandwidth of the real instrument can be emulated, the time spent depends on the transfer
+    format. Traces are generated in place into the buffers passed by the caller, so it can drive
+    the full acquisition pipeline without hardware.
+
+    Example config for copy-paste:
+
+    rohdeschwarz_dummy:
+        module.Class: 'oscilloscope.rhode_schwarz_dummy.OscilloscopeRS'
+        options:
+            address: 'TCPIP::192.168.0.9::INSTR'
+            trace_length: 10000         # record length in samples, up to 10M
+            timebase: 20.0e-6            # s
+            linewidth: 0.2e-6           # HWHM of the resonances on the time axis in s
+            peak_height: 0.318          # V
+            sideband_offset: 2.0e-6      # distance of the sidebands from the carrier in s
+            sideband_ratio: 0.1         # sideband height relative to the carrier
+            noise_level: 2.0e-3          # V rms
+            drift: 0                    # rms random walk of the carrier per trace in s
+            transfer_latency: 0         # s per transaction
+            transfer_bandwidth: 0       # bytes/s, 0 for instant transfer
+    """
     _address = ConfigOption('address', missing='error')
     _rto = None
     _visa_timeout = ConfigOption('visa_timeout', default=1000.)
     _opc_timeout = ConfigOption('opc_timeout', default=3000.)
     _measurement_timing = ConfigOption('measurement_timing', default=300.)
-    _trace_length = 6000
-    _timebase = 20e-6
+    _transfer_format = ConfigOption('transfer_format', default='REAL,32')
+    _trace_length = ConfigOption('trace_length', default=6000)
+    _timebase = ConfigOption('timebase', default=20e-6)
+
+    # simulator settings
+    _linewidth = ConfigOption('linewidth', default=0.2e-6)
+    _peak_height = ConfigOption('peak_height', default=0.318)
+    _sideband_offset = ConfigOption('sideband_offset', default=2e-6)
+    _sideband_ratio = ConfigOption('sideband_ratio', default=0.1)
+    _noise_level = ConfigOption('noise_level', default=2e-3)
+    _drift = ConfigOption('drift', default=0.)
+    _transfer_latency = ConfigOption('transfer_latency', default=0.)
+    _transfer_bandwidth = ConfigOption('transfer_bandwidth', default=0.)
+
+    # bytes per sample, sample dtype and ADC levels per vertical division (10 divisions) per
+    # transfer format
+    _bytes_per_sample = {'REAL,32': 4, 'INT,16': 2, 'INT,8': 1}
+    _transfer_formats = {'REAL,32': np.float32, 'INT,16': np.int16, 'INT,8': np.int8}
+    _lsb_per_division = {'INT,16': 6476.8, 'INT,8': 25.3}
 
     sig_handle_timer = QtCore.Signal(bool, int)
 
@@ -42,11 +84,21 @@ class OscilloscopeRS(OscilloscopeInterface):
         super().__init__(config=config, **kwargs)
         
         self._current_trace = []
+        # memoized time axis per channel, see get_xaxis
+        self._xaxis_cache = dict()
+        # vertical scale per channel in V/div, used to emulate the integer transfer formats
+        self._vertical_scale = dict()
+        self._carrier_center = 0.
+        self._rng = np.random.default_rng()
+        # reusable scratch memory of the simulator
+        self._work = np.empty(0, dtype=np.float32)
+        self._raw_work = np.empty(0, dtype=np.float32)
 
     def on_activate(self):
         """ Activate module.
         """
-        pass
+        self._trace_length = int(self._trace_length)
+        self._carrier_center = 0.
 
     def on_deactivate(self):
         """ Deactivate module.
@@ -64,13 +116,126 @@ class OscilloscopeRS(OscilloscopeInterface):
     def getData_cont(self, channel):
         """ Generates a dummy trace.
 
-            @return ndarray: _trace_length value ndarray containing random trace
+            @return ndarray: _trace_length value ndarray containing the simulated trace
         """
-        trace = np.random.standard_cauchy(self._trace_length,)
+        trace = np.empty(self._trace_length, dtype=np.float32)
+        self.get_trace_into(trace, channel)
 
         self._current_trace = trace
         return self._current_trace
 
+    def get_trace_into(self, buffer, channel=1):
+        """ Generates a dummy trace directly into a preallocated buffer.
+
+        @param numpy.ndarray buffer: 1D float32 array receiving the samples
+        @param int channel: channel 1 gives a bare Lorentzian peak, others add sidebands
+
+        @return int: number of samples written into buffer (-1: error)
+        """
+        if buffer.size < self._trace_length:
+            self.log.error('Trace of {0:d} samples does not fit into buffer of size {1:d}.'
+                           ''.format(self._trace_length, buffer.size))
+            return -1
+        self._simulate_into(buffer[:self._trace_length], channel)
+        self._emulate_transfer(self._trace_length)
+        return self._trace_length
+
+    def get_raw_trace_into(self, buffer, channel=1):
+        """ Generates a dummy trace in the raw samples of the current transfer format.
+
+        The integer formats hold the ADC levels of the simulated trace, see get_scaling.
+
+        @param numpy.ndarray buffer: 1D, C-contiguous array with the dtype of the current
+                                     transfer format (float32, int16 or int8)
+        @param int channel: channel 1 gives a bare Lorentzian peak, others add sidebands
+
+        @return int: number of samples written into buffer (-1: error)
+        """
+        dtype = self._transfer_formats[self._transfer_format]
+        if buffer.dtype != dtype or buffer.ndim != 1 or not buffer.flags.c_contiguous:
+            self.log.error('Raw trace buffer must be a 1D, C-contiguous {0} array for transfer '
+                           'format {1}.'.format(np.dtype(dtype).name, self._transfer_format))
+            return -1
+        if buffer.size < self._trace_length:
+            self.log.error('Trace of {0:d} samples does not fit into buffer of size {1:d}.'
+                           ''.format(self._trace_length, buffer.size))
+            return -1
+        if dtype == np.float32:
+            self._simulate_into(buffer[:self._trace_length], channel)
+        else:
+            if self._raw_work.size < self._trace_length:
+                self._raw_work = np.empty(self._trace_length, dtype=np.float32)
+            volts = self._raw_work[:self._trace_length]
+            self._simulate_into(volts, channel)
+            gain, offset = self.get_scaling(channel)
+            volts /= gain
+            np.rint(volts, out=volts)
+            buffer[:self._trace_length] = volts
+        self._emulate_transfer(self._trace_length)
+        return self._trace_length
+
+    def get_scaling(self, channel=1):
+        """ Return the factors converting raw samples of the current transfer format into V.
+
+        @param int channel: channel the scaling is requested for
+
+        @return tuple(float, float): gain and offset, volts = raw * gain + offset
+        """
+        if self._transfer_format not in self._lsb_per_division:
+            return 1.0, 0.0
+        return (self._vertical_scale.get(channel, 0.1)
+                / self._lsb_per_division[self._transfer_format], 0.0)
+
+    def get_traces(self, channels, out=None):
+        """ Generates dummy traces for several channels sharing one time axis.
+
+        @param list channels: channels to generate, see get_trace_into
+        @param numpy.ndarray out: optional, float32 array of shape (len(channels), _trace_length)
+
+        @return tuple(numpy.ndarray, numpy.ndarray): time axis and 2D array of traces
+        """
+        channels = list(channels)
+        shape = (len(channels), self._trace_length)
+        if out is None:
+            out = np.empty(shape, dtype=np.float32)
+        elif out.shape != shape:
+            self.log.error('Trace array must be of shape {0}.'.format(shape))
+            return None, None
+        for row, channel in enumerate(channels):
+            self._simulate_into(out[row], channel)
+        self._emulate_transfer(out.size)
+        return self.get_xaxis(channels[0]), out
+
+    def get_segments(self, channel, n_segments, out=None):
+        """ Generates n_segments dummy sweeps of one channel.
+
+        @param int channel: channel to generate, see get_trace_into
+        @param int n_segments: number of segments
+        @param numpy.ndarray out: optional, float32 array of shape (n_segments, _trace_length)
+
+        @return tuple(numpy.ndarray, numpy.ndarray): time axis and 2D array of segments
+        """
+        shape = (n_segments, self._trace_length)
+        if out is None:
+            out = np.empty(shape, dtype=np.float32)
+        elif out.shape != shape:
+            self.log.error('Segment array must be of shape {0}.'.format(shape))
+            return None, None
+        for segment in out:
+            self._simulate_into(segment, channel)
+        self._emulate_transfer(out.size)
+        return self.get_xaxis(channel), out
+
+    def get_transfer_format(self):
+        return self._transfer_format
+
+    def set_transfer_format(self, transfer_format):
+        if transfer_format not in self._bytes_per_sample:
+            self.log.error('Unknown transfer format "{0}".'.format(transfer_format))
+        else:
+            self._transfer_format = transfer_format
+        return self._transfer_format
+
     def RunContinous(self, channel=1, refreshrate=None):
         """ SimpleDataInterface function to get the power from the scope """
         # self._rte.write('RUNContinous')
@@ -88,29 +253,26 @@ class OscilloscopeRS(OscilloscopeInterface):
 
     def SetVerticalScale(self, channel=1, scale=10e-3):
         # self._rte.write('CHAN{0}:SCAL {1}'.format(channel, scale))
-        pass
+        self._vertical_scale[channel] = scale
 
     def SetTimeBase(self, timebase=5e-3):
         # self._rte.write('TIMebase:RANGe {}'.format(timebase))
-        pass
+        self._timebase = timebase
+        self.resync_settings()
 
     def SetRecordLength(self, recordlength=1000):
         # self._rte.write('ACQ:POIN {}'.format(recordlength))
         # sleep(0.1)
-        pass
+        self._trace_length = int(recordlength)
+        self.resync_settings()
 
     def RunSingle(self, channel=1):
         """ Generates a dummy trace.
 
             @return ndarray: _trace_length value ndarray containing sample trace
         """
-        if channel == 1:
-            # Lorentzian peak without sidebands
-            trace = self.gen_trace(self.get_xaxis)
-        else:
-            # Lorentzian peak with sidebands
-            trace = self.gen_trace(self.get_xaxis, sidebands=True)
-
+        trace = np.empty(self._trace_length, dtype=np.float32)
+        self.get_trace_into(trace, channel)
         return trace    
 
     def RunSTOP(self):
@@ -122,39 +284,83 @@ class OscilloscopeRS(OscilloscopeInterface):
             self.module_state.stop()
         return 0
 
-    def get_xaxis(self):
-        # timebase = float(self._rte.query('TIMebase:RANGe?'))
-        # self._rte.query('*OPC?')
-        # recordlength = int(self._rte.query('ACQ:POIN?'))
-        # self._rte.query('*OPC?')
-        xaxis = np.linspace(-self._timebase/2, self._timebase/2, self._trace_length)
+    def get_xaxis(self, channel=1):
+        xaxis = self._xaxis_cache.get(channel)
+        if xaxis is None:
+            xaxis = np.linspace(-self._timebase/2, self._timebase/2, self._trace_length)
+            xaxis.flags.writeable = False
+            self._xaxis_cache[channel] = xaxis
         return xaxis
 
-    def gen_trace(self, x, sidebands = False):
-        # Parameters for the generated Lorentzian trace
-        amplitude = 0.2e-6
-        center = 0.0
-        gamma = 0.2e-6
-        noise_level = 2e-3
-    
-        # Retrieving x_values that fit with the timescale
-        x_values = np.linspace(-self._timebase/2, self._timebase/2, self._trace_length)
-        
-        #lorentzian_values = amplitude / np.pi * (gamma / ((x_values - center)**2 + gamma**2))  
-        # It is better to use the physical definition of the Lorentzian as it is the one used for the fit...
-        I = amplitude / (np.pi * gamma)
-        lorentzian_values = I * (gamma**2 / ((x_values - center)**2 + gamma**2))
-
-        # Add random noise
-        noise = np.random.normal(loc=0, scale=noise_level, size=self._trace_length)
-        trace = lorentzian_values + noise
+    def resync_settings(self):
+        """ Drop all cached scope settings so they are queried again on next use. """
+        self._xaxis_cache.clear()
 
-        # If sidebands, adding 20% amplitude sidebands at 15 gammas distance
-        if sidebands:
-            offset = 10 * gamma
-            sideband_1 = 0.1 * I * (gamma**2 / ((x_values - (center + offset))**2 + gamma**2))
-            sideband_2 = 0.1 * I * (gamma**2 / ((x_values - (center - offset))**2 + gamma**2))
+    def gen_trace(self, x=None, sidebands=False):
+        """ Generates a new dummy trace, see get_trace_into for the allocation free variant.
 
-            trace = trace + sideband_1 + sideband_2
+        @param x: unused, the time axis is given by the timebase and record length
+        @param bool sidebands: add the EOM sidebands to the carrier
 
+        @return ndarray: _trace_length value ndarray containing the simulated trace
+        """
+        trace = np.empty(self._trace_length, dtype=np.float32)
+        self._simulate_into(trace, 2 if sidebands else 1)
         return trace
+
+    def _simulate_into(self, out, channel):
+        """ Synthesize a transmission trace in place.
+
+        The resonances use the physical definition of the Lorentzian, the same one the fit uses:
+        height * linewidth^2 / ((x - center)^2 + linewidth^2).
+
+        @param numpy.ndarray out: float32 array of _trace_length samples
+        @param int channel: channel 1 gives a bare Lorentzian peak, others add sidebands
+        """
+        x = self.get_xaxis()
+        if self._work.size < out.size:
+            self._work = np.empty(out.size, dtype=np.float32)
+        work = self._work[:out.size]
+
+        # the carrier performs a random walk, kept within the central half of the sweep
+        if self._drift > 0:
+            self._carrier_center += self._rng.normal(scale=self._drift)
+            self._carrier_center = np.clip(self._carrier_center, -self._timebase / 4,
+                                           self._timebase / 4)
+        peaks = [(self._carrier_center, self._peak_height)]
+        if channel != 1:
+            sideband_height = self._sideband_ratio * self._peak_height
+            peaks.append((self._carrier_center - self._sideband_offset, sideband_height))
+            peaks.append((self._carrier_center + self._sideband_offset, sideband_height))
+
+        self._rng.standard_normal(dtype=np.float32, out=out)
+        out *= self._noise_level
+        gamma_sqr = self._linewidth ** 2
+        for center, height in peaks:
+            np.subtract(x, center, out=work, casting='same_kind')
+            np.square(work, out=work)
+            work += gamma_sqr
+            np.divide(height * gamma_sqr, work, out=work)
+            out += work
+
+        # emulate the ADC resolution of the integer transfer formats
+        if self._transfer_format in self._lsb_per_division:
+            lsb_per_division = self._lsb_per_division[self._transfer_format]
+            lsb = self.get_scaling(channel)[0]
+            levels = 5 * lsb_per_division
+            out /= lsb
+            np.rint(out, out=out)
+            np.clip(out, -levels, levels, out=out)
+            out *= lsb
+
+    def _emulate_transfer(self, n_samples):
+        """ Spend the time a transaction of n_samples would take over the instrument link.
+
+        @param int n_samples: number of samples transferred in one transaction
+        """
+        delay = self._transfer_latency
+        if self._transfer_bandwidth > 0:
+            delay += n_samples * self._bytes_per_sample[self._transfer_format] \
+                     / self._transfer_bandwidth
+        if delay > 0:
+            sleep(delay)
@@ -33,3 +33,88 @@ class OscilloscopeInterface(Base):
         """ Return a measured value """
         pass
 
+    @abstractmethod
+    def get_trace_into(self, buffer, channel):
+        """ Read the current trace of a channel directly into a preallocated buffer.
+
+        @param numpy.ndarray buffer: 1D, C-contiguous float32 array receiving the samples
+        @param int channel: channel to read from
+
+        @return int: number of samples written into buffer (-1: error)
+        """
+        pass
+
+    @abstractmethod
+    def get_raw_trace_into(self, buffer, channel):
+        """ Read the current trace of a channel without converting it to V.
+
+        @param numpy.ndarray buffer: 1D, C-contiguous array with the dtype of the current
+                                     transfer format (float32, int16 or int8)
+        @param int channel: channel to read from
+
+        @return int: number of samples written into buffer (-1: error)
+        """
+        pass
+
+    @abstractmethod
+    def get_scaling(self, channel):
+        """ Return the factors converting raw samples of the current transfer format into V.
+
+        @param int channel: channel the scaling is requested for
+
+        @return tuple(float, float): gain and offset, volts = raw * gain + offset
+        """
+        pass
+
+    @abstractmethod
+    def get_traces(self, channels, out=None):
+        """ Acquire several channels from the same trigger event.
+
+        The scope is left in continuous acquisition, as the other acquisition methods expect.
+
+        @param list channels: channels to read, e.g. [1, 2, 3, 4]
+        @param numpy.ndarray out: optional, C-contiguous float32 array of shape
+                                  (len(channels), record length) receiving the traces
+
+        @return tuple(numpy.ndarray, numpy.ndarray): shared time axis and 2D array of traces
+                                                     (channels x samples); (None, None) on error
+        """
+        pass
+
+    @abstractmethod
+    def get_segments(self, channel, n_segments, out=None):
+        """ Capture several triggered acquisitions of a channel and return them all at once.
+
+        The acquisition settings changed for the capture are restored and the scope is left in
+        continuous acquisition, as the other acquisition methods expect.
+
+        @param int channel: channel to read
+        @param int n_segments: number of triggered segments to capture
+        @param numpy.ndarray out: optional, C-contiguous float32 array of shape
+                                  (n_segments, record length) receiving the segments
+
+        @return tuple(numpy.ndarray, numpy.ndarray): time axis of a segment and 2D array of
+                                                     segments; (None, None) on error
+        """
+        pass
+
+    @abstractmethod
+    def get_transfer_format(self):
+        """ Return the waveform transfer format.
+
+        @return str: transfer format, e.g. 'REAL,32', 'INT,16' or 'INT,8'
+        """
+        pass
+
+    @abstractmethod
+    def set_transfer_format(self, transfer_format):
+        """ Set the waveform transfer format.
+
+        Integer formats reduce the amount of data sent per sample, the conversion to V is done
+        on the host.
+
+        @param str transfer_format: transfer format, e.g. 'REAL,32', 'INT,16' or 'INT,8'
+
+        @return str: the transfer format actually set
+        """
+        pass
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains a Qudi logic module benchmarking the acquisition, fit and save pipeline of the
+finesse measurement.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import datetime
+import json
+import os
+import platform
+import time
+
+import lmfit
+import numpy as np
+import scipy
+
+from qudi.core.connector import Connector
+from qudi.core.configoption import ConfigOption
+from qudi.util.mutex import Mutex
+from qudi.core.module import LogicBase
+
+
+class _StageTimer:
+    """ Collects the durations of the pipeline stages of one benchmark configuration. """
+
+    def __init__(self, stages):
+        self.samples = {stage: list() for stage in stages}
+
+    def timed(self, stage, func):
+        """ Wrap func so that every call adds its duration to stage. """
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.samples[stage].append(time.perf_counter() - start)
+        return wrapper
+
+    def clear(self):
+        for samples in self.samples.values():
+            samples.clear()
+
+    def add(self, stage, duration):
+        self.samples[stage].append(duration)
+
+    def mark(self):
+        """ Number of samples recorded so far per stage, to be passed to since. """
+        return {stage: len(samples) for stage, samples in self.samples.items()}
+
+    def since(self, stage, mark):
+        """ Total duration recorded for stage after mark was taken. """
+        return sum(self.samples[stage][mark[stage]:])
+
+    def summary(self, percentiles):
+        """ Latency statistics of all stages in ms, stages that did not run are omitted. """
+        summary = dict()
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            samples_ms = np.asarray(samples) * 1e3
+            stats = {'count': len(samples_ms),
+                     'mean': float(np.mean(samples_ms)),
+                     'max': float(np.max(samples_ms))}
+            for percentile in percentiles:
+                stats['p{0:g}'.format(percentile)] = float(np.percentile(samples_ms, percentile))
+            summary[stage] = stats
+        return summary
+
+
+class FinesseBenchmarkLogic(LogicBase):
+    """ Headless throughput benchmark of the finesse measurement pipeline.
+
+    The benchmark runs the acquisition, fit and save stages of FinesseLogic back to back on the
+    connected oscilloscope (usually the dummy scope) and sweeps record length, fit function and
+    pre-fit on/off. For every configuration the latency percentiles of each stage and the
+    sustained trace rate are reported. The result is written as JSON, so runs before and after a
+    change of finesse_logic.py or the fit methods can be compared.
+
+    Start qudi without GUI, activate this module and call run_benchmark() from the console or a
+    notebook.
+
+    The stages are:
+        transfer:     get_trace_into of the oscilloscope
+        x_axis:       get_xaxis of the oscilloscope
+        pre_fit:      peak detection pre-fit of FinesseLogic (only with pre-fit on)
+        estimator:    estimator of the fit
+        minimize:     minimization of the fit backend (FitLogic._fit_model), summed over both
+                      attempts if a warm started fit falls back
+        model_eval:   evaluation of the lazy fit curve returned by do_fit at the resolution
+                      of a plot (model_eval_points), as done by the GUI
+        finesse_calc: finesse calculation from the fit result
+        save:         FinesseLogic.save_data, i.e. handing the trace to the save queue (only with
+                      save_traces)
+        total:        all of the above
+
+    With warm start enabled in the fit container, the number of warm started fits that were
+    accepted (warm_start_hits) and that fell back to the estimator (warm_start_fallbacks) is
+    reported per configuration as well.
+
+    Example config for copy-paste:
+
+    finessebenchmarklogic:
+        module.Class: 'finesse_benchmark_logic.FinesseBenchmarkLogic'
+        connect:
+            finesselogic: 'finesselogic'
+            fitlogic: 'fitlogic'
+            savelogic: 'savelogic'
+            oscilloscope: 'rohdeschwarz_dummy'
+        options:
+            record_lengths: [1000, 10000, 100000]
+            fit_functions: ['Lorentzian peak', 'Lorentzian peak with sidebands']
+            n_traces: 20
+            warmup_traces: 2
+            save_traces: True
+            channel: 2                  # the dummy scope shows the sidebands on channels > 1
+            model_eval_points: 1000     # points of the fit curve, about the width of the plot
+    """
+
+    # declare connectors
+    finesselogic = Connector(interface='FinesseLogic')
+    fitlogic = Connector(interface='FitLogic')
+    savelogic = Connector(interface='SaveLogic')
+    oscilloscope = Connector(interface='OscilloscopeInterface')
+
+    # config options
+    _record_lengths = ConfigOption('record_lengths', [1000, 10000, 100000])
+    _fit_functions = ConfigOption('fit_functions',
+                                  ['Lorentzian peak', 'Lorentzian peak with sidebands'])
+    _n_traces = ConfigOption('n_traces', 20)
+    _warmup_traces = ConfigOption('warmup_traces', 2)
+    _save_traces = ConfigOption('save_traces', True)
+    _channel = ConfigOption('channel', 2)
+    _percentiles = ConfigOption('percentiles', [50, 90, 99])
+    _model_eval_points = ConfigOption('model_eval_points', 1000)
+
+    _stages = ('transfer', 'x_axis', 'pre_fit', 'estimator', 'minimize', 'model_eval',
+               'finesse_calc', 'save', 'total')
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        # locking for thread safety
+        self.threadlock = Mutex()
+        self.last_result = None
+
+    def on_activate(self):
+        """ Initialisation performed during activation of the module.
+        """
+        self._finesse_logic = self.finesselogic()
+        self._oscilloscope = self.oscilloscope()
+        self._save_logic = self.savelogic()
+
+    def on_deactivate(self):
+        """ Deinitialisation performed during deactivation of the module.
+        """
+        pass
+
+    def run_benchmark(self, record_lengths=None, fit_functions=None, pre_fit=(False, True),
+                      n_traces=None, save_traces=None, filepath=None):
+        """ Sweep the benchmark configurations and write the result as JSON.
+
+        @param list record_lengths: optional, record lengths in samples to sweep
+        @param list fit_functions: optional, names of the configured fits in FinesseLogic
+        @param tuple pre_fit: pre-fit settings to sweep, pre-fit on is only run for the fits
+                              supporting it
+        @param int n_traces: optional, number of timed traces per configuration
+        @param bool save_traces: optional, include FinesseLogic.save_data in the pipeline
+        @param str filepath: optional, JSON file to write, defaults to a file in the daily
+                             directory of the save logic
+
+        @return dict: metadata and one entry per configuration with the trace rate and the
+                      latency statistics in ms of every stage
+        """
+        record_lengths = self._record_lengths if record_lengths is None else record_lengths
+        fit_functions = self._fit_functions if fit_functions is None else fit_functions
+        n_traces = self._n_traces if n_traces is None else int(n_traces)
+        save_traces = self._save_traces if save_traces is None else bool(save_traces)
+
+        with self.threadlock:
+            if self.module_state() == 'locked':
+                self.log.error('Benchmark is already running.')
+                return None
+            self.module_state.lock()
+        try:
+            if self._finesse_logic.enabled:
+                self._finesse_logic.stop_acquisition()
+            self._finesse_logic.calc_FSR(self._finesse_logic.cavity_length,
+                                         self._finesse_logic.cavity_error)
+            initial_record_length = len(self._oscilloscope.get_xaxis(self._channel))
+            initial_fit = self._finesse_logic.fc.current_fit
+
+            results = list()
+            try:
+                for record_length in record_lengths:
+                    for fit_function in fit_functions:
+                        if fit_function not in self._finesse_logic.get_fit_functions():
+                            self.log.warning('Fit function "{0}" not available in Finesse fit '
+                                             'container, skipped.'.format(fit_function))
+                            continue
+                        for use_pre_fit in pre_fit:
+                            if use_pre_fit and fit_function not in ['Lorentzian peak with sidebands']:
+                                continue
+                            results.append(self._run_configuration(
+                                int(record_length), fit_function, bool(use_pre_fit), n_traces,
+                                save_traces))
+            finally:
+                self._oscilloscope.SetRecordLength(initial_record_length)
+                self._finesse_logic.fc.set_current_fit(initial_fit)
+
+            self.last_result = {'metadata': self._get_metadata(), 'results': results}
+            self._write_result(self.last_result, filepath)
+        finally:
+            self.module_state.unlock()
+        return self.last_result
+
+    def _run_configuration(self, record_length, fit_function, pre_fit, n_traces, save_traces):
+        """ Time the pipeline for a single configuration.
+
+        The fit stages are timed by temporarily wrapping the estimator entry of the fit container
+        and by the fit_model_timer of the fit logic, so the code paths of FitContainer.do_fit are
+        measured unchanged.
+        """
+        finesse = self._finesse_logic
+        fc = finesse.fc
+        timer = _StageTimer(self._stages + ('fit_model', ))
+        fit_logic = self.fitlogic()
+
+        self._oscilloscope.SetRecordLength(record_length)
+        buffer = np.empty(record_length, dtype=np.float32)
+        fit_entry = fc.fit_list[fit_function]
+        # the parameter use settings are usually set up by the fit settings dialog of the GUI
+        fit_entry.setdefault('use_settings', {name: False for name in fit_entry['parameters']})
+        fc.set_current_fit(fit_function)
+        fc.fit_list[fit_function] = dict(fit_entry,
+                                         estimator=timer.timed('estimator', fit_entry['estimator']))
+        fit_logic.fit_model_timer = lambda duration: timer.add('fit_model', duration)
+
+        failed_fits = 0
+        warm_start_hits = 0
+        warm_start_fallbacks = 0
+        timed_traces = 0
+        start_time = time.perf_counter()
+        try:
+            for ii in range(self._warmup_traces + n_traces):
+                if ii == self._warmup_traces:
+                    # drop the samples of the warm-up traces
+                    timer.clear()
+                    failed_fits = 0
+                    warm_start_hits = 0
+                    warm_start_fallbacks = 0
+                    start_time = time.perf_counter()
+                trace_start = time.perf_counter()
+
+                start = time.perf_counter()
+                n_samples = self._oscilloscope.get_trace_into(buffer, self._channel)
+                timer.add('transfer', time.perf_counter() - start)
+                if n_samples < 0:
+                    self.log.error('Trace transfer failed, benchmark configuration aborted.')
+                    break
+
+                start = time.perf_counter()
+                time_axis = self._oscilloscope.get_xaxis(self._channel)
+                timer.add('x_axis', time.perf_counter() - start)
+                trace = buffer[:n_samples]
+
+                if pre_fit:
+                    start = time.perf_counter()
+                    finesse.do_pre_fit(time_axis, trace)
+                    fc.set_current_fit(fit_function)
+                    timer.add('pre_fit', time.perf_counter() - start)
+
+                # a warm started fit skips the estimator and a fallback fits twice, so the
+                # stages are summed over all calls made during this trace
+                mark = timer.mark()
+                warm_started = fc.will_warm_start(fit_function)
+                fallbacks = fc.warm_start_fallbacks
+                try:
+                    fit_x, fit_y, result = fc.do_fit(time_axis, trace)
+                except ValueError:
+                    self.log.exception('Fit of benchmark trace failed:')
+                    result = None
+                timer.add('minimize', timer.since('fit_model', mark))
+                if result is not None:
+                    # do_fit only returns the lazy fit curve, it is evaluated by the consumer
+                    start = time.perf_counter()
+                    fit_y.curve.evaluate(self._model_eval_points)
+                    timer.add('model_eval', time.perf_counter() - start)
+                if fc.warm_start_fallbacks > fallbacks:
+                    warm_start_fallbacks += 1
+                elif warm_started:
+                    warm_start_hits += 1
+
+                if result is None:
+                    failed_fits += 1
+                else:
+                    start = time.perf_counter()
+                    finesse.result_str_dict = result.result_str_dict
+                    try:
+                        finesse.cavity_finesse, finesse.cavity_finesse_error = finesse.finesse(
+                            fit_function)
+                    except (KeyError, TypeError, ZeroDivisionError):
+                        failed_fits += 1
+                    timer.add('finesse_calc', time.perf_counter() - start)
+
+                if save_traces:
+                    start = time.perf_counter()
+                    finesse.set_current_trace(trace, time_axis)
+                    finesse.save_data(tag='benchmark')
+                    timer.add('save', time.perf_counter() - start)
+
+                timer.add('total', time.perf_counter() - trace_start)
+                if ii >= self._warmup_traces:
+                    timed_traces += 1
+        finally:
+            fc.fit_list[fit_function] = fit_entry
+            fit_logic.fit_model_timer = None
+        if save_traces:
+            # the sustained rate includes writing the traces still queued in the save logic
+            self._save_logic.flush()
+        elapsed = time.perf_counter() - start_time
+
+        del timer.samples['fit_model']
+        return {'record_length': record_length,
+                'fit_function': fit_function,
+                'pre_fit': pre_fit,
+                'n_traces': timed_traces,
+                'failed_fits': failed_fits,
+                'warm_start_hits': warm_start_hits,
+                'warm_start_fallbacks': warm_start_fallbacks,
+                'traces_per_s': timed_traces / elapsed if timed_traces > 0 else None,
+                'latency_ms': timer.summary(self._percentiles)}
+
+    def _get_metadata(self):
+        return {'timestamp': datetime.datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'numpy': np.__version__,
+                'scipy': scipy.__version__,
+                'lmfit': lmfit.__version__,
+                'oscilloscope': type(self._oscilloscope).__name__,
+                'transfer_format': self._oscilloscope.get_transfer_format(),
+                'reference_channel': self._finesse_logic.reference_channel,
+                'fit_settings': self.fitlogic().fit_settings()}
+
+    def _write_result(self, result, filepath=None):
+        if filepath is None:
+            filepath = os.path.join(
+                self._save_logic.get_path_for_module('FinesseBenchmark'),
+                datetime.datetime.now().strftime('%Y%m%d-%H%M-%S_finesse_benchmark.json'))
+        with open(filepath, 'w') as file:
+            json.dump(result, file, indent=2)
+        self.log.info('Benchmark result written to {0}'.format(filepath))
+        return filepath
@@ -21,6 +21,7 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 import datetime
 from errno import EEXIST
+import threading
 import time
 from xmlrpc.client import Boolean
 
@@ -43,6 +44,302 @@ from qudi.util.network import netobtain
 from qudi.core.module import LogicBase
 
 
+def _normalize_transmission(signal, reference, out=None):
+    """ Divide a transmission trace by the trace of the reference arm in a single pass.
+
+    @param numpy.ndarray signal: transmission trace
+    @param numpy.ndarray reference: reference arm trace of the same acquisition
+    @param numpy.ndarray out: optional, array receiving the normalized trace
+
+    @return numpy.ndarray: normalized transmission, inf/nan where the reference is zero
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.divide(signal, reference, out=out)
+
+
+class TraceRingBuffer:
+    """ Fixed capacity ring buffer of preallocated float32 traces.
+
+    A single producer claims the next slot, fills it in place and commits it. Consumers take
+    views of the newest (latest) or the next unread trace (get_next) without copying. Producer
+    and consumers are kept apart by sequence numbers instead of locks: a view obtained for
+    sequence number seq stays untouched as long as is_valid(seq) is True, i.e. until the
+    producer has lapped it.
+
+    Every acquisition loop has its own generation. Commits of a loop whose generation is not
+    the current one of the buffer (set by clear) are rejected, so a loop still finishing a
+    transfer can not publish an old trace after a restart.
+    """
+
+    def __init__(self, capacity):
+        """ @param int capacity: number of traces kept, at least 2 """
+        self.capacity = max(2, int(capacity))
+        self._traces = [np.empty(0, dtype=np.float32) for _ in range(self.capacity)]
+        self._time_axes = [None] * self.capacity
+        self._lengths = [0] * self.capacity
+        self._generation = 0
+        self.clear()
+
+    def clear(self, generation=None):
+        """ Forget all traces and reset the counters. The allocated memory is kept.
+
+        @param int generation: optional, generation of the acquisition loop allowed to commit
+        """
+        if generation is not None:
+            self._generation = generation
+        # sequence number of the next trace to be written
+        self._write_seq = 0
+        # sequence number of the next trace not yet taken by any consumer
+        self._read_seq = 0
+        # traces committed while the buffer was full of unread traces
+        self.overruns = 0
+        # traces never taken by any consumer
+        self.dropped = 0
+
+    def claim(self, size):
+        """ Return the buffer of the next slot to be written by the producer.
+
+        @param int size: number of samples the buffer must hold
+
+        @return numpy.ndarray: float32 buffer of at least size samples
+        """
+        slot = self._write_seq % self.capacity
+        if self._traces[slot].size < size:
+            self._traces[slot] = np.empty(size, dtype=np.float32)
+        return self._traces[slot]
+
+    def commit(self, length, time_axis, generation=None):
+        """ Publish the slot previously returned by claim.
+
+        @param int length: number of valid samples written into the slot
+        @param numpy.ndarray time_axis: time axis belonging to the trace
+        @param int generation: optional, generation of the committing acquisition loop
+
+        @return int: sequence number of the committed trace, -1 if the generation is outdated
+        """
+        if generation is not None and generation != self._generation:
+            return -1
+        seq = self._write_seq
+        slot = seq % self.capacity
+        self._lengths[slot] = length
+        self._time_axes[slot] = time_axis
+        if seq - self._read_seq >= self.capacity:
+            self.overruns += 1
+        self._write_seq = seq + 1
+        return seq
+
+    def latest(self):
+        """ Take the newest trace, skipping all unread older ones.
+
+        @return tuple(int, numpy.ndarray, numpy.ndarray): sequence number, time axis and trace
+                                                          view; (-1, None, None) if empty
+        """
+        seq = self._write_seq - 1
+        if seq < 0:
+            return -1, None, None
+        if seq >= self._read_seq:
+            self.dropped += seq - self._read_seq
+            self._read_seq = seq + 1
+        return (seq, ) + self._view(seq)
+
+    def get_next(self):
+        """ Take the oldest unread trace still held in the buffer.
+
+        @return tuple(int, numpy.ndarray, numpy.ndarray): sequence number, time axis and trace
+                                                          view; (-1, None, None) if none unread
+        """
+        write_seq = self._write_seq
+        if self._read_seq >= write_seq:
+            return -1, None, None
+        oldest = write_seq - self.capacity + 1
+        if self._read_seq < oldest:
+            self.dropped += oldest - self._read_seq
+            self._read_seq = oldest
+        seq = self._read_seq
+        self._read_seq = seq + 1
+        return (seq, ) + self._view(seq)
+
+    def is_valid(self, seq):
+        """ Check if the trace with sequence number seq has not been overwritten yet.
+
+        @param int seq: sequence number returned by latest or get_next
+
+        @return bool: True if views of this trace still hold its data
+        """
+        return 0 <= seq and self._write_seq - seq < self.capacity
+
+    def get_statistics(self):
+        """ @return dict: number of written, overrun and dropped traces """
+        return {'written': self._write_seq, 'overruns': self.overruns, 'dropped': self.dropped}
+
+    def _view(self, seq):
+        slot = seq % self.capacity
+        return self._time_axes[slot], self._traces[slot][:self._lengths[slot]]
+
+
+class TraceAcquisitionWorker(QtCore.QObject):
+    """ Helper class pulling traces from the oscilloscope into a ring buffer in a separate thread.
+    """
+
+    # signal to deliver the sequence number of each committed trace
+    sig_new_trace = QtCore.Signal(int)
+
+    def __init__(self, oscilloscope, ring_buffer, log):
+        super().__init__()
+        self._oscilloscope = oscilloscope
+        self._ring_buffer = ring_buffer
+        self.log = log
+        # reusable (signal, reference) array for normalized acquisition
+        self._channel_buffer = np.empty((2, 0), dtype=np.float32)
+        # a running loop stops as soon as the generation does not match its own anymore
+        self._generation = 0
+        self._wakeup = threading.Event()
+        # cleared while an acquisition loop is running
+        self._idle = threading.Event()
+        self._idle.set()
+
+    def next_generation(self):
+        """ Stop a running acquisition loop and return the generation for the next one.
+
+        Can be called from any thread.
+
+        @return int: generation to pass to run
+        """
+        self._generation += 1
+        self._wakeup.set()
+        return self._generation
+
+    def wait_stopped(self, timeout=None):
+        """ Wait until a loop stopped by next_generation has finished its current transfer.
+
+        Can be called from any thread but the one of the worker.
+
+        @param float timeout: optional, maximum time to wait in s
+
+        @return bool: True if no acquisition loop is running
+        """
+        return self._idle.wait(timeout)
+
+    @QtCore.Slot(int, int, float, int)
+    def run(self, channel, reference_channel, period, generation):
+        """ Threaded acquisition loop, runs until the generation is changed.
+
+        @param int channel: oscilloscope channel to read
+        @param int reference_channel: channel of the reference arm the trace is normalized to,
+                                      0 to disable normalization
+        @param float period: minimum time between two traces in s
+        @param int generation: generation obtained from next_generation
+        """
+        # cleared before the generation is checked, so a caller of wait_stopped either sees
+        # the loop running or the loop sees the new generation
+        self._idle.clear()
+        try:
+            while generation == self._generation:
+                start = time.perf_counter()
+                try:
+                    time_axis = self._oscilloscope.get_xaxis(channel)
+                    buffer = self._ring_buffer.claim(len(time_axis))
+                    if reference_channel > 0:
+                        n_samples = self._read_normalized_into(buffer, channel,
+                                                               reference_channel,
+                                                               len(time_axis))
+                    else:
+                        n_samples = self._oscilloscope.get_trace_into(buffer, channel)
+                except Exception:
+                    self.log.exception('Trace acquisition failed, stopping acquisition loop.')
+                    break
+                if n_samples > 0:
+                    seq = self._ring_buffer.commit(n_samples, time_axis, generation)
+                    if seq >= 0:
+                        self.sig_new_trace.emit(seq)
+                remaining = period - (time.perf_counter() - start)
+                if remaining > 0:
+                    self._wakeup.wait(remaining)
+                    self._wakeup.clear()
+        finally:
+            self._idle.set()
+
+    def _read_normalized_into(self, buffer, channel, reference_channel, n_samples):
+        """ Acquire signal and reference channel together and store their ratio in buffer.
+
+        @return int: number of samples written into buffer (-1: error)
+        """
+        if self._channel_buffer.shape != (2, n_samples):
+            self._channel_buffer = np.empty((2, n_samples), dtype=np.float32)
+        time_axis, traces = self._oscilloscope.get_traces((channel, reference_channel),
+                                                          out=self._channel_buffer)
+        if traces is None:
+            return -1
+        _normalize_transmission(traces[0], traces[1], out=buffer[:n_samples])
+        return n_samples
+
+
+class FitWorker(QtCore.QObject):
+    """ Helper class running the fits of FinesseLogic in a separate thread.
+
+    Fits are executed with latest-wins semantics: at most one trace is waiting to be fitted. A
+    trace submitted while a fit is still running replaces the pending one, which is dropped
+    instead of being queued up.
+    """
+
+    # signal to deliver the trace id and the result of each fit
+    sig_fit_done = QtCore.Signal(int, dict)
+    _sig_wakeup = QtCore.Signal()
+
+    def __init__(self, fit_method, log):
+        """
+        @param callable fit_method: fit routine, called with the keyword arguments passed to
+                                    submit and returning the result dict
+        @param log: logger to report failing fits to
+        """
+        super().__init__()
+        self._fit_method = fit_method
+        self.log = log
+        self._lock = threading.Lock()
+        self._pending = None
+        self._busy = False
+        # pending traces superseded before their fit was started
+        self.dropped = 0
+        self._sig_wakeup.connect(self._process, QtCore.Qt.QueuedConnection)
+
+    def submit(self, trace_id, **kwargs):
+        """ Schedule the fit of a trace, replacing the pending one. Can be called from any thread.
+
+        @param int trace_id: id of the trace, handed back with the result
+        @param kwargs: keyword arguments for the fit routine
+        """
+        with self._lock:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (trace_id, kwargs)
+            if self._busy:
+                return
+            self._busy = True
+        self._sig_wakeup.emit()
+
+    def cancel(self):
+        """ Drop the pending fit, a running fit is finished. """
+        with self._lock:
+            self._pending = None
+
+    @QtCore.Slot()
+    def _process(self):
+        """ Fit pending traces until there is none left. """
+        while True:
+            with self._lock:
+                if self._pending is None:
+                    self._busy = False
+                    return
+                trace_id, kwargs = self._pending
+                self._pending = None
+            try:
+                result = self._fit_method(**kwargs)
+            except Exception:
+                self.log.exception('Fit of trace {0} failed:'.format(trace_id))
+                continue
+            self.sig_fit_done.emit(trace_id, result)
+
+
 class FinesseLogic(LogicBase):
     # declare connectors
     oscilloscope = Connector(interface='OscilloscopeInterface')
@@ -51,6 +348,8 @@ class FinesseLogic(LogicBase):
 
     # config options
     _logic_acquisition_timing = ConfigOption('logic_acquisition_timing', 20.0, missing='warn')
+    _trace_buffer_size = ConfigOption('trace_buffer_size', 8)
+    _acquisition_stop_timeout = ConfigOption('acquisition_stop_timeout', 5.0)
     fc = StatusVar('fits', None)
     cavity_length = StatusVar('cavity_length', 460) # µm
     cavity_error = StatusVar('cavity_error', 0.02) # µm
@@ -60,14 +359,24 @@ class FinesseLogic(LogicBase):
     eom_frequency = StatusVar('eom_frequency', 1004) # MHz
     time_base = StatusVar('time_base', 5e-3)
     current_channel = StatusVar('current_channel', 1)
+    reference_channel = StatusVar('reference_channel', 0)
     vertical_scale = StatusVar('vertical_scale', 20e-3)
     record_length = StatusVar('record_length', 10000)
+    burst_segments = StatusVar('burst_segments', 1000)
+    transfer_format = StatusVar('transfer_format', 'REAL,32')
+    warm_start = StatusVar('warm_start', False)
+    roi = StatusVar('roi', False)
+    roi_linewidths = StatusVar('roi_linewidths', 10.0)
+    roi_decimation = StatusVar('roi_decimation', 'minmax')
     dirname = StatusVar('directory name', 'none')
 
     # signals
     sigUpdateGui = QtCore.Signal()
     sig_handle_timer = QtCore.Signal(bool, int)
-    sig_fit_updated = QtCore.Signal()
+    sig_start_acquisition_loop = QtCore.Signal(int, int, float, int)
+    sig_fit_updated = QtCore.Signal(int, dict)
+    sig_burst_updated = QtCore.Signal(dict)
+    _sig_burst_fitted = QtCore.Signal(dict)
     sig_Parameter_Updated = QtCore.Signal(dict)
 
     def __init__(self, **kwargs):
@@ -76,6 +385,13 @@ class FinesseLogic(LogicBase):
         # locking for thread safety
         self.threadlock = Mutex()
         self._current_trace = []
+        self._current_trace_seq = -1
+        # id of the trace currently shown, handed back with its fit result
+        self._trace_id = 0
+        # serializes the use of the fit container by the fit worker and burst fits
+        self._fit_lock = Mutex()
+        # HDF5 run store every trace and fit result is appended to, see start_run
+        self._run = None
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
@@ -86,13 +402,31 @@ class FinesseLogic(LogicBase):
         self._fit_logic = self.fitlogic()
 
         self.stopRequested = False
+        self.transfer_format = self._oscilloscope.set_transfer_format(self.transfer_format)
+        self.fc.set_warm_start(self.warm_start)
+        self.fc.set_roi(self.roi, self.roi_linewidths, self.roi_decimation)
         #self.scope_stetting(self.time_base, self.record_length, self.vertical_scale)
 
         self.enabled = False
-        self.timer = QtCore.QTimer()
-        self.timer.setSingleShot(True)
-        self.timer.setInterval(self.refresh_timing/1000)
-        self.timer.timeout.connect(self.acq_loop)
+        # traces are pulled into a ring buffer by a producer running in its own thread
+        self._trace_ring = TraceRingBuffer(self._trace_buffer_size)
+        self._acquisition_thread = QtCore.QThread()
+        self._acquisition_worker = TraceAcquisitionWorker(self._oscilloscope, self._trace_ring,
+                                                          self.log)
+        self._acquisition_worker.moveToThread(self._acquisition_thread)
+        self.sig_start_acquisition_loop.connect(self._acquisition_worker.run)
+        self._acquisition_worker.sig_new_trace.connect(self._handle_new_trace,
+                                                       QtCore.Qt.QueuedConnection)
+        self._acquisition_thread.start()
+
+        # fits run in their own thread, so slow fits never stall acquisition or GUI
+        self._fit_thread = QtCore.QThread()
+        self._fit_worker = FitWorker(self._fit_trace, self.log)
+        self._fit_worker.moveToThread(self._fit_thread)
+        self._fit_worker.sig_fit_done.connect(self._handle_fit_result,
+                                              QtCore.Qt.QueuedConnection)
+        self._fit_thread.start()
+        self._sig_burst_fitted.connect(self._handle_burst_result, QtCore.Qt.QueuedConnection)
 
     def on_deactivate(self):
         """ Deinitialisation performed during deactivation of the module.
@@ -109,44 +443,156 @@ class FinesseLogic(LogicBase):
                                'running but can not be stopped after 30 sec.')
                 break
 
+        self.stop_acquisition()
+        self._acquisition_thread.quit()
+        self._acquisition_thread.wait()
+        self.sig_start_acquisition_loop.disconnect()
+        self._acquisition_worker.sig_new_trace.disconnect()
+        self._fit_worker.cancel()
+        self._fit_thread.quit()
+        self._fit_thread.wait()
+        self._fit_worker.sig_fit_done.disconnect()
+        self._sig_burst_fitted.disconnect()
         self._oscilloscope.RunSTOP()
+        self.stop_run()
 
     ########################################################################
     #                       Hardware control                               #
     ########################################################################
     def handle_trace(self, trace):
-        self._current_trace = np.array(trace)
+        self._current_trace = np.asarray(trace)
+        self._trace_id += 1
         self.sigUpdateGui.emit()
 
+    def set_current_trace(self, trace, time_axis=None):
+        """ Show a trace which is not held by the ring buffer, e.g. a single or burst trace.
+
+        @param numpy.ndarray trace: the trace
+        @param numpy.ndarray time_axis: optional, time axis of the trace, defaults to the current
+        """
+        if time_axis is not None:
+            self.time_axis = time_axis
+        self._current_trace_seq = -1
+        self.handle_trace(trace)
+
+    def get_current_trace(self):
+        """ Return a copy of the current trace.
+
+        The current trace of a running acquisition is a view of the ring buffer, which the
+        acquisition overwrites once it has lapped it. The copy is only returned if the trace was
+        still valid after copying.
+
+        @return numpy.ndarray: copy of the current trace, None if it has been overwritten
+        """
+        trace = np.array(self._current_trace)
+        if self._current_trace_seq >= 0 and not self._trace_ring.is_valid(self._current_trace_seq):
+            return None
+        return trace
+
     def get_single_trace(self, channel=1):
-        self.time_axis = self._oscilloscope.get_xaxis()
-        trace = self._oscilloscope.RunSingle(channel)
-        self._current_trace = np.array(trace)
-        self.sigUpdateGui.emit()
-    
+        if self.reference_channel > 0:
+            time_axis, traces = self._oscilloscope.get_traces((channel, self.reference_channel))
+            if traces is None:
+                return
+            self.time_axis = time_axis
+            trace = _normalize_transmission(traces[0], traces[1], out=traces[0])
+        else:
+            self.time_axis = self._oscilloscope.get_xaxis(channel)
+            trace = self._oscilloscope.RunSingle(channel)
+        self.set_current_trace(trace)
+
+    def set_reference_channel(self, channel):
+        """ Normalize the transmission to a reference arm recorded on another channel.
+
+        Signal and reference are acquired from the same trigger event in a single transaction.
+
+        @param int channel: channel of the reference arm, 0 to disable normalization
+        """
+        self.reference_channel = max(0, int(channel))
+        return self.reference_channel
+
+    def _handle_new_trace(self, seq):
+        """ Show the newest trace of the ring buffer.
+
+        Notifications queued up while the consumers were busy are coalesced, i.e. only the
+        newest trace is handled and the superseded ones are counted as dropped.
+        """
+        seq, time_axis, trace = self._trace_ring.latest()
+        if seq < 0 or seq == self._current_trace_seq:
+            return
+        self._current_trace_seq = seq
+        self.time_axis = time_axis
+        self.handle_trace(trace)
+        if self._run is not None:
+            self._append_to_run()
+
     def start_acquisition(self, channel=1, refreshrate=300.):
+        # a running loop must have finished its transfer before the scope is accessed directly
+        self.stop_acquisition()
         self.current_channel = channel
+        # settings might have been changed on the scope itself, drop the cached time axis
+        self._oscilloscope.resync_settings()
         self.get_single_trace(channel)
         self.refresh_timing = refreshrate
         self._oscilloscope.RunContinous(channel)
+        generation = self._acquisition_worker.next_generation()
+        self._trace_ring.clear(generation)
         self.enabled = True
-        self.timer.start(self.refresh_timing)
-
-    def acq_loop(self):
-        self.time_axis = self._oscilloscope.get_xaxis(self.current_channel)
-        trace = self._oscilloscope.getData_cont(self.current_channel)
-        if len(trace)==0:
-            self.time_axis = np.linspace(0, 1, self.record_length)
-            trace = np.zeros(self.record_length)
-        self.handle_trace(trace)
-        if self.enabled:
-            self.timer.start(self.refresh_timing)
+        self.sig_start_acquisition_loop.emit(channel, self.reference_channel,
+                                             self.refresh_timing / 1000, generation)
 
     def stop_acquisition(self):
         #self._oscilloscope.RunSTOP()
+        self._acquisition_worker.next_generation()
+        if not self._acquisition_worker.wait_stopped(self._acquisition_stop_timeout):
+            self.log.warning('Acquisition loop did not finish its transfer within {0:g} s.'
+                             ''.format(self._acquisition_stop_timeout))
         self.enabled = False
         return 0
 
+    def get_acquisition_statistics(self):
+        """ Tell whether the consumers keep up with the acquisition.
+
+        @return dict: number of traces written to the ring buffer, overruns (traces committed
+                      while the buffer was full of unread traces), dropped traces (never
+                      taken by any consumer) and dropped fits (superseded by a newer trace)
+        """
+        statistics = self._trace_ring.get_statistics()
+        statistics['fits_dropped'] = self._fit_worker.dropped
+        return statistics
+
+    def set_transfer_format(self, transfer_format):
+        """ Select the waveform transfer format, integer formats raise the achievable trace rate.
+
+        @param str transfer_format: 'REAL,32', 'INT,16' or 'INT,8'
+        """
+        self.transfer_format = self._oscilloscope.set_transfer_format(transfer_format)
+        return self.transfer_format
+
+    def set_warm_start(self, enabled):
+        """ Start each fit from the result of the previous trace instead of the estimator.
+
+        @param bool enabled: enable warm start of the fits
+        """
+        self.warm_start = bool(enabled)
+        with self._fit_lock:
+            self.fc.set_warm_start(self.warm_start)
+        return self.warm_start
+
+    def set_roi(self, enabled, linewidths=None, decimation=None):
+        """ Fit only windows around the resonance and the sidebands of the traces.
+
+        @param bool enabled: enable the region of interest
+        @param float linewidths: optional, half width of the windows in linewidths
+        @param str decimation: optional, samples between the windows, 'minmax', 'mean' or 'none'
+        """
+        with self._fit_lock:
+            self.fc.set_roi(enabled, linewidths, decimation)
+            self.roi = self.fc.roi
+            self.roi_linewidths = self.fc.roi_linewidths
+            self.roi_decimation = self.fc.roi_decimation
+        return self.roi
+
     def scope_stetting(self, timebase=5e-3, recordlength=1000, scale=10e-3):
         self.time_base = timebase
         self._oscilloscope.SetTimeBase(self.time_base)
@@ -229,73 +675,238 @@ class FinesseLogic(LogicBase):
         return 0
 
     def do_fit(self, fit_function=None, x_data=None, y_data=None, chi=0.1, pre_fit=False):
-        """
-        Execute the currently configured fit on the measurement data. Optionally on passed data
+        """ Fit the current trace, or the passed data, in the fit thread.
+
+        The fit does not block the caller. If a fit is still running, the trace waits for it to
+        finish, replacing a trace already waiting. The result is delivered by sig_fit_updated
+        together with the id of the fitted trace.
+
+        @param str fit_function: name of the configured fit to use
+        @param numpy.ndarray x_data: optional, x values, defaults to the current time axis
+        @param numpy.ndarray y_data: optional, y values, defaults to the current trace
+        @param float chi: chi square threshold, the finesse error of fits above it is inf
+        @param bool pre_fit: run the peak detection pre-fit before fitting
+
+        @return int: id of the trace scheduled for fitting, -1 if no fit is scheduled
         """
         if (x_data is None) or (y_data is None):
-            y_data = self._current_trace
+            x_data = self.time_axis
+            y_data = self.get_current_trace()
+            if y_data is None:
+                self.log.debug('Current trace was overwritten by the acquisition, not fitted.')
+                return -1
 
         if pre_fit and fit_function not in ['Lorentzian peak with sidebands']:
             self.log.warning("Pre-fit checked, only available for Lorentzian peak with sidebands for now")
 
-        if fit_function is not None and isinstance(fit_function, str):
-            if fit_function in self.get_fit_functions():
-                if fit_function in ['Lorentzian peak with sidebands']:
-                    if pre_fit:
-                        res = self.do_pre_fit(self.time_axis, y_data)
-                        if res < 0:
-                            self.log.warning("Pre-fit failed, fitting as is...")                    
-                    self.fc.set_current_fit(fit_function)
-                    self.cavity_fit_x, self.cavity_fit_y, result = self.fc.do_fit(self.time_axis, y_data)
-                    if result is None:
-                        self.result_str_dict = {}
-                    else:
-                        self.result_str_dict = result.result_str_dict
-                    if self.result_str_dict['chi_sqr']['value'] < chi:
-                        (self.cavity_finesse, self.cavity_finesse_error) = self.finesse(fit_function)
-                    else:
-                        self.log.info("Warning no conclusive fit, increase Chi threshold or reacquire signal")
-                        (self.cavity_finesse, self.cavity_finesse_error) = self.finesse(fit_function)
-                        self.cavity_finesse_error = math.inf
-                    self.sig_fit_updated.emit()
-                else:
+        if fit_function is None or not isinstance(fit_function, str):
+            return -1
+        if fit_function not in self.get_fit_functions():
+            self.fc.set_current_fit('No Fit')
+            if fit_function != 'No Fit':
+                self.log.warning('Fit function "{0}" not available in Finesse fit container.'
+                                 ''.format(fit_function))
+            return -1
+
+        # the trace buffer is reused by the acquisition, the fit works on a copy
+        self._fit_worker.submit(self._trace_id,
+                                fit_function=fit_function,
+                                x_data=x_data,
+                                y_data=np.array(y_data),
+                                chi=chi,
+                                pre_fit=pre_fit)
+        return self._trace_id
+
+    def _fit_trace(self, fit_function, x_data, y_data, chi=0.1, pre_fit=False):
+        """ Fit a trace and calculate the finesse, runs in the fit thread.
+
+        @return dict: fit_function, fit_x, fit_y, result_str_dict, finesse, finesse_error and
+                      conversion
+        """
+        with self._fit_lock:
+            if pre_fit and fit_function in ['Lorentzian peak with sidebands']:
+                res = self.do_pre_fit(x_data, y_data)
+                if res < 0:
+                    self.log.warning("Pre-fit failed, fitting as is...")
+            self.fc.set_current_fit(fit_function)
+            fit_x, fit_y, result = self.fc.do_fit(x_data, y_data)
+
+        fit_result = {'fit_function': fit_function,
+                      'fit_x': fit_x,
+                      'fit_y': fit_y,
+                      'result_str_dict': {},
+                      'finesse': 0,
+                      'finesse_error': math.inf,
+                      'conversion': None}
+        if result is None:
+            return fit_result
+        fit_result['result_str_dict'] = result.result_str_dict
+        # the conversion is stored by _handle_fit_result, not from the fit thread
+        finesse, finesse_error, fit_result['conversion'] = self._calc_finesse(
+            fit_function, result.result_str_dict)
+        if fit_function in ['Lorentzian peak with sidebands'] \
+                and result.result_str_dict['chi_sqr']['value'] >= chi:
+            self.log.info("Warning no conclusive fit, increase Chi threshold or reacquire signal")
+            finesse_error = math.inf
+        fit_result['finesse'] = finesse
+        fit_result['finesse_error'] = finesse_error
+        return fit_result
+
+    def _handle_fit_result(self, trace_id, fit_result):
+        """ Store the result delivered by the fit thread and pass it on. """
+        self.cavity_fit_x = fit_result['fit_x']
+        self.cavity_fit_y = fit_result['fit_y']
+        self.result_str_dict = fit_result['result_str_dict']
+        self.cavity_finesse = fit_result['finesse']
+        self.cavity_finesse_error = fit_result['finesse_error']
+        if fit_result['conversion'] is not None:
+            self.conversion = fit_result['conversion']
+        if self._run is not None and fit_result['result_str_dict']:
+            result_str_dict = dict(fit_result['result_str_dict'])
+            result_str_dict['Finesse'] = {'value': fit_result['finesse'],
+                                          'error': fit_result['finesse_error'],
+                                          'unit': ''}
+            self._save_logic.submit_call(self._run.append_fit, trace_id,
+                                         fit_result['fit_function'], result_str_dict)
+        self.sig_fit_updated.emit(trace_id, fit_result)
+
+    def do_burst(self, fit_function, n_segments=None, chi=0.1, pre_fit=False):
+        """ Capture a burst of sweeps in the fast segmentation mode of the scope and fit each.
+
+        All segments are downloaded as one block, a running acquisition is restarted right after.
+        The segments are fitted in the background and the finesse statistics are emitted once
+        via sig_burst_updated, as a dict with finesse and finesse_error arrays (nan for
+        discarded segments), their mean and standard deviation and the number of valid segments.
+
+        @param str fit_function: name of the configured fit to use
+        @param int n_segments: optional, number of sweeps, defaults to burst_segments
+        @param float chi: chi square threshold, finesse of fits above it are discarded
+        @param bool pre_fit: run the peak detection pre-fit on each segment
+
+        @return int: number of segments scheduled for fitting, -1 on error
+        """
+        if n_segments is not None:
+            self.burst_segments = int(n_segments)
+        if fit_function not in self.get_fit_functions():
+            self.log.warning('Fit function "{0}" not available in Finesse fit container.'
+                             ''.format(fit_function))
+            return -1
+        acquiring = self.enabled
+        if acquiring:
+            self.stop_acquisition()
+        try:
+            time_axis, segments = self._oscilloscope.get_segments(self.current_channel,
+                                                                  self.burst_segments)
+            if segments is None:
+                return -1
+            self.set_current_trace(segments[-1], time_axis)
+        finally:
+            if acquiring:
+                self.start_acquisition(self.current_channel, self.refresh_timing)
+
+        threading.Thread(target=self._fit_burst, args=(fit_function, time_axis, segments, chi,
+                                                       pre_fit),
+                         name='finesse burst fit', daemon=True).start()
+        return len(segments)
+
+    def _fit_burst(self, fit_function, time_axis, segments, chi, pre_fit):
+        """ Fit the segments of a burst and hand the result to the logic thread, runs in a
+        thread of its own.
+        """
+        finesse = np.full(len(segments), np.nan)
+        finesse_error = np.full(len(segments), np.nan)
+        fit_result = {'fit_function': fit_function,
+                      'fit_x': [],
+                      'fit_y': [],
+                      'result_str_dict': {},
+                      'conversion': None}
+        try:
+            # all segments are submitted first, so they are fitted in parallel if the fit logic
+            # runs fit worker processes. The fit container is only locked while the parameter
+            # hints of a segment are set up and taken by submit_fit.
+            futures = list()
+            for segment in segments:
+                with self._fit_lock:
+                    if pre_fit and fit_function in ['Lorentzian peak with sidebands']:
+                        self.do_pre_fit(time_axis, segment)
+                    # pick up the parameter hints set by the pre-fit
                     self.fc.set_current_fit(fit_function)
+                    futures.append(self.fc.submit_fit(time_axis, segment))
+            for ii, future in enumerate(futures):
+                fit_x, fit_y, result = future.result()
+                if result is None:
+                    continue
+                fit_result.update(fit_x=fit_x, fit_y=fit_y,
+                                  result_str_dict=result.result_str_dict)
+                if result.result_str_dict['chi_sqr']['value'] < chi:
+                    finesse[ii], finesse_error[ii], conversion = self._calc_finesse(
+                        fit_function, result.result_str_dict)
+                    if conversion is not None:
+                        fit_result['conversion'] = conversion
+        except Exception:
+            self.log.exception('Burst fit failed:')
 
-                    self.cavity_fit_x, self.cavity_fit_y, result = self.fc.do_fit(self.time_axis, y_data)
-                    if result is None:
-                        self.result_str_dict = {}
-                    else:
-                        self.result_str_dict = result.result_str_dict
+        valid = np.isfinite(finesse)
+        fit_result['burst'] = {'finesse': finesse,
+                               'finesse_error': finesse_error,
+                               'mean': np.mean(finesse[valid]) if valid.any() else np.nan,
+                               'std': np.std(finesse[valid]) if valid.any() else np.nan,
+                               'valid_segments': int(valid.sum())}
+        self._sig_burst_fitted.emit(fit_result)
 
-                    (self.cavity_finesse, self.cavity_finesse_error) = self.finesse(fit_function)
-                    self.sig_fit_updated.emit()
-            else:
-                self.fc.set_current_fit('No Fit')
-                if fit_function != 'No Fit':
-                    self.log.warning('Fit function "{0}" not available in Finesse fit container.'
-                                     ''.format(fit_function))
-        return 0
+    def _handle_burst_result(self, fit_result):
+        """ Store the result of a burst delivered by _fit_burst and pass it on. """
+        self.cavity_fit_x = fit_result['fit_x']
+        self.cavity_fit_y = fit_result['fit_y']
+        self.result_str_dict = fit_result['result_str_dict']
+        if fit_result['conversion'] is not None:
+            self.conversion = fit_result['conversion']
+        self.burst_result = fit_result['burst']
+        self.sig_burst_updated.emit(self.burst_result)
+
+    def finesse(self, fit_function, result_str_dict=None):
+        """ Calculate the finesse from a fit result and store the time to frequency conversion.
+
+        @param str fit_function: name of the configured fit the result belongs to
+        @param dict result_str_dict: optional, fit result, defaults to the last one
+
+        @return tuple(float, float): finesse and its error
+        """
+        if result_str_dict is None:
+            result_str_dict = self.result_str_dict
+        finesse, error_finesse, conversion = self._calc_finesse(fit_function, result_str_dict)
+        if conversion is not None:
+            self.conversion = conversion
+        return finesse, error_finesse
+
+    def _calc_finesse(self, fit_function, result_str_dict):
+        """ Calculate the finesse from a fit result without changing the logic state.
+
+        @param str fit_function: name of the configured fit the result belongs to
+        @param dict result_str_dict: fit result
 
-    def finesse(self, fit_function):
+        @return tuple(float, float, float): finesse, its error and the time to frequency
+                                            conversion in MHz/s (None if not available)
+        """
         if fit_function is not None and isinstance(fit_function, str):
             if fit_function in ['Two Lorentzian peaks']:
-                finesse = np.mean([self.result_str_dict['Splitting']['value']/self.result_str_dict['FWHM 0']['value'],
-                                  self.result_str_dict['Splitting']['value']/self.result_str_dict['FWHM 1']['value']])
-                error_finesse = np.std([self.result_str_dict['Splitting']['value']/self.result_str_dict['FWHM 0']['value'],
-                                       self.result_str_dict['Splitting']['value']/self.result_str_dict['FWHM 1']['value']])
-                return finesse, error_finesse
+                finesse = np.mean([result_str_dict['Splitting']['value']/result_str_dict['FWHM 0']['value'],
+                                  result_str_dict['Splitting']['value']/result_str_dict['FWHM 1']['value']])
+                error_finesse = np.std([result_str_dict['Splitting']['value']/result_str_dict['FWHM 0']['value'],
+                                       result_str_dict['Splitting']['value']/result_str_dict['FWHM 1']['value']])
+                return finesse, error_finesse, None
             elif fit_function in ['Lorentzian peak with sidebands']:
-                Splitting = np.mean([self.result_str_dict['Splitting left']['value'], self.result_str_dict['Splitting right']['value']])
-                self.conversion = self.eom_frequency/(Splitting)
-                Linewidth = self.result_str_dict['FWHM 1']['value']*self.conversion
+                Splitting = np.mean([result_str_dict['Splitting left']['value'], result_str_dict['Splitting right']['value']])
+                conversion = self.eom_frequency/(Splitting)
+                Linewidth = result_str_dict['FWHM 1']['value']*conversion
                 finesse = self.FSR*1e3/Linewidth
-                error_finesse = self.FSR/(self.result_str_dict['FWHM 1']['value']*self.eom_frequency)*np.std([self.result_str_dict['Splitting left']['value'], self.result_str_dict['Splitting right']['value']]) + self.FSR_error*1e3/Linewidth + self.FSR*1e3/(self.result_str_dict['FWHM 1']['value']**2*self.conversion)*self.result_str_dict['FWHM 1']['error']
-                return finesse, error_finesse
+                error_finesse = self.FSR/(result_str_dict['FWHM 1']['value']*self.eom_frequency)*np.std([result_str_dict['Splitting left']['value'], result_str_dict['Splitting right']['value']]) + self.FSR_error*1e3/Linewidth + self.FSR*1e3/(result_str_dict['FWHM 1']['value']**2*conversion)*result_str_dict['FWHM 1']['error']
+                return finesse, error_finesse, conversion
 
             else:
-                return 0, 0
+                return 0, 0, None
         else:
-            return 0, 0
+            return 0, 0, None
 
     @fc.constructor
     def sv_set_fits(self, val):
@@ -342,6 +953,10 @@ class FinesseLogic(LogicBase):
         return list(self.fc.fit_list)
 
     def save_data(self, tag=None, timestamp=None):
+        """ Save the current trace in the background.
+
+        @return concurrent.futures.Future: future of the path of the saved file
+        """
         if timestamp is None:
             timestamp = datetime.datetime.now()
         if tag is not None and len(tag) > 0:
@@ -349,24 +964,80 @@ class FinesseLogic(LogicBase):
         else:
             filelabel = 'cavity_trans'
 
+        # the trace is a view of the ring buffer, the save logic gets its own copy
         data = OrderedDict()
-        data['measurement time (s)'] = self.time_axis
-        data['photodiode signal (V)'] = self._current_trace
+        data['measurement time (s)'] = np.array(self.time_axis)
+        data['photodiode signal (V)'] = self.get_current_trace()
+        if data['photodiode signal (V)'] is None:
+            self.log.warning('Current trace was overwritten by the acquisition, not saved.')
+            return None
         
         parameters = OrderedDict()
         parameters['modulation frequency (MHz)'] = self.eom_frequency
         parameters['cavity length (um)'] = self.cavity_length
 
-        self._save_logic.save_data(data,
-                                   filepath=self.dirname,
-                                   filelabel=filelabel,
-                                   filetype='p',
-                                   parameters=parameters,
-                                   fmt='%.6e',
-                                   delimiter='\t',
-                                   timestamp=timestamp)
+        return self._save_logic.submit_data(data,
+                                            filepath=self.dirname,
+                                            filelabel=filelabel,
+                                            filetype='bundle',
+                                            parameters=parameters,
+                                            fmt='%.6e',
+                                            delimiter='\t',
+                                            timestamp=timestamp,
+                                            module_name='finesse_logic')
+
+    def start_run(self, tag=None):
+        """ Append every acquired trace and fit result to one HDF5 file until stop_run.
+
+        The traces are appended by the writer of the save logic, keyed by their trace id, which
+        the fit results refer to.
+
+        @param str tag: optional, tag of the file name
+
+        @return str: path of the run file
+        """
+        self.stop_run()
+        if tag is not None and len(tag) > 0:
+            filelabel = 'cavity_run_' + tag
+        else:
+            filelabel = 'cavity_run'
+        parameters = OrderedDict()
+        parameters['cavity length (um)'] = self.cavity_length
+        parameters['ring cavity'] = self.is_ring_cavity
+        parameters['channel'] = self.current_channel
+        parameters['reference channel'] = self.reference_channel
+        parameters['record length'] = self.record_length
+        parameters['time base (s)'] = self.time_base
+        self._run = self._save_logic.open_run(filelabel=filelabel, filepath=self.dirname,
+                                              parameters=parameters,
+                                              module_name='finesse_logic')
+        return self._run.path
+
+    def stop_run(self):
+        """ Close the run file opened by start_run. """
+        if self._run is not None:
+            run, self._run = self._run, None
+            self._save_logic.close_run(run)
+
+    def _append_to_run(self):
+        """ Hand the current trace over to the run file. """
+        # the trace is a view of the ring buffer, the save logic gets its own copy
+        data = OrderedDict()
+        data['measurement time (s)'] = np.array(self.time_axis)
+        data['photodiode signal (V)'] = self.get_current_trace()
+        if data['photodiode signal (V)'] is None:
+            self.log.warning('Current trace was overwritten by the acquisition, not saved.')
+            return
+        metadata = {'modulation frequency (MHz)': self.eom_frequency}
+        self._save_logic.submit_call(self._run.append, data,
+                                     timestamp=datetime.datetime.now(), metadata=metadata,
+                                     record_id=self._trace_id)
 
     def save_fig(self, tag=None, timestamp=None):
+        """ Save the current trace and a plot of it in the background.
+
+        @return concurrent.futures.Future: future of the path of the saved file
+        """
         if timestamp is None:
             timestamp = datetime.datetime.now()
         if tag is not None and len(tag) > 0:
@@ -374,9 +1045,13 @@ class FinesseLogic(LogicBase):
         else:
             filelabel = 'cavity_trans'
 
+        # the trace is a view of the ring buffer, the save logic gets its own copy
         data = OrderedDict()
-        data['measurement time (s)'] = self.time_axis
-        data['photodiode signal (V)'] = self._current_trace
+        data['measurement time (s)'] = np.array(self.time_axis)
+        data['photodiode signal (V)'] = self.get_current_trace()
+        if data['photodiode signal (V)'] is None:
+            self.log.warning('Current trace was overwritten by the acquisition, not saved.')
+            return None
         
         parameters = OrderedDict()
         parameters['modulation frequency (MHz)'] = self.eom_frequency
@@ -409,18 +1084,19 @@ class FinesseLogic(LogicBase):
 
         plt.locator_params(axis='y', nbins=4)
 
-        axes.plot(freq_axis, self._current_trace*1e3, marker="", linewidth=1)
+        axes.plot(freq_axis, data['photodiode signal (V)']*1e3, marker="", linewidth=1)
         axes.set_xlabel('Frequency offset (MHz)'+arbitrary, labelpad=15)
         axes.set_ylabel('Photodiode signal (mV)')
         fig.tight_layout(rect=[0,-0.015,1,1.025])
 
-        self._save_logic.save_data(data,
-                            filepath=self.dirname,
-                            filelabel=filelabel,
-                            parameters=parameters,
-                            fmt='%.6e',
-                            filetype='p',
-                            delimiter='\t',
-                            timestamp=timestamp,
-                            plotfig=fig)
+        return self._save_logic.submit_data(data,
+                                            filepath=self.dirname,
+                                            filelabel=filelabel,
+                                            parameters=parameters,
+                                            fmt='%.6e',
+                                            filetype='bundle',
+                                            delimiter='\t',
+                                            timestamp=timestamp,
+                                            plotfig=fig,
+                                            module_name='finesse_logic')
           
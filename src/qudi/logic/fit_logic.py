@@ -20,23 +20,459 @@ Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
 top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
 """
 
+import ast
 import importlib
 import inspect
+import json
+import logging
 import lmfit
+import multiprocessing
 from qtpy import QtCore
 import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
 import os
 import sys
 from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
 from distutils.version import LooseVersion
+from multiprocessing import shared_memory
+from scipy.signal import find_peaks
 
-from qudi.util.paths import get_main_dir
+from qudi.util.paths import get_main_dir, get_appdata_dir
 from qudi.util.mutex import Mutex
 from qudi.util.yaml import yaml_load, yaml_dump
 from qudi.core.configoption import ConfigOption
 from qudi.core.module import LogicBase
 
 
+class _FitMethodManifest:
+    """ Names of the functions in the fit method files and the module defining each of them.
+
+    The names are read from the source of the files, without importing them, and kept in a
+    manifest file, in which the entry of a file is only renewed when the file changes. A module is
+    imported when one of its methods is used for the first time, see _attach_fit_methods.
+
+    Files binding names the source does not reveal as functions (module level assignments,
+    decorated functions, imported make_* and estimate_* functions) are imported right away to
+    read their functions. As with importing all files, a method defined in several files is
+    taken from the last one.
+    """
+
+    def __init__(self, path_list, cache_file=None):
+        """ Collect the fit methods in the given directories.
+
+        @param list path_list: directories containing the fit method files
+        @param str cache_file: optional, path of the manifest file
+        """
+        # directory by module name and module name by method name
+        self.modules = OrderedDict()
+        self.methods = OrderedDict()
+        # fit method files which could not be read
+        self.failed = list()
+
+        cache = self._read_cache(cache_file)
+        entries = dict()
+        for path in path_list:
+            for f in sorted(os.listdir(path)):
+                filename = os.path.join(path, f)
+                if not (os.path.isfile(filename) and f.endswith('.py')):
+                    continue
+                stat = os.stat(filename)
+                entry = cache.get(filename)
+                if entry is None or entry['mtime'] != stat.st_mtime \
+                        or entry['size'] != stat.st_size:
+                    self.modules[f[:-3]] = path
+                    try:
+                        methods = self._read_methods(filename)
+                        if methods is None:
+                            methods = [method for method, ref in self.import_module(f[:-3])]
+                    except Exception:
+                        del self.modules[f[:-3]]
+                        self.failed.append(filename)
+                        continue
+                    entry = {'mtime': stat.st_mtime, 'size': stat.st_size, 'methods': methods}
+                entries[filename] = entry
+                self.modules[f[:-3]] = path
+                for method in entry['methods']:
+                    # later files override earlier ones, the order of the names stays the same
+                    self.methods[method] = f[:-3]
+
+        if cache_file is not None and entries != cache:
+            try:
+                with open(cache_file, 'w') as file:
+                    json.dump(entries, file)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _read_cache(cache_file):
+        if cache_file is None:
+            return dict()
+        try:
+            with open(cache_file, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return dict()
+
+    @staticmethod
+    def _read_methods(filename):
+        """ Names of the functions defined at module level of a source file.
+
+        @return list: names of the functions, None if they can only be found by importing the file
+        """
+        with open(filename, 'r', encoding='utf-8') as file:
+            tree = ast.parse(file.read(), filename)
+        methods = list()
+        for node in tree.body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                if node.decorator_list:
+                    return None
+                methods.append(node.name)
+            elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+                return None
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                for alias in node.names:
+                    name = alias.asname or alias.name
+                    if name == '*' or name.startswith(('make_', 'estimate_')):
+                        return None
+        return methods
+
+    def import_module(self, module):
+        """ Import a fit method file.
+
+        @param str module: name of the module
+
+        @return list: (name, function) tuples of all functions in the module
+        """
+        path = self.modules[module]
+        if path not in sys.path:
+            sys.path.append(path)
+        mod = importlib.import_module(module)
+        methods = list()
+        for method in dir(mod):
+            ref = getattr(mod, method)
+            if callable(ref) and (inspect.ismethod(ref) or inspect.isfunction(ref)):
+                methods.append((method, ref))
+        return methods
+
+
+def _attach_fit_methods(host, name):
+    """ Attach the functions of the fit method file defining name to the class of host.
+
+    Called by __getattr__ of the fit method hosts, so each file is imported on first use.
+
+    @return function: the method name of host
+    """
+    manifest = host.__dict__.get('_fit_manifest')
+    if manifest is None or name not in manifest.methods:
+        raise AttributeError('{0!r} object has no attribute {1!r}'.format(type(host).__name__,
+                                                                          name))
+    module = manifest.methods[name]
+    for method, ref in manifest.import_module(module):
+        # methods defined again in a later file are attached when that file is imported
+        if manifest.methods.get(method, module) == module:
+            setattr(type(host), method, ref)
+    if name not in type(host).__dict__:
+        raise AttributeError('Fit method {0!r} not found in module {1!r}.'
+                             ''.format(name, manifest.methods[name]))
+    return getattr(host, name)
+
+
+class _FitMethodReference:
+    """ Calls a fit method of a host by name, so the fit method file is imported on first use.
+    """
+
+    def __init__(self, host, name):
+        self.host = host
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        return getattr(self.host, self.name)(*args, **kwargs)
+
+
+class _FitProcessHost:
+    """ Stand-in for FitLogic in the fit worker processes, the fit methods are attached to it. """
+
+    def __init__(self, manifest):
+        self.log = logging.getLogger('{0}.fit_process'.format(__name__))
+        self._fit_manifest = manifest
+
+    def __getattr__(self, name):
+        return _attach_fit_methods(self, name)
+
+
+# fit method host of a fit worker process, set up once by _init_fit_process
+_fit_process_host = None
+
+
+def _init_fit_process(manifest):
+    """ Initializer of the fit worker processes, the fit methods are imported on first use. """
+    global _fit_process_host
+    _fit_process_host = _FitProcessHost(manifest)
+
+
+def _fit_in_process(fit_name, est_name, units, add_params, settings, shm_name, x_spec, y_spec,
+                    best_fit_spec, x_fit_spec=None, y_fit_spec=None):
+    """ Run a fit in a fit worker process.
+
+    x and y data are read from and the best fit is written to a shared memory block, only the
+    names of fit and estimator, the parameter hints and the fit settings of the fit logic
+    (FitLogic.fit_settings) are passed. If the specs of separate fit data are given, the
+    estimator runs on x and y data and the model is fitted to the fit data.
+
+    @return dict: fitted parameters (Parameters.dumps), result_str_dict and fit statistics
+    """
+    host = _fit_process_host
+    for attr, value in settings.items():
+        setattr(host, attr, value)
+    if est_name == 'generic':
+        estimator = getattr(host, 'estimate_{0}'.format(fit_name))
+    else:
+        estimator = getattr(host, 'estimate_{0}_{1}'.format(fit_name, est_name))
+    if add_params is not None:
+        add_params = lmfit.parameter.Parameters().loads(add_params)
+
+    # the fit result and the estimator keep references to the data, so the data is copied out of
+    # the shared memory block, which can only be closed once no view on it is left
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        x_data, y_data = (np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset).copy()
+                          for offset, shape, dtype in (x_spec, y_spec))
+        if x_fit_spec is not None:
+            estimator = _estimator_on(estimator, x_data, y_data)
+            x_data, y_data = (
+                np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset).copy()
+                for offset, shape, dtype in (x_fit_spec, y_fit_spec))
+        result = getattr(host, 'make_{0}_fit'.format(fit_name))(
+            x_axis=x_data, data=y_data, estimator=estimator, units=units, add_params=add_params)
+        offset, shape, dtype = best_fit_spec
+        best_fit = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        best_fit[:] = result.best_fit
+        del best_fit
+    finally:
+        shm.close()
+
+    return {'params': result.params.dumps(),
+            'result_str_dict': getattr(result, 'result_str_dict', dict()),
+            'stats': {attr: getattr(result, attr, None) for attr in _fit_result_attributes}}
+
+
+# scalar attributes of a fit result transferred back from the fit worker processes
+_fit_result_attributes = ('method', 'success', 'message', 'errorbars', 'nfev', 'ndata', 'nvarys',
+                          'nfree', 'chisqr', 'redchi', 'aic', 'bic')
+
+
+def _reset_parameters(params, template):
+    """ Set all parameters in params back to the settings of the same parameters in template. """
+    for name, par in template.items():
+        params[name].set(value=par.value, min=par.min, max=par.max, vary=par.vary)
+        # an empty expression removes a constraint set in between
+        params[name].set(expr=par.expr or '')
+
+
+# handling of the samples outside the region of interest of a fit container
+roi_decimations = ('minmax', 'mean', 'none')
+
+
+def _crop_to_roi(x_data, y_data, linewidths, decimation='minmax', bin_size=50):
+    """ Crop a trace to windows around its peaks and dips.
+
+    Features are the extrema of the trace relative to its median, with a prominence of at least
+    a tenth of the largest one and five times the noise. Samples within linewidths full widths
+    at half maximum of a feature are kept. The other samples are dropped ('none'), reduced to
+    the smallest and largest sample ('minmax') or averaged ('mean') in bins of bin_size samples.
+
+    @param numpy.ndarray x_data: 1D array with the x values
+    @param numpy.ndarray y_data: 1D array with the y values
+    @param float linewidths: half width of the windows in linewidths of the features
+    @param str decimation: 'minmax', 'mean' or 'none'
+    @param int bin_size: number of samples per bin outside the windows
+
+    @return tuple(numpy.ndarray, numpy.ndarray): x and y values to fit, None if no feature is
+                                                 found or the windows cover more than half of
+                                                 the trace
+    """
+    x = np.asarray(x_data)
+    y = np.asarray(y_data, dtype=float)
+    signal = np.abs(y - np.median(y))
+    # noise from the differences of neighbouring samples, hardly affected by the features
+    noise = 1.4826 * np.median(np.abs(np.diff(y))) / np.sqrt(2)
+    peaks, properties = find_peaks(signal,
+                                   prominence=max(0.1 * np.ptp(signal), 5 * noise),
+                                   width=1)
+    if len(peaks) == 0:
+        return None
+
+    half_width = np.ceil(linewidths * properties['widths']).astype(int)
+    edges = np.zeros(len(y) + 1, dtype=int)
+    np.add.at(edges, np.clip(peaks - half_width, 0, len(y)), 1)
+    np.add.at(edges, np.clip(peaks + half_width + 1, 0, len(y)), -1)
+    mask = np.cumsum(edges[:-1]) > 0
+    if mask.sum() > len(y) // 2:
+        return None
+    if decimation == 'none':
+        return x[mask], y[mask]
+
+    # bins of bin_size samples in each gap between the windows
+    inside = np.flatnonzero(mask)
+    outside = np.flatnonzero(~mask)
+    new_gap = np.ones(len(outside), dtype=bool)
+    new_gap[1:] = np.diff(outside) > 1
+    gap_start = outside[new_gap][np.cumsum(new_gap) - 1]
+    bin_starts = np.flatnonzero((outside - gap_start) % bin_size == 0)
+    if decimation == 'mean':
+        counts = np.diff(np.append(bin_starts, len(outside)))
+        position = np.concatenate((inside, np.add.reduceat(outside, bin_starts) / counts))
+        order = np.argsort(position, kind='stable')
+        x_fit = np.concatenate((x[inside], np.add.reduceat(x[outside], bin_starts) / counts))
+        y_fit = np.concatenate((y[inside], np.add.reduceat(y[outside], bin_starts) / counts))
+        return x_fit[order], y_fit[order]
+    # 'minmax': sorted by bin and value, the first sample of a bin is its minimum, the last one
+    # its maximum
+    bin_index = np.zeros(len(outside), dtype=int)
+    bin_index[bin_starts[1:]] = 1
+    order = np.lexsort((y[outside], np.cumsum(bin_index)))
+    bin_stops = np.append(bin_starts[1:], len(outside)) - 1
+    keep = np.union1d(inside, outside[order[np.union1d(bin_starts, bin_stops)]])
+    return x[keep], y[keep]
+
+
+def _estimator_on(estimator, x_data, y_data):
+    """ Wrap an estimator to run on the given data instead of the data passed to it.
+
+    The estimators expect evenly sampled traces, so with a region of interest they still get the
+    full trace while the model is fitted to the cropped one.
+    """
+    def estimate(x_axis, data, params, *args, **kwargs):
+        return estimator(x_data, y_data, params, *args, **kwargs)
+    return estimate
+
+
+class FitCurve:
+    """ Fitted model over the x range of a fit, evaluated only on request.
+
+    The fit curve is evaluated at the resolution the consumer asks for, e.g. the width of a plot
+    in pixels. The last few evaluations are cached.
+    """
+
+    _cache_size = 4
+
+    def __init__(self, model, params, x_start, x_stop, num):
+        """ Create a fit curve.
+
+        @param lmfit.Model model: fitted model, None for no fit (the curve is zero)
+        @param lmfit.parameter.Parameters params: fitted parameters
+        @param float x_start: first x value
+        @param float x_stop: last x value
+        @param int num: default number of points
+        """
+        self.model = model
+        self.params = params
+        self.x_start = x_start
+        self.x_stop = x_stop
+        self.num = int(num)
+        self._cache = OrderedDict()
+
+    def evaluate(self, num=None, x_range=None):
+        """ Evaluate the fit curve on evenly spaced x values.
+
+        @param int num: optional, number of points, defaults to num of the curve
+        @param tuple x_range: optional, (start, stop) of the x values, e.g. the visible range of
+                              a plot, limited to the x range of the fit
+
+        @return tuple(numpy.ndarray, numpy.ndarray): x and y values
+        """
+        num = self.num if num is None else max(2, int(num))
+        start, stop = self.x_start, self.x_stop
+        if x_range is not None:
+            low, high = sorted((start, stop))
+            start, stop = (np.clip(value, low, high) for value in x_range)
+        key = (num, start, stop)
+        if key not in self._cache:
+            x = np.linspace(start=start, stop=stop, num=num)
+            if self.model is None:
+                y = np.zeros(x.shape)
+            else:
+                y = self.model.eval(x=x, params=self.params)
+            if len(self._cache) >= self._cache_size:
+                self._cache.popitem(last=False)
+            self._cache[key] = (x, y)
+        return self._cache[key]
+
+    @property
+    def x(self):
+        """ Lazy x values at the default resolution. """
+        return FitCurveValues(self, 0)
+
+    @property
+    def y(self):
+        """ Lazy y values at the default resolution. """
+        return FitCurveValues(self, 1)
+
+
+class FitCurveValues(NDArrayOperatorsMixin):
+    """ x or y values of a FitCurve, behaving like an array evaluated on first use.
+
+    shape, ndim and size are known without evaluating the curve, dtype and all array operations
+    evaluate it.
+    """
+
+    def __init__(self, curve, axis):
+        self.curve = curve
+        self._axis = axis
+
+    def _values(self):
+        return self.curve.evaluate()[self._axis]
+
+    def __array__(self, dtype=None, copy=None):
+        values = self._values()
+        if dtype is not None and values.dtype != dtype:
+            if copy is False:
+                raise ValueError('Fit curve values can not be cast to {0} without a copy.'
+                                 ''.format(dtype))
+            return values.astype(dtype)
+        # the evaluated values are cached by the curve, so they are never handed out for writing
+        if copy:
+            return values.copy()
+        return values
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        # arithmetic and numpy functions work on the evaluated values
+        inputs = [arg._values() if isinstance(arg, FitCurveValues) else arg for arg in inputs]
+        out = kwargs.get('out')
+        if out is not None and any(isinstance(arg, FitCurveValues) for arg in out):
+            return NotImplemented
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __len__(self):
+        return self.curve.num
+
+    def __iter__(self):
+        return iter(self._values())
+
+    def __getitem__(self, item):
+        return self._values()[item]
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, self._values())
+
+    @property
+    def shape(self):
+        return (self.curve.num, )
+
+    @property
+    def ndim(self):
+        return 1
+
+    @property
+    def size(self):
+        return self.curve.num
+
+    @property
+    def dtype(self):
+        return self._values().dtype
+
+
 class FitLogic(LogicBase):
     """
     Documentation to add a new fit model/estimator/function can be found in
@@ -54,13 +490,24 @@ class FitLogic(LogicBase):
     _additional_methods_import_path = ConfigOption(name='additional_fit_methods_path',
                                                    default=None,
                                                    missing='nothing')
+    # Use the analytic Jacobians of the models providing one, False for numeric derivatives
+    _analytic_jacobian = ConfigOption(name='analytic_jacobian', default=True, missing='nothing')
+    # Minimizer of the fits: 'lmfit' (lmfit.Model.fit) or 'least_squares' (scipy least_squares
+    # on plain arrays, without the lmfit parameter bookkeeping in each iteration)
+    _fit_backend = ConfigOption(name='fit_backend', default='lmfit', missing='nothing')
+    # Solve for amplitudes and offset in closed form in each step (variable projection), only
+    # the other parameters are fitted nonlinearly. Uses the least_squares backend.
+    _separable_fit = ConfigOption(name='separable_fit', default=False, missing='nothing')
+    # Number of worker processes fitting in parallel, 0 fits in the calling thread
+    _fit_processes = ConfigOption(name='fit_processes', default=0, missing='nothing')
+
+    fit_backends = ('lmfit', 'least_squares')
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         # locking for thread safety
         self.lock = Mutex()
 
-        filenames = []
         # for path in directories:
         dirname = os.path.dirname(__file__)
         path_list = [os.path.join(dirname, 'fitmethods')]
@@ -83,12 +530,25 @@ class FitLogic(LogicBase):
                 self.log.error('ConfigOption additional_predefined_methods_path needs to either be a string or '
                                'a list of strings.')
 
-        for path in path_list:
-            for f in os.listdir(path):
-                if os.path.isfile(os.path.join(path, f)) and f.endswith('.py'):
-                    filenames.append(f[:-3])
-                    if path not in sys.path:
-                        sys.path.append(path)
+        # the fit method files are only imported when one of their methods is first used
+        try:
+            cache_file = os.path.join(get_appdata_dir(create_missing=True),
+                                      'fit_methods_manifest.json')
+        except OSError:
+            cache_file = None
+        self._fit_manifest = _FitMethodManifest(path_list, cache_file)
+        for filename in self._fit_manifest.failed:
+            self.log.error('Fit methods file "{0}" could not be read.'.format(filename))
+        self.analytic_jacobian = bool(self._analytic_jacobian)
+        if self._fit_backend not in self.fit_backends:
+            self.log.error('Unknown fit_backend "{0}", use one of {1}. Falling back to "lmfit".'
+                           ''.format(self._fit_backend, self.fit_backends))
+            self._fit_backend = 'lmfit'
+        self.fit_backend = self._fit_backend
+        self.separable_fit = bool(self._separable_fit)
+        # optional callable getting the duration of each minimization in s, see _fit_model
+        self.fit_model_timer = None
+        self._fit_pool = None
 
         # A dictionary containing all fit methods and their estimators.
         self.fit_list = OrderedDict()
@@ -102,25 +562,14 @@ class FitLogic(LogicBase):
         models_for_dict = list()
         fits_for_dict = list()
 
-        for files in filenames:
-            mod = importlib.import_module('{0}'.format(files))
-            for method in dir(mod):
-                ref = getattr(mod, method)
-                if callable(ref) and (inspect.ismethod(ref) or inspect.isfunction(ref)):
-                    method_str = str(method)
-                    try:
-                        # import methods in Fitlogic
-                        setattr(FitLogic, method, ref)
-                        # append method to a list of methods to include in the fit_list dictionary
-                        if method_str.startswith('make_') and method_str.endswith('_fit'):
-                            fits_for_dict.append(method_str.split('_', 1)[1].rsplit('_', 1)[0])
-                        elif method_str.startswith('make_') and method_str.endswith('_model'):
-                            models_for_dict.append(method_str.split('_', 1)[1].rsplit('_', 1)[0])
-                        elif method_str.startswith('estimate_'):
-                            estimators_for_dict.append(method_str.split('_', 1)[1])
-                    except:
-                        self.log.error('Method "{0}" could not be imported to FitLogic.'
-                                       ''.format(str(method)))
+        for method_str in self._fit_manifest.methods:
+            # append method to a list of methods to include in the fit_list dictionary
+            if method_str.startswith('make_') and method_str.endswith('_fit'):
+                fits_for_dict.append(method_str.split('_', 1)[1].rsplit('_', 1)[0])
+            elif method_str.startswith('make_') and method_str.endswith('_model'):
+                models_for_dict.append(method_str.split('_', 1)[1].rsplit('_', 1)[0])
+            elif method_str.startswith('estimate_'):
+                estimators_for_dict.append(method_str.split('_', 1)[1])
 
         fits_for_dict.sort()
         models_for_dict.sort()
@@ -141,11 +590,12 @@ class FitLogic(LogicBase):
             # Attach make_*_fit method to fit_list
             if fit_name not in self.fit_list[dimension]:
                 self.fit_list[dimension][fit_name] = OrderedDict()
-            self.fit_list[dimension][fit_name]['make_fit'] = getattr(self, fit_method)
+            self.fit_list[dimension][fit_name]['make_fit'] = _FitMethodReference(self, fit_method)
 
             # Attach make_*_model method to fit_list
             if fit_name in models_for_dict:
-                self.fit_list[dimension][fit_name]['make_model'] = getattr(self, model_method)
+                self.fit_list[dimension][fit_name]['make_model'] = _FitMethodReference(
+                    self, model_method)
             else:
                 self.log.error('No make_*_model method for fit "{0}" found in FitLogic.'
                                ''.format(fit_name))
@@ -155,11 +605,13 @@ class FitLogic(LogicBase):
             for estimator_name in estimators_for_dict:
                 estimator_method = 'estimate_' + estimator_name
                 if fit_name == estimator_name:
-                    self.fit_list[dimension][fit_name]['generic'] = getattr(self, estimator_method)
+                    self.fit_list[dimension][fit_name]['generic'] = _FitMethodReference(
+                        self, estimator_method)
                     found_estimator = True
                 elif estimator_name.startswith(fit_name + '_'):
                     custom_name = estimator_name.split('_', 1)[1]
-                    self.fit_list[dimension][fit_name][custom_name] = getattr(self, estimator_method)
+                    self.fit_list[dimension][fit_name][custom_name] = _FitMethodReference(
+                        self, estimator_method)
                     found_estimator = True
             if not found_estimator:
                 self.log.error('No estimator method for fit "{0}" found in FitLogic.'
@@ -168,6 +620,9 @@ class FitLogic(LogicBase):
         self.log.info('Methods were included to FitLogic, but only if naming is right: check the'
                       ' doxygen documentation if you added a new method and it does not show.')
 
+    def __getattr__(self, name):
+        # only called for attributes not found otherwise, e.g. fit methods not yet imported
+        return _attach_fit_methods(self, name)
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
@@ -176,10 +631,124 @@ class FitLogic(LogicBase):
         fitversion = LooseVersion(lmfit.__version__)
         if fitversion < LooseVersion('0.9.2'):
             raise Exception('lmfit needs to be at least version 0.9.2!')
+        if self._fit_processes > 0:
+            # spawn the workers, forking a process running Qt threads is unsafe
+            self._fit_pool = ProcessPoolExecutor(max_workers=int(self._fit_processes),
+                                                 mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_init_fit_process,
+                                                 initargs=(self._fit_manifest, ))
 
     def on_deactivate(self):
         """ """
-        pass
+        if self._fit_pool is not None:
+            self._fit_pool.shutdown(wait=True, cancel_futures=True)
+            self._fit_pool = None
+
+    def submit_fit(self, fit_name, est_name, x_data, y_data, units=None, add_params=None,
+                   x_fit=None, y_fit=None):
+        """ Schedule a fit in the fit worker processes.
+
+        Only the names of fit and estimator, the parameter hints and the data are passed to the
+        worker, the data via shared memory. Without worker processes (fit_processes: 0) the fit
+        is done right away in the calling thread.
+
+        @param str fit_name: name of the fit, e.g. 'lorentziantriple'
+        @param str est_name: name of the estimator, e.g. 'generic' or 'sidebands'
+        @param numpy.ndarray x_data: 1D array with the x values
+        @param numpy.ndarray y_data: 1D array with the y values
+        @param list units: optional, units of x and y values
+        @param lmfit.Parameters add_params: optional, parameter hints for the fit
+        @param numpy.ndarray x_fit: optional, x values the model is fitted to, e.g. a region of
+                                    interest of x_data. The estimator still uses x_data.
+        @param numpy.ndarray y_fit: optional, y values the model is fitted to, with x_fit
+
+        @return concurrent.futures.Future: future of the lmfit.model.ModelResult
+        """
+        fit = self._get_fit(fit_name)
+        if self._fit_pool is None:
+            future = Future()
+            estimator = fit[est_name]
+            if x_fit is not None:
+                estimator = _estimator_on(estimator, x_data, y_data)
+                x_data, y_data = x_fit, y_fit
+            try:
+                future.set_result(fit['make_fit'](x_axis=x_data, data=y_data,
+                                                  estimator=estimator, units=units,
+                                                  add_params=add_params))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        # data is passed as float64, so the estimated parameters can be serialized
+        x_data = np.asarray(x_data)
+        y_data = np.asarray(y_data)
+        arrays = [x_data, y_data, None]
+        if x_fit is not None:
+            arrays += [np.asarray(x_fit), np.asarray(y_fit)]
+            x_data, y_data = arrays[3:]
+        # the best fit has the shape of the fitted data
+        shm = shared_memory.SharedMemory(
+            create=True, size=sum(y_data.size if arr is None else arr.size for arr in arrays) * 8)
+        try:
+            specs = list()
+            offset = 0
+            for arr in arrays:
+                shape = y_data.shape if arr is None else arr.shape
+                view = np.ndarray(shape, dtype=np.float64, buffer=shm.buf, offset=offset)
+                if arr is not None:
+                    view[:] = arr
+                specs.append((offset, shape, view.dtype.str))
+                offset += view.nbytes
+            del view
+            inner = self._fit_pool.submit(
+                _fit_in_process, fit_name, est_name, units,
+                None if add_params is None else add_params.dumps(), self.fit_settings(),
+                shm.name, *specs)
+        except Exception:
+            shm.close()
+            shm.unlink()
+            raise
+
+        future = Future()
+
+        def rebuild_result(inner):
+            try:
+                payload = inner.result()
+                model, params = fit['make_model']()
+                result = lmfit.model.ModelResult(model, params)
+                result.params = params.loads(payload['params'])
+                result.result_str_dict = payload['result_str_dict']
+                for attr, value in payload['stats'].items():
+                    setattr(result, attr, value)
+                offset, shape, dtype = specs[2]
+                result.best_fit = np.ndarray(shape, dtype=dtype, buffer=shm.buf,
+                                             offset=offset).copy()
+                result.data = y_data
+                result.userkws = {'x': x_data}
+                future.set_result(result)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                shm.close()
+                shm.unlink()
+
+        inner.add_done_callback(rebuild_result)
+        return future
+
+    def fit_settings(self):
+        """ Settings of the fit logic used by the fit methods.
+
+        @return dict: analytic_jacobian, fit_backend and separable_fit
+        """
+        return {'analytic_jacobian': self.analytic_jacobian, 'fit_backend': self.fit_backend,
+                'separable_fit': self.separable_fit}
+
+    def _get_fit(self, fit_name):
+        """ Return the fit_list entry of a fit by its name, regardless of the dimension. """
+        for dim_fits in self.fit_list.values():
+            if fit_name in dim_fits:
+                return dim_fits[fit_name]
+        raise KeyError('Fit "{0}" not found in FitLogic.'.format(fit_name))
 
     def validate_load_fits(self, fits):
         """ Take fit names and estimators from a dict and check if they are valid.
@@ -315,7 +884,9 @@ class FitContainer(QtCore.QObject):
             raise Exception('Invalid dimension {0}'.format(dimension))
         self.dimension = dimension
         self.fit_list = OrderedDict()
-        # variables for fitting
+        # models of the fit curves by fit name, built on first use
+        self._models = dict()
+        # variables for fitting, default number of points of the fit curve per data point
         self.fit_granularity_fact = 10
         self.current_fit = 'No Fit'
         self.current_fit_param = lmfit.parameter.Parameters()
@@ -323,6 +894,22 @@ class FitContainer(QtCore.QObject):
         self.use_settings = None
         self.units = ['independent variable {0}'.format(i+1) for i in range(self.dim)]
         self.units.append('dependent variable')
+        # warm start: seed do_fit with the parameters of the last good fit instead of estimating
+        self.warm_start = False
+        # fall back to the estimator if the reduced chi square grows by more than this factor
+        # compared to the last fit started from the estimator
+        self.warm_start_chi_factor = 2.0
+        # or if a center moves by more than this fraction of the x range
+        self.warm_start_max_drift = 0.1
+        self.warm_start_fallbacks = 0
+        self._clear_warm_start()
+        # region of interest: fit only windows around the peaks and dips of a trace
+        self.roi = False
+        # half width of the windows in linewidths of the features
+        self.roi_linewidths = 10.0
+        # samples outside the windows, see roi_decimations
+        self.roi_decimation = 'minmax'
+        self.roi_bin_size = 50
 
     def set_units(self, units):
         """ Set units for this fit.
@@ -342,6 +929,7 @@ class FitContainer(QtCore.QObject):
             self.fit_list = self.fit_logic.validate_load_fits(fit_dict)[self.dimension]
         except KeyError:
             self.fit_list = OrderedDict()
+        self._models = dict()
 
     def save_to_dict(self):
         """ Convert self.fit_list to a storable dictionary.
@@ -357,12 +945,113 @@ class FitContainer(QtCore.QObject):
         self.current_fit_param = lmfit.parameter.Parameters()
         self.current_fit_result = None
 
+    def set_warm_start(self, enabled, chi_factor=None, max_drift=None):
+        """ Seed do_fit with the converged parameters of the previous fit.
+
+        In steady state consecutive traces are nearly identical, so the fit can start from the
+        last result instead of running the estimator. The estimator is used again as soon as a
+        warm started fit fails the chi square or the drift check.
+
+        @param bool enabled: enable warm start
+        @param float chi_factor: optional, maximum ratio of the reduced chi square to the one of
+                                 the last fit started from the estimator
+        @param float max_drift: optional, maximum shift of the centers as fraction of the x range
+        """
+        self.warm_start = bool(enabled)
+        if chi_factor is not None:
+            self.warm_start_chi_factor = float(chi_factor)
+        if max_drift is not None:
+            self.warm_start_max_drift = float(max_drift)
+        self.warm_start_fallbacks = 0
+        self._clear_warm_start()
+
+    def set_roi(self, enabled, linewidths=None, decimation=None, bin_size=None):
+        """ Fit only a region of interest around the features of a trace.
+
+        If enabled, do_fit, submit_fit and do_fit_many crop each trace to windows around its
+        peaks and dips before fitting, so the fit cost scales with the features and not with the
+        record length. The samples between the windows are decimated, see _crop_to_roi. The fit
+        curve is still evaluated over the full x range.
+
+        @param bool enabled: enable the region of interest
+        @param float linewidths: optional, half width of the windows in linewidths
+        @param str decimation: optional, samples outside the windows, 'minmax' keeps the
+                               smallest and largest sample of each bin, 'mean' averages the bins,
+                               'none' drops them
+        @param int bin_size: optional, number of samples per bin outside the windows
+        """
+        self.roi = bool(enabled)
+        if linewidths is not None:
+            self.roi_linewidths = float(linewidths)
+        if decimation is not None:
+            if decimation in roi_decimations:
+                self.roi_decimation = decimation
+            else:
+                self.fit_logic.log.error('Unknown decimation "{0}", choose one of {1}.'
+                                         ''.format(decimation, roi_decimations))
+        if bin_size is not None:
+            self.roi_bin_size = max(1, int(bin_size))
+
+    def _get_model(self, fit_name):
+        """ The model of a configured fit, built once per fit name. """
+        if fit_name not in self._models:
+            self._models[fit_name] = self.fit_list[fit_name]['make_model']()[0]
+        return self._models[fit_name]
+
+    def _fit_curve(self, x_data, model=None, params=None):
+        """ Lazy fit curve over the x range of the data, see FitCurve. """
+        return FitCurve(model, params, x_data[0], x_data[-1],
+                        len(x_data) * self.fit_granularity_fact)
+
+    def _crop_to_roi(self, x_data, y_data):
+        """ The data in the region of interest, None if disabled or not cropped. """
+        if not self.roi:
+            return None
+        return _crop_to_roi(x_data, y_data, self.roi_linewidths, self.roi_decimation,
+                            self.roi_bin_size)
+
+    def will_warm_start(self, fit_name=None):
+        """ Tell whether do_fit starts the next fit from the result of the previous one.
+
+        @param str fit_name: optional, name of the fit, defaults to the current fit
+
+        @return bool: True if the next fit of fit_name is warm started
+        """
+        fit_name = self.current_fit if fit_name is None else fit_name
+        return self.warm_start and self._warm_start_fit == fit_name
+
+    def _clear_warm_start(self):
+        self._warm_start_fit = None
+        self._warm_start_params = None
+        self._warm_start_redchi = np.inf
+
+    def _warm_start_estimator(self, x_axis, data, params):
+        """ Estimator replacement setting the parameters of the previous fit. """
+        _reset_parameters(params, self._warm_start_params)
+        return 0, params
+
+    def _check_warm_start(self, result, x_data):
+        """ Check a warm started fit against the previous one.
+
+        @return bool: True if the fit is good, False if it has to be redone with the estimator
+        """
+        if not result.success or not np.isfinite(result.redchi):
+            return False
+        if result.redchi > self.warm_start_chi_factor * self._warm_start_redchi:
+            return False
+        max_shift = self.warm_start_max_drift * abs(x_data[-1] - x_data[0])
+        for name, par in self._warm_start_params.items():
+            if 'center' in name and abs(result.params[name].value - par.value) > max_shift:
+                return False
+        return True
+
     @QtCore.Slot(dict)
     def set_fit_functions(self, fit_functions):
         """ Set the configured fit functions for this container.
             @param fit_functions dict: configured fit functions dictionary
         """
         self.fit_list = fit_functions
+        self._models = dict()
         self.set_current_fit(self.current_fit)
 
     @QtCore.Slot(str)
@@ -402,8 +1091,10 @@ class FitContainer(QtCore.QObject):
                              as x_data.
 
         @return: tuple (fit_x, fit_y, str_dict, fit_result)
-            np.array fit_x: 1D array containing the x values of the fit
-            np.array fit_y: 1D array containing the y values of the fit
+            FitCurveValues fit_x: x values of the fit, array like. The fit curve is evaluated
+                                  on first use, fit_x.curve.evaluate(num) evaluates it with
+                                  num points instead of the default fit granularity.
+            FitCurveValues fit_y: y values of the fit, array like
             OrderedDict str_dict: a dictionary with the relevant fit
                                     parameters, i.e. the result of the fit. Each
                                     entry is again a dict with three entries,
@@ -419,11 +1110,6 @@ class FitContainer(QtCore.QObject):
         """
         self.clear_result()
 
-        fit_x = np.linspace(
-            start=x_data[0],
-            stop=x_data[-1],
-            num=int(len(x_data) * self.fit_granularity_fact))
-
         # set the keyword arguments, which will be passed to the fit.
         kwargs = {
             'x_axis': x_data,
@@ -431,14 +1117,39 @@ class FitContainer(QtCore.QObject):
             'units': self.units,
             'add_params': self.use_settings}
         result = None
+        roi = self._crop_to_roi(x_data, y_data)
+        if roi is not None:
+            kwargs['x_axis'], kwargs['data'] = roi
 
         if self.current_fit in self.fit_list:
-            result = self.fit_list[self.current_fit]['make_fit'](
-                estimator=self.fit_list[self.current_fit]['estimator'],
-                **kwargs)
-        
+            estimated = True
+            if self.will_warm_start():
+                result = self.fit_list[self.current_fit]['make_fit'](
+                    estimator=self._warm_start_estimator,
+                    **kwargs)
+                if self._check_warm_start(result, x_data):
+                    estimated = False
+                else:
+                    self.warm_start_fallbacks += 1
+                    result = None
+            if result is None:
+                estimator = self.fit_list[self.current_fit]['estimator']
+                if roi is not None:
+                    estimator = _estimator_on(estimator, x_data, y_data)
+                result = self.fit_list[self.current_fit]['make_fit'](estimator=estimator,
+                                                                     **kwargs)
+            if self.warm_start and result.success:
+                self._warm_start_fit = self.current_fit
+                self._warm_start_params = result.params
+                # the chi square reference is only taken from estimated fits, so a series of
+                # warm starts can not drift it up step by step
+                if estimated:
+                    self._warm_start_redchi = result.redchi
+            else:
+                self._clear_warm_start()
+
         elif self.current_fit == 'No Fit':
-            fit_y = np.zeros(fit_x.shape)
+            pass
 
         else:
             self.fit_logic.log.warning(
@@ -449,10 +1160,10 @@ class FitContainer(QtCore.QObject):
             self.current_fit = 'No Fit'
 
         if self.current_fit != 'No Fit':
-            # after the fit was performed, retrieve the fitting function and
-            # evaluate the fitted parameters according to the function:
-            model, params = self.fit_list[self.current_fit]['make_model']()
-            fit_y = model.eval(x=fit_x, params=result.params)
+            # the fit curve is only evaluated when used
+            curve = self._fit_curve(x_data, self._get_model(self.current_fit), result.params)
+        else:
+            curve = self._fit_curve(x_data)
 
         if result is not None:
             self.current_fit_param = result.params
@@ -462,4 +1173,134 @@ class FitContainer(QtCore.QObject):
 
         self.sigFitUpdated.emit()
 
-        return fit_x, fit_y, result
+        return curve.x, curve.y, result
+
+    def submit_fit(self, x_data, y_data):
+        """ Schedule the current fit in the fit worker processes of the fit logic.
+
+        In contrast to do_fit, the container state (current_fit_param, current_fit_result) is not
+        changed and no signals are emitted, so several fits can be in flight at once. The
+        parameter hints are taken at the time of submission.
+
+        @param array x_data: 1D np.array with the x values
+        @param array y_data: 1D np.array with the y values
+
+        @return concurrent.futures.Future: future of the tuple (fit_x, fit_y, fit_result), see
+                                           do_fit
+        """
+        future = Future()
+        if self.current_fit not in self.fit_list:
+            curve = self._fit_curve(x_data)
+            future.set_result((curve.x, curve.y, None))
+            return future
+
+        fit = self.fit_list[self.current_fit]
+        model = self._get_model(self.current_fit)
+        roi = self._crop_to_roi(x_data, y_data)
+        x_fit, y_fit = (None, None) if roi is None else roi
+        inner = self.fit_logic.submit_fit(fit['fit_name'], fit['est_name'], x_data, y_data,
+                                          units=self.units, add_params=self.use_settings,
+                                          x_fit=x_fit, y_fit=y_fit)
+
+        def evaluate_fit(inner):
+            try:
+                result = inner.result()
+                curve = self._fit_curve(x_data, model, result.params)
+                future.set_result((curve.x, curve.y, result))
+            except Exception as e:
+                future.set_exception(e)
+
+        inner.add_done_callback(evaluate_fit)
+        return future
+
+    def do_fit_many(self, x_data, y_data, evaluate=False):
+        """ Perform the current fit on many traces sharing the same x values.
+
+        One model and one parameter template are used for all traces, the fitted model is only
+        evaluated if requested. The options of model.fit set up by the fit method file (e.g. the
+        analytic Jacobian of the Lorentzian fits, see prepare_*_fit) and the region of interest
+        are applied as in do_fit. No result_str_dict is built, the container state is not changed
+        and no signals are emitted.
+
+        @param array x_data: 1D np.array with the x values
+        @param array y_data: 2D np.array of shape (N, M) with one trace of M y values per row
+        @param bool evaluate: optional, evaluate the fitted models on the fit granularity grid
+
+        @return: tuple (fit_x, fit_y, results)
+            np.array fit_x: 1D array containing the x values of the fits, None if not evaluated
+            np.array fit_y: 2D array with the fitted model of each trace in a row, None if not
+                            evaluated
+            np.array results: structured array with one row per trace and the fields
+                              'value' and 'stderr' (with one sub field per fit parameter),
+                              'chisqr', 'redchi' and 'success'. Values of failed fits are nan.
+                              None if no fit is set.
+        """
+        y_data = np.asarray(y_data)
+        if y_data.ndim != 2 or y_data.shape[1] != len(x_data):
+            self.fit_logic.log.error('y_data of do_fit_many needs the shape (N, {0}), got {1}.'
+                                     ''.format(len(x_data), y_data.shape))
+            return None, None, None
+        if self.current_fit not in self.fit_list:
+            self.fit_logic.log.warning('No fit set in fit container "{0}", do_fit_many skipped.'
+                                       ''.format(self.name))
+            return None, None, None
+
+        fit = self.fit_list[self.current_fit]
+        model, template = fit['make_model']()
+        names = list(template)
+        try:
+            prepare = getattr(self.fit_logic, 'prepare_{0}_fit'.format(fit['fit_name']))
+        except AttributeError:
+            prepare = None
+
+        param_dtype = [(name, np.float64) for name in names]
+        results = np.zeros(len(y_data), dtype=[('value', param_dtype),
+                                               ('stderr', param_dtype),
+                                               ('chisqr', np.float64),
+                                               ('redchi', np.float64),
+                                               ('success', np.bool_)])
+        for field in ('value', 'stderr'):
+            for name in names:
+                results[field][name] = np.nan
+        results['chisqr'] = np.nan
+        results['redchi'] = np.nan
+
+        if evaluate:
+            fit_x = np.linspace(
+                start=x_data[0],
+                stop=x_data[-1],
+                num=int(len(x_data) * self.fit_granularity_fact))
+            fit_y = np.full((len(y_data), len(fit_x)), np.nan)
+        else:
+            fit_x = fit_y = None
+
+        failed = 0
+        for ii, trace in enumerate(y_data):
+            try:
+                # the estimators estimate on the whole trace, the model is fitted to the ROI
+                error, params = fit['estimator'](x_data, trace, template.copy())
+                params = self.fit_logic._substitute_params(initial_params=params,
+                                                           update_params=self.use_settings)
+                kwargs = dict() if prepare is None else prepare(params, dict())
+                roi = self._crop_to_roi(x_data, trace)
+                x_fit, y_fit = (x_data, trace) if roi is None else roi
+                result = self.fit_logic._fit_model(model, y_fit, x=x_fit, params=params,
+                                                   **kwargs)
+            except Exception:
+                failed += 1
+                continue
+            row = results[ii]
+            for name in names:
+                row['value'][name] = result.params[name].value
+                stderr = result.params[name].stderr
+                row['stderr'][name] = np.nan if stderr is None else stderr
+            row['chisqr'] = result.chisqr
+            row['redchi'] = result.redchi
+            row['success'] = result.success
+            if evaluate:
+                fit_y[ii] = model.eval(x=fit_x, params=result.params)
+
+        if failed > 0:
+            self.fit_logic.log.warning('{0} of {1} fits of "{2}" failed.'
+                                       ''.format(failed, len(y_data), self.current_fit))
+        return fit_x, fit_y, results
@@ -192,9 +192,9 @@ def make_decayexponential_fit(self, x_axis, data, estimator, units=None, add_par
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = exponentialdecay.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(exponentialdecay, data, x=x_axis, params=params, **kwargs)
     except:
-        result = exponentialdecay.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(exponentialdecay, data, x=x_axis, params=params, **kwargs)
         self.log.warning('The exponentialdecay with offset fit did not work. '
                        'Message: {}'.format(str(result.message)))
 
@@ -314,9 +314,9 @@ def make_decayexponentialstretched_fit(self, x_axis, data, estimator, units=None
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = stret_exp_decay_offset.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(stret_exp_decay_offset, data, x=x_axis, params=params, **kwargs)
     except:
-        result = stret_exp_decay_offset.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(stret_exp_decay_offset, data, x=x_axis, params=params, **kwargs)
         self.log.warning('The double exponentialdecay with offset fit did not work. '
                        'Message: {}'.format(str(result.message)))
 
@@ -325,7 +325,7 @@ def make_gaussian_fit(self, x_axis, data, estimator, units=None, add_params=None
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = mod_final.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(mod_final, data, x=x_axis, params=params, **kwargs)
     except:
         self.log.warning('The 1D gaussian peak fit did not work. Error '
                        'message: {0}\n'.format(result.message))
@@ -496,7 +496,7 @@ def make_gaussianlinearoffset_fit(self, x_axis, data, estimator, units=None, add
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = mod_final.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(mod_final, data, x=x_axis, params=params, **kwargs)
     except:
         self.log.warning('The 1D gaussian peak fit did not work. Error '
                        'message: {0}\n'.format(result.message))
@@ -624,9 +624,9 @@ def make_gaussiandouble_fit(self, x_axis, data, estimator,
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = model.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(model, data, x=x_axis, params=params, **kwargs)
     except:
-        result = model.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(model, data, x=x_axis, params=params, **kwargs)
         self.log.warning('The double gaussian dip fit did not work: {0}'.format(
             result.message))
 
@@ -787,9 +787,9 @@ def make_twoDgaussian_fit(self, xy_axes, data, estimator, units=None, add_params
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = gaussian_2d_model.fit(data, x=xy_axes, params=params, **kwargs)
+        result = self._fit_model(gaussian_2d_model, data, x=xy_axes, params=params, **kwargs)
     except:
-        result = gaussian_2d_model.fit(data, x=xy_axes, params=params, **kwargs)
+        result = self._fit_model(gaussian_2d_model, data, x=xy_axes, params=params, **kwargs)
         self.log.warning('The 2D gaussian fit did not work: {0}'.format(
                        result.message))
 
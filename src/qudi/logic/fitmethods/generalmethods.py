@@ -23,9 +23,14 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 import numpy as np
 import lmfit
+import operator
+import time
+from copy import deepcopy
+from scipy.optimize import least_squares
 from scipy.signal import gaussian
 from scipy.ndimage import filters
 from lmfit import Parameters
+from lmfit.model import CompositeModel, ModelResult
 from collections import OrderedDict
 
 ############################################################################
@@ -130,6 +135,44 @@ def _substitute_params(self, initial_params, update_params=None):
 
     return initial_params
 
+def _constraint_derivatives(self, params, var_names, dependent_names):
+    """ Derivatives of constrained parameters with respect to the varying parameters.
+
+    Needed to apply the chain rule in analytic Jacobians, if parameters of a model are tied to
+    others by an expression. Only the constraint expressions are evaluated, not the model.
+
+    @param lmfit.parameter.Parameters params: parameters with the current values
+    @param list var_names: names of the varying parameters
+    @param list dependent_names: names of the parameters constrained by an expression
+
+    @return numpy.array: 2D array d(dependent)/d(variable) of shape
+                         (len(dependent_names), len(var_names))
+    """
+    # only the parameters appearing in the expressions need to be perturbed
+    required = set()
+    pending = list(dependent_names)
+    while pending:
+        for dep in getattr(params[pending.pop()], '_expr_deps', None) or ():
+            if dep in params and dep not in required:
+                required.add(dep)
+                pending.append(dep)
+
+    derivatives = np.zeros((len(dependent_names), len(var_names)))
+    initial = np.array([params[name].value for name in dependent_names])
+    for jj, name in enumerate(var_names):
+        if required and name not in required:
+            continue
+        value = params[name].value
+        step = 1e-6 * abs(value) if value != 0 else 1e-6
+        if params[name].max is not None and value + step > params[name].max:
+            step = -step
+        params[name].value = value + step
+        params.update_constraints()
+        derivatives[:, jj] = ([params[dep].value for dep in dependent_names] - initial) / step
+        params[name].value = value
+    params.update_constraints()
+    return derivatives
+
 def create_fit_string(self, result, model, units=None, decimal_digits_value_given=None,
                       decimal_digits_err_given=None):
     """ This method can produces a well readable string from the results of a fitted model.
@@ -543,14 +586,533 @@ def _check_1D_input(self, x_axis, data, params):
     return error
 
 def _find_peaks(self, x, y, npeaks, hold):
-    ymin = y.min()
-    xpeak = []
-    ypeak = []
-    for i in range(npeaks):
-        m = np.argmax(y)
-        ypeak.append(y[m])
-        xpeak.append(x[m])
-        a = max(0,m-hold)
-        b = min(m+hold+1, len(y)+1)
-        y[a:b] = ymin
-    return xpeak, ypeak 
\ No newline at end of file
+    """ Find the highest peaks of a trace which are more than hold apart.
+
+    The highest sample is taken as peak and the samples within hold of it are excluded, npeaks
+    times. The excluded samples are not overwritten, the free parts of the trace are searched
+    instead, so the data is not changed.
+
+    @param numpy.array x: x values, evenly spaced
+    @param numpy.array y: y values
+    @param int npeaks: number of peaks to find
+    @param float hold: minimal distance of the peaks, in units of x
+
+    @return tuple(list, list): x and y values of the peaks, highest first. Less than npeaks if
+                               the trace is too short for npeaks peaks hold apart.
+    """
+    step = abs(x[-1] - x[0]) / max(len(x) - 1, 1)
+    hold = int(round(hold / step)) if step > 0 else 0
+
+    peaks = list()
+    # (start, stop, index of the maximum) of the parts of the trace not within hold of a peak
+    free = [(0, len(y), int(np.argmax(y)))]
+    while len(peaks) < npeaks and free:
+        ii = max(range(len(free)), key=lambda jj: y[free[jj][2]])
+        start, stop, peak = free.pop(ii)
+        peaks.append(peak)
+        for part_start, part_stop in ((start, peak - hold), (peak + hold + 1, stop)):
+            if part_stop > part_start:
+                free.append((part_start, part_stop,
+                             part_start + int(np.argmax(y[part_start:part_stop]))))
+    return [x[peak] for peak in peaks], [y[peak] for peak in peaks]
+
+
+############################################################################
+#                                                                          #
+#                              Fit backends                                #
+#                                                                          #
+############################################################################
+
+def _fit_model(self, model, data, params, weights=None, **kwargs):
+    """ Fit a model with the fit backend selected in the fit logic.
+
+    Takes the same arguments as lmfit.Model.fit, which is the 'lmfit' backend. The
+    'least_squares' backend runs scipy.optimize.least_squares on plain float arrays, see
+    _fit_least_squares. Options it does not support are left to lmfit. The separable fit mode
+    of the fit logic (separable_fit) always goes through _fit_least_squares.
+
+    @param lmfit.Model model: model to fit
+    @param numpy.array data: data to be fitted
+    @param lmfit.parameter.Parameters params: start parameters of the fit
+    @param numpy.array weights: optional, weights multiplying (model - data)
+    @param kwargs: independent variables of the model, e.g. x, and options of lmfit.Model.fit
+
+    If the fit logic has a fit_model_timer, it is called with the duration of the fit in s.
+
+    @return lmfit.model.ModelResult: result of the fit
+    """
+    timer = getattr(self, 'fit_model_timer', None)
+    start = time.perf_counter()
+    try:
+        separable = getattr(self, 'separable_fit', False)
+        if separable or getattr(self, 'fit_backend', 'lmfit') == 'least_squares':
+            result = self._fit_least_squares(model, data, params, weights, separable=separable,
+                                             **kwargs)
+            if result is not None:
+                return result
+        return model.fit(data, params=params, weights=weights, **kwargs)
+    finally:
+        if timer is not None:
+            timer(time.perf_counter() - start)
+
+
+class _ParameterReference:
+    """ Stands in for a parameter value to find the function argument it is passed to. """
+
+    def __init__(self, name):
+        self.name = name
+        self.value = self
+
+
+def _model_evaluator(self, model, references, independent):
+    """ Evaluate a model directly from a dict of parameter values.
+
+    @param lmfit.Model model: model or composite model
+    @param dict references: _ParameterReference of all parameters by name
+    @param dict independent: values of the independent variables, e.g. {'x': x_axis}
+
+    @return tuple(function, set): evaluate(values), which returns the model for a dict of
+                                  parameter values, and the names of the parameters it uses
+    """
+    if isinstance(model, CompositeModel):
+        left, left_names = self._model_evaluator(model.left, references, independent)
+        right, right_names = self._model_evaluator(model.right, references, independent)
+        op = model.op
+        return lambda values: op(left(values), right(values)), left_names | right_names
+
+    func = model.func
+    fixed_args = dict()
+    param_args = list()
+    for arg, value in model.make_funcargs(references, independent).items():
+        if isinstance(value, _ParameterReference):
+            param_args.append((arg, value.name))
+        else:
+            fixed_args[arg] = value
+
+    def evaluate(values):
+        args = dict(fixed_args)
+        for arg, name in param_args:
+            args[arg] = values[name]
+        return func(**args)
+
+    return evaluate, {name for arg, name in param_args}
+
+
+def _linear_terms(self, model, references, independent, candidates):
+    """ Split a model into terms proportional to its linear parameters and the remainder.
+
+    A parameter enters linearly if it is the only parameter of a component proportional to it,
+    like the amplitude and offset components of the peak and sine models. Sums of components and
+    products with components free of linear parameters keep this, then
+
+        model = terms[None] + sum(values[name] * terms[name] for the linear names)
+
+    @param lmfit.Model model: model or composite model
+    @param dict references: _ParameterReference of all parameters by name
+    @param dict independent: values of the independent variables, e.g. {'x': x_axis}
+    @param set candidates: names of the parameters which may be linear, e.g. the varying ones
+
+    @return tuple(function, set, set): terms(values), which returns the terms in a dict, the
+                                       names of the linear parameters and of the parameters
+                                       the terms depend on. terms raises a ValueError if the
+                                       model is not linear in the linear parameters.
+    """
+    if not isinstance(model, CompositeModel):
+        evaluate, names = self._model_evaluator(model, references, independent)
+        if len(names) == 1 and names <= candidates:
+            name = next(iter(names))
+            term = evaluate({name: 1.0})
+            if np.allclose(evaluate({name: 2.0}), 2 * term):
+                return lambda values: {name: term}, names, set()
+        return lambda values: {None: evaluate(values)}, set(), names
+
+    left, left_linear, left_other = self._linear_terms(model.left, references, independent,
+                                                       candidates)
+    right, right_linear, right_other = self._linear_terms(model.right, references, independent,
+                                                          candidates)
+    op = model.op
+    if op is operator.add or op is operator.sub:
+        def terms(values):
+            out = left(values)
+            for key, term in right(values).items():
+                term = term if op is operator.add else -term
+                out[key] = out[key] + term if key in out else term
+            return out
+    elif op is operator.mul:
+        def terms(values):
+            left_terms, right_terms = left(values), right(values)
+            if list(left_terms) == [None]:
+                factor, out = left_terms[None], right_terms
+            elif list(right_terms) == [None]:
+                factor, out = right_terms[None], left_terms
+            else:
+                raise ValueError('Product of two terms with linear parameters.')
+            return {key: term * factor for key, term in out.items()}
+    else:
+        def terms(values):
+            left_terms, right_terms = left(values), right(values)
+            if list(left_terms) != [None] or list(right_terms) != [None]:
+                raise ValueError('Linear parameters in a term combined by {0}.'.format(op))
+            return {None: op(left_terms[None], right_terms[None])}
+    return terms, left_linear | right_linear, left_other | right_other
+
+
+class _BoundsTransform:
+    """ Map bounded parameter values to unbounded internal values, as lmfit does (MINUIT). """
+
+    def __init__(self, lower, upper):
+        self.lower = lower
+        self.upper = upper
+        self.lower_only = np.isfinite(lower) & ~np.isfinite(upper)
+        self.upper_only = ~np.isfinite(lower) & np.isfinite(upper)
+        self.both = np.isfinite(lower) & np.isfinite(upper)
+        self.half_span = np.where(self.both, (upper - lower) / 2, 1.0)
+
+    def to_internal(self, values):
+        internal = np.array(values, dtype=np.float64)
+        mask = self.lower_only
+        internal[mask] = np.sqrt((values[mask] - self.lower[mask] + 1) ** 2 - 1)
+        mask = self.upper_only
+        internal[mask] = np.sqrt((self.upper[mask] - values[mask] + 1) ** 2 - 1)
+        mask = self.both
+        internal[mask] = np.arcsin(
+            np.clip((values[mask] - self.lower[mask]) / self.half_span[mask] - 1, -1, 1))
+        return internal
+
+    def to_external(self, internal):
+        values = np.array(internal, dtype=np.float64)
+        mask = self.lower_only
+        values[mask] = self.lower[mask] - 1 + np.sqrt(internal[mask] ** 2 + 1)
+        mask = self.upper_only
+        values[mask] = self.upper[mask] + 1 - np.sqrt(internal[mask] ** 2 + 1)
+        mask = self.both
+        values[mask] = self.lower[mask] + (np.sin(internal[mask]) + 1) * self.half_span[mask]
+        return values
+
+    def gradient(self, internal):
+        """ Derivative of the external with respect to the internal values. """
+        gradient = np.ones(len(internal))
+        mask = self.lower_only
+        gradient[mask] = internal[mask] / np.sqrt(internal[mask] ** 2 + 1)
+        mask = self.upper_only
+        gradient[mask] = -internal[mask] / np.sqrt(internal[mask] ** 2 + 1)
+        mask = self.both
+        gradient[mask] = np.cos(internal[mask]) * self.half_span[mask]
+        return gradient
+
+
+def _fit_least_squares(self, model, data, params, weights=None, method='leastsq', fit_kws=None,
+                       scale_covar=True, max_nfev=None, nan_policy='raise', separable=False,
+                       **kwargs):
+    """ Fit a model with scipy.optimize.least_squares on plain float arrays.
+
+    The model functions are called directly with the parameter values and the constraint
+    expressions are compiled once, instead of going through the Parameter objects of lmfit in
+    every iteration. Only the expressions the model depends on are evaluated while fitting.
+
+    By default the Levenberg-Marquardt method of least_squares is used with the bounds
+    transformed away like in lmfit, so the fits take the same steps as with lmfit's leastsq.
+    With method 'trf' or 'dogbox' in fit_kws the bounds are passed to the solver instead.
+    An analytic Jacobian given for leastsq (fit_kws Dfun and col_deriv) is used as well, the
+    Parameters are only updated for its calls. Uncertainties follow lmfit: the covariance is
+    estimated from the Jacobian at the solution (scaled by the reduced chi-square) and
+    propagated linearly to constrained parameters.
+
+    In the separable mode (variable projection) the parameters entering the model linearly,
+    i.e. the amplitudes and the offset of the peak and sine models (see _linear_terms), are
+    solved for by linear least squares in every step. Only the other parameters, e.g. centers
+    and widths, are left to the nonlinear minimizer. If linear parameters end up outside of
+    their bounds, the full problem is fitted from there. The uncertainties are taken from the
+    Jacobian of the full problem at the solution.
+
+    @param lmfit.Model model: model to fit
+    @param numpy.array data: data to be fitted
+    @param lmfit.parameter.Parameters params: start parameters of the fit
+    @param numpy.array weights: optional, weights multiplying (model - data)
+    @param str method: 'leastsq' or 'least_squares', other minimizers are not supported
+    @param dict fit_kws: optional, keyword arguments for scipy.optimize.least_squares, besides
+                         Dfun and col_deriv of leastsq
+    @param bool scale_covar: scale the covariance with the reduced chi-square
+    @param int max_nfev: optional, maximum number of function evaluations
+    @param str nan_policy: only 'raise' is supported
+    @param bool separable: solve for the linear parameters separately (variable projection)
+    @param kwargs: independent variables of the model, e.g. x
+
+    @return lmfit.model.ModelResult: result of the fit, same attributes as from lmfit. None if
+                                     the fit needs features of lmfit.
+    """
+    original_fit_kws = fit_kws
+    fit_kws = dict() if fit_kws is None else dict(fit_kws)
+    jacobian_function = fit_kws.pop('Dfun', None)
+    col_deriv = fit_kws.pop('col_deriv', False)
+    if method not in ('leastsq', 'least_squares') or nan_policy != 'raise' \
+            or set(kwargs) - set(model.independent_vars):
+        return None
+
+    fitted = deepcopy(params)
+    fitted.update_constraints()
+    var_names = [name for name, par in fitted.items() if par.vary and not par.expr]
+
+    # constraint expressions, ordered such that each one only depends on earlier ones
+    try:
+        codes = {name: compile(par.expr, name, 'eval')
+                 for name, par in fitted.items() if par.expr}
+    except SyntaxError:
+        return None
+    expr_names = list()
+    pending = [name for name in fitted if name in codes]
+    while pending:
+        ready = [name for name in pending
+                 if not (set(codes[name].co_names) & set(codes)) - set(expr_names)]
+        if not ready:
+            return None
+        expr_names.extend(ready)
+        pending = [name for name in pending if name not in ready]
+
+    data = np.asarray(data, dtype=np.float64)
+    references = {name: _ParameterReference(name) for name in fitted}
+    evaluate, model_names = self._model_evaluator(model, references, kwargs)
+
+    required = set()
+    pending = [name for name in model_names if name in codes]
+    while pending:
+        name = pending.pop()
+        if name not in required:
+            required.add(name)
+            pending.extend(dep for dep in codes[name].co_names if dep in codes)
+    model_expr_names = [name for name in expr_names if name in required]
+
+    namespace = dict(fitted._asteval.symtable)
+    namespace.update((name, par.value) for name, par in fitted.items())
+
+    def set_values(names, values, expressions):
+        namespace.update(zip(names, values))
+        for name in expressions:
+            namespace[name] = eval(codes[name], namespace)
+
+    lower = np.array([fitted[name].min for name in var_names], dtype=np.float64)
+    upper = np.array([fitted[name].max for name in var_names], dtype=np.float64)
+    start = np.clip([fitted[name].value for name in var_names], lower, upper)
+
+    set_values(var_names, start, expr_names)
+    init_fit = evaluate(namespace)
+
+    def model_residual(values):
+        set_values(var_names, values, model_expr_names)
+        out = evaluate(namespace) - data
+        if weights is not None:
+            out *= weights
+        return np.ravel(out)
+
+    def analytic_jacobian(values):
+        for name, value in zip(var_names, values):
+            fitted[name].value = value
+        fitted.update_constraints()
+        jac = jacobian_function(fitted, data, weights, **kwargs)
+        return jac.T if col_deriv else jac
+
+    # variable projection: the linear parameters are solved for in each step
+    linear_names = list()
+    if separable:
+        referenced = set()
+        for name in model_expr_names:
+            referenced.update(codes[name].co_names)
+        candidates = set(var_names) - referenced
+        try:
+            model_terms, linear, other = self._linear_terms(model, references, kwargs,
+                                                            candidates)
+            if linear & other:
+                model_terms, linear, other = self._linear_terms(model, references, kwargs,
+                                                                candidates - other)
+            model_terms(namespace)
+        except ValueError:
+            linear = set()
+        if len(linear) < len(var_names):
+            linear_names = [name for name in var_names if name in linear]
+    nonlinear = [ii for ii, name in enumerate(var_names) if name not in linear_names]
+    nonlinear_names = [var_names[ii] for ii in nonlinear]
+
+    if linear_names:
+        linear_index = [var_names.index(name) for name in linear_names]
+        flat_weights = None if weights is None else np.ravel(weights)[:, np.newaxis]
+
+        def project():
+            """ Solve for the linear parameters, return the residual and the design matrix. """
+            terms = model_terms(namespace)
+            target = np.ravel(data - terms.pop(None, 0.0))
+            design = np.empty((len(target), len(linear_names)))
+            for jj, name in enumerate(linear_names):
+                design[:, jj] = np.ravel(np.broadcast_to(terms[name], data.shape))
+            if flat_weights is not None:
+                design *= flat_weights
+                target = target * flat_weights[:, 0]
+            # Normal equations of the column normalized design, there are only a few columns.
+            # Directions the columns hardly span (e.g. a very broad peak next to the offset)
+            # are left out, otherwise the linear parameters run away along them.
+            norms = np.sqrt(np.einsum('ij,ij->j', design, design))
+            norms[norms == 0] = 1.0
+            eigenvalues, eigenvectors = np.linalg.eigh(
+                np.dot(design.T, design) / np.outer(norms, norms))
+            keep = eigenvalues > 1e-10 * eigenvalues[-1]
+            eigenvectors = eigenvectors[:, keep]
+            coefficients = np.dot(eigenvectors, np.dot(np.dot(target, design) / norms,
+                                                       eigenvectors) / eigenvalues[keep]) / norms
+            namespace.update(zip(linear_names, coefficients))
+            return np.dot(design, coefficients) - target, design
+
+    # the parameters span many orders of magnitude (e.g. a linewidth of 1e-7 s), scale them by
+    # the Jacobian and use relative finite difference steps, like minpack in lmfit
+    options = {'method': 'lm', 'x_scale': 'jac', 'diff_step': np.sqrt(np.finfo(float).eps),
+               'ftol': 1.5e-8, 'xtol': 1.5e-8}
+    options.update(fit_kws)
+    if max_nfev is not None:
+        options['max_nfev'] = max_nfev
+    if options['method'] == 'lm':
+        bounds = _BoundsTransform(lower[nonlinear], upper[nonlinear])
+        internal_start = bounds.to_internal(start[nonlinear])
+    else:
+        bounds = None
+        internal_start = start[nonlinear]
+        options['bounds'] = (lower[nonlinear], upper[nonlinear])
+
+    def external(internal):
+        return internal if bounds is None else bounds.to_external(internal)
+
+    if linear_names:
+        def residual(internal):
+            set_values(nonlinear_names, external(internal), model_expr_names)
+            return project()[0]
+
+        if jacobian_function is not None:
+            # Kaufman's approximation: derivatives with respect to the nonlinear parameters,
+            # without the parts the linear parameters can compensate for
+            def jacobian(internal):
+                set_values(nonlinear_names, external(internal), model_expr_names)
+                design = project()[1]
+                jac = analytic_jacobian([namespace[name] for name in var_names])[:, nonlinear]
+                basis = np.linalg.qr(design)[0]
+                jac = jac - np.dot(basis, np.dot(basis.T, jac))
+                return jac if bounds is None else jac * bounds.gradient(internal)
+            options['jac'] = jacobian
+    else:
+        def residual(internal):
+            return model_residual(external(internal))
+
+        if jacobian_function is not None:
+            def jacobian(internal):
+                jac = analytic_jacobian(external(internal))
+                return jac if bounds is None else jac * bounds.gradient(internal)
+            options['jac'] = jacobian
+
+    solution = least_squares(residual, internal_start, **options)
+
+    if linear_names:
+        set_values(nonlinear_names, external(solution.x), model_expr_names)
+        fun = project()[0]
+        best = np.array([namespace[name] for name in var_names])
+        # A linear parameter outside of its bounds (e.g. the amplitude of a peak not in the
+        # data) is only rejected at the end, clamping it while fitting would freeze the
+        # parameters of its component. Continue with the full problem from here instead.
+        outside = (best < lower) | (best > upper)
+        if np.any(outside):
+            restart = deepcopy(params)
+            for name, value in zip(var_names, np.where(outside, start, best)):
+                restart[name].value = value
+            result = self._fit_least_squares(model, data, restart, weights, method=method,
+                                             fit_kws=original_fit_kws, scale_covar=scale_covar,
+                                             max_nfev=max_nfev, nan_policy=nan_policy,
+                                             **kwargs)
+            result.init_params = deepcopy(params)
+            result.nfev += solution.nfev
+            return result
+        # uncertainties from the Jacobian of the full problem
+        if jacobian_function is not None:
+            full_jacobian = analytic_jacobian(best)
+        else:
+            full_jacobian = np.empty((len(fun), len(var_names)))
+            for jj, value in enumerate(best):
+                step = np.sqrt(np.finfo(float).eps) * (abs(value) if value != 0 else 1.0)
+                shifted = best.copy()
+                shifted[jj] += step
+                full_jacobian[:, jj] = (model_residual(shifted) - fun) / step
+        gradient = None
+    else:
+        best = external(solution.x)
+        fun = solution.fun
+        full_jacobian = solution.jac
+        gradient = None if bounds is None else bounds.gradient(solution.x)
+
+    set_values(var_names, best, expr_names)
+    best_fit = evaluate(namespace)
+    ndata = len(fun)
+    nvarys = len(var_names)
+    nfree = ndata - nvarys
+    chisqr = float(np.dot(fun, fun))
+    redchi = chisqr / max(1, nfree)
+
+    try:
+        covar = np.linalg.inv(np.dot(full_jacobian.T, full_jacobian))
+        if gradient is not None:
+            covar *= np.outer(gradient, gradient)
+        if scale_covar:
+            covar *= redchi
+        if not np.all(np.isfinite(covar)):
+            covar = None
+    except np.linalg.LinAlgError:
+        covar = None
+
+    for name, start_value, value in zip(var_names, start, best):
+        fitted[name].init_value = start_value
+        fitted[name].value = value
+    fitted.update_constraints()
+
+    errorbars = covar is not None and np.all(np.diag(covar) > 0)
+    if errorbars:
+        stderr = np.sqrt(np.diag(covar))
+        for ii, name in enumerate(var_names):
+            fitted[name].stderr = stderr[ii]
+            fitted[name].correl = {other: covar[ii, jj] / (stderr[ii] * stderr[jj])
+                                   for jj, other in enumerate(var_names) if jj != ii}
+        # linear error propagation into the constrained parameters
+        if expr_names:
+            values = np.array([namespace[name] for name in expr_names])
+            gradient = np.zeros((len(expr_names), nvarys))
+            for jj, value in enumerate(best):
+                step = 1e-8 * abs(value) if value != 0 else 1e-12
+                shifted = best.copy()
+                shifted[jj] += step
+                set_values(var_names, shifted, expr_names)
+                gradient[:, jj] = ([namespace[name] for name in expr_names] - values) / step
+            set_values(var_names, best, expr_names)
+            variance = np.einsum('ij,jk,ik->i', gradient, covar, gradient)
+            for name, var in zip(expr_names, variance):
+                fitted[name].stderr = np.sqrt(var) if var >= 0 else None
+    else:
+        for name in var_names + expr_names:
+            fitted[name].stderr = None
+
+    result = ModelResult(model, params, data=data, weights=weights, method='least_squares',
+                         fcn_kws=kwargs, scale_covar=scale_covar)
+    result.params = fitted
+    result.var_names = var_names
+    result.init_vals = list(start)
+    result.init_fit = init_fit
+    result.best_fit = best_fit
+    result.init_values = {name: params[name].value for name in model.param_names}
+    result.best_values = {name: fitted[name].value for name in model.param_names}
+    result.residual = fun
+    result.covar = covar
+    result.errorbars = errorbars
+    result.nfev = solution.nfev
+    result.success = solution.success
+    result.status = solution.status
+    result.message = solution.message
+    result.ndata = ndata
+    result.nvarys = nvarys
+    result.nfree = nfree
+    result.chisqr = chisqr
+    result.redchi = redchi
+    neg2_log_likel = ndata * np.log(max(chisqr, 1e-250 * ndata) / ndata)
+    result.aic = neg2_log_likel + 2 * nvarys
+    result.bic = neg2_log_likel + np.log(ndata) * nvarys
+    return result
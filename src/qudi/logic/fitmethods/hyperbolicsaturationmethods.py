@@ -106,7 +106,7 @@ def make_hyperbolicsaturation_fit(self, x_axis, data, estimator, units=None, add
         initial_params=params,
         update_params=add_params)
 
-    result = mod_final.fit(data, x=x_axis, params=params, **kwargs)
+    result = self._fit_model(mod_final, data, x=x_axis, params=params, **kwargs)
 
     return result
 
@@ -212,7 +212,7 @@ def make_linear_fit(self, x_axis, data, estimator, units=None, add_params=None,
 
     params = self._substitute_params(initial_params=params, update_params=add_params)
 
-    result = linear.fit(data, x=x_axis, params=params, **kwargs)
+    result = self._fit_model(linear, data, x=x_axis, params=params, **kwargs)
 
     if units is None:
         units = ['arb. unit', 'arb. unit']
@@ -275,6 +275,120 @@ def make_lorentziantriple_model(self):
 
     return self.make_multiplelorentzian_model(no_of_functions=3)
 
+#################################################
+#    Analytic Jacobian of the Lorentzian models #
+#################################################
+
+def make_lorentzian_jacobian(self, no_of_functions=1):
+    """ Create the analytic Jacobian of the (multiple) Lorentzian model with offset.
+
+    @param int no_of_functions: number of Lorentzians, the parameter names are the ones of
+                                make_multiplelorentzian_model
+
+    @return function: Jacobian with respect to the varying parameters, called by the minimizer
+                      as jacobian(params, data, weights, x). It returns one row of
+                      derivatives per varying parameter (col_deriv=True). Parameters tied to
+                      others by an expression are taken into account by the chain rule.
+
+    With D = (x_0 - x)^2 + sigma^2 the partial derivatives of L(x; I, x_0, sigma) are
+
+        dL/dI = sigma^2 / D
+        dL/dx_0 = -2 * I * sigma^2 * (x_0 - x) / D^2
+        dL/dsigma = 2 * I * sigma * (x_0 - x)^2 / D^2
+    """
+    if no_of_functions == 1:
+        prefixes = ['']
+    else:
+        prefixes = ['l{0:d}_'.format(ii) for ii in range(no_of_functions)]
+
+    def lorentzian_jacobian(params, data, weights, x, **kwargs):
+        partials = OrderedDict()
+        for prefix in prefixes:
+            amplitude = params['{0}amplitude'.format(prefix)].value
+            center = params['{0}center'.format(prefix)].value
+            sigma = params['{0}sigma'.format(prefix)].value
+            diff = center - x
+            inv_denominator = 1 / (np.square(diff) + sigma ** 2)
+            lorentzian = sigma ** 2 * inv_denominator
+            partials['{0}amplitude'.format(prefix)] = lorentzian
+            partials['{0}center'.format(prefix)] = -2 * amplitude * diff * lorentzian * inv_denominator
+            partials['{0}sigma'.format(prefix)] = (2 * amplitude * sigma * np.square(diff)
+                                                   * np.square(inv_denominator))
+        partials['offset'] = np.ones(len(x))
+
+        var_names = [name for name, par in params.items() if par.vary]
+        # one row per varying parameter, the layout minpack uses internally (col_deriv)
+        jacobian = np.zeros((len(var_names), len(x)))
+        for jj, name in enumerate(var_names):
+            if name in partials:
+                jacobian[jj] = partials[name]
+
+        dependent_names = [name for name in partials if params[name].expr]
+        if dependent_names:
+            chain = self._constraint_derivatives(params, var_names, dependent_names)
+            for ii, name in enumerate(dependent_names):
+                jacobian += np.outer(chain[ii], partials[name])
+
+        if weights is not None:
+            jacobian *= weights
+        return jacobian
+
+    return lorentzian_jacobian
+
+
+def _use_lorentzian_jacobian(self, no_of_functions, params, kwargs):
+    """ Pass the analytic Jacobian to the minimizer, unless switched off in the fit logic.
+
+    The switch (analytic_jacobian) allows to compare with the numeric derivatives. Only the
+    Levenberg-Marquardt (leastsq) minimizer takes a Jacobian function, the least_squares fit
+    backend uses it as well.
+
+    lmfit scales the derivatives of bounded parameters by the derivative of the bounds
+    transformation, which is exactly zero on a bound. Varying parameters starting on a bound
+    are therefore moved inside by a negligible amount, the numeric derivatives do not get stuck
+    there since they are taken with a finite step.
+
+    @param int no_of_functions: number of Lorentzians in the model
+    @param lmfit.parameter.Parameters params: start parameters of the fit, changed in place
+    @param dict kwargs: keyword arguments for model.fit
+
+    @return dict: keyword arguments for model.fit
+    """
+    if not getattr(self, 'analytic_jacobian', True) \
+            or kwargs.get('method', 'leastsq') != 'leastsq' or 'fit_kws' in kwargs:
+        return kwargs
+
+    for par in params.values():
+        if not par.vary:
+            continue
+        if par.value <= par.min:
+            span = par.max - par.min if np.isfinite(par.max) else max(abs(par.min), 1.0)
+            par.value = par.min + 1e-6 * span
+        elif par.value >= par.max:
+            span = par.max - par.min if np.isfinite(par.min) else max(abs(par.max), 1.0)
+            par.value = par.max - 1e-6 * span
+
+    kwargs = dict(kwargs)
+    kwargs['fit_kws'] = {'Dfun': self.make_lorentzian_jacobian(no_of_functions),
+                         'col_deriv': True}
+    return kwargs
+
+
+def prepare_lorentzian_fit(self, params, kwargs):
+    """ Options of model.fit for the lorentzian fit, see _use_lorentzian_jacobian. """
+    return self._use_lorentzian_jacobian(1, params, kwargs)
+
+
+def prepare_lorentziandouble_fit(self, params, kwargs):
+    """ Options of model.fit for the double lorentzian fit, see _use_lorentzian_jacobian. """
+    return self._use_lorentzian_jacobian(2, params, kwargs)
+
+
+def prepare_lorentziantriple_fit(self, params, kwargs):
+    """ Options of model.fit for the triple lorentzian fit, see _use_lorentzian_jacobian. """
+    return self._use_lorentzian_jacobian(3, params, kwargs)
+
+
 ################################################################################
 #                                                                              #
 #                    Fit functions and their estimators                        #
@@ -308,10 +422,11 @@ def make_lorentzian_fit(self, x_axis, data, estimator, units=None,
 
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
+    kwargs = self.prepare_lorentzian_fit(params, kwargs)
     try:
-        result = model.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(model, data, x=x_axis, params=params, **kwargs)
     except:
-        result = model.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(model, data, x=x_axis, params=params, **kwargs)
         self.log.warning('The 1D lorentzian fit did not work. Error '
                          'message: {0}\n'.format(result.message))
 
@@ -461,10 +576,11 @@ def make_lorentziandouble_fit(self, x_axis, data, estimator, units=None, add_par
     # redefine values of additional parameters
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
+    kwargs = self.prepare_lorentziandouble_fit(params, kwargs)
     try:
-        result = model.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(model, data, x=x_axis, params=params, **kwargs)
     except:
-        result = model.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(model, data, x=x_axis, params=params, **kwargs)
         self.log.error('The double lorentzian fit did not '
                      'work: {0}'.format(result.message))
 
@@ -782,10 +898,11 @@ def make_lorentziantriple_fit(self, x_axis, data, estimator, units=None,
 
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
+    kwargs = self.prepare_lorentziantriple_fit(params, kwargs)
     try:
-        result = model.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(model, data, x=x_axis, params=params, **kwargs)
     except:
-        result = model.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(model, data, x=x_axis, params=params, **kwargs)
         self.log.error('The triple lorentzian fit did not '
                        'work: {0}'.format(result.message))
 
@@ -1097,8 +1214,6 @@ def estimate_lorentziantriple_sidebands(self, x_axis, data, params,
     data_level = data_smooth - data
     amplitude = data_level.max()
     
-    xpeak, ypeak = self._find_peaks(x_axis, data - offset, 3, 2000)
-    xpeak, ypeak = zip(*sorted(zip(xpeak, ypeak)))
     params_single = Parameters()
     params_single.add(name='amplitude', value=amplitude)
     params_single.add(name='sigma', value=np.inf)
@@ -1110,6 +1225,19 @@ def estimate_lorentziantriple_sidebands(self, x_axis, data, params,
     center = result['center'].value
     amplitude = result['amplitude'].value
 
+    # The sidebands are the highest peaks outside the resonance. Its extent is taken from the data,
+    # up to where it drops to a tenth of its height, the estimated sigma is not reliable enough.
+    level = data - offset
+    peak = np.argmax(level)
+    below = level < 0.1 * level[peak]
+    extent = max(np.argmax(below[peak:]), np.argmax(below[peak::-1]))
+    hold = 2 * extent * abs(x_axis[-1] - x_axis[0]) / (len(x_axis) - 1)
+    xpeak, ypeak = self._find_peaks(x_axis, level, 3, hold)
+    if len(xpeak) < 3:
+        xpeak = (center - 50 * sigma, center, center + 50 * sigma)
+        ypeak = (amplitude / 6, amplitude, amplitude / 6)
+    xpeak, ypeak = zip(*sorted(zip(xpeak, ypeak)))
+
     params['l1_center'].set(value=center)
     params['l0_center'].set(value=xpeak[0])
     params['l2_center'].set(value=xpeak[2])
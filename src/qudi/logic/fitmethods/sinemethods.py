@@ -23,7 +23,6 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 import numpy as np
 from lmfit.models import Model
-from qudi.util.math import compute_ft
 
 
 ################################################################################
@@ -402,6 +401,61 @@ def make_sinetriplewiththreeexpdecay_model(self, prefix=None):
 ################################################################################
 
 
+def _sine_spectrum(self, x_axis, data, zeropad_num=1):
+    """ Amplitude spectrum of evenly sampled data from a zero padded real FFT.
+
+    Same normalization as qudi.util.math.compute_ft with baseline correction, but only the
+    positive frequencies are computed and the padded length is rounded up to a power of two.
+
+    @param numpy.array x_axis: 1D axis values, evenly spaced
+    @param numpy.array data: 1D data, same dimension as x_axis
+    @param int zeropad_num: the data is padded to at least (zeropad_num + 1) times its length
+
+    @return tuple(numpy.array, numpy.array): frequencies and amplitudes of the spectrum
+    """
+    n_fft = 1 << int(np.ceil(np.log2(len(data) * (zeropad_num + 1))))
+    stepsize = (x_axis[-1] - x_axis[0]) / (len(x_axis) - 1)
+    dft_y = np.abs(np.fft.rfft(data - data.mean(), n_fft)) * (2 / len(data))
+    return np.fft.rfftfreq(n_fft, d=stepsize), dft_y
+
+
+def _sine_peak_frequency(self, dft_x, dft_y):
+    """ Frequency of the highest peak in a spectrum.
+
+    The peak position is interpolated between the frequency bins with a parabola through the
+    logarithm of the highest bin and its neighbours.
+
+    @param numpy.array dft_x: frequencies, evenly spaced
+    @param numpy.array dft_y: amplitudes
+
+    @return float: frequency of the peak
+    """
+    index = dft_y.argmax()
+    if index == 0 or index == len(dft_y) - 1:
+        return abs(dft_x[index])
+    left, center, right = np.log(np.maximum(dft_y[index - 1:index + 2],
+                                            np.finfo(float).tiny))
+    curvature = left - 2 * center + right
+    shift = 0.5 * (left - right) / curvature if curvature < 0 else 0
+    return abs(dft_x[index] + shift * (dft_x[1] - dft_x[0]))
+
+
+def _sine_phase(self, x_axis, data, frequency):
+    """ Phase of a sine with known frequency in the data.
+
+    The data is demodulated with the frequency, the phase of the sum is the phase of the sine.
+
+    @param numpy.array x_axis: 1D axis values
+    @param numpy.array data: 1D data without offset, same dimension as x_axis
+    @param float frequency: frequency of the sine
+
+    @return float: phase of sin(2*pi*frequency*x + phase) in the interval [-pi, pi]
+    """
+    demodulated = np.dot(data, np.exp(-2j * np.pi * frequency * x_axis))
+    # sin(t + phase) = cos(t + phase - pi/2)
+    return np.angle(demodulated * 1j)
+
+
 def estimate_baresine(self, x_axis, data, params):
     """ Bare sine estimator with a frequency and phase.
 
@@ -426,34 +480,13 @@ def estimate_baresine(self, x_axis, data, params):
 
     # calculate dft with zeropadding to obtain nicer interpolation between the
     # appearing peaks.
-    dft_x, dft_y = compute_ft(x_axis, data, zeropad_num=1)
+    dft_x, dft_y = self._sine_spectrum(x_axis, data, zeropad_num=1)
 
     stepsize = x_axis[1]-x_axis[0]  # for frequency axis
-    frequency_max = np.abs(dft_x[np.log(dft_y).argmax()])
-
-    # find minimal distance to the next meas point in the corresponding time value>
-    min_x_diff = np.ediff1d(x_axis).min()
-
-    # How many points are used to sample the estimated frequency with min_x_diff:
-    iter_steps = int(1/(frequency_max*min_x_diff))
-    if iter_steps < 1:
-        iter_steps = 1
-
-    sum_res = np.zeros(iter_steps)
-
-    # Procedure: Create sin waves with different phases and perform a summation.
-    #            The sum shows how well the sine was fitting to the actual data.
-    #            The best fitting sine should be a maximum of the summed time
-    #            trace.
-
-    for iter_s in range(iter_steps):
-        func_val = np.sin(2*np.pi*frequency_max*x_axis + iter_s/iter_steps *2*np.pi)
-        sum_res[iter_s] = np.abs(data - func_val).sum()
+    frequency_max = self._sine_peak_frequency(dft_x, dft_y)
 
-    # The minimum indicates where the sine function was fittng the worst,
-    # therefore subtract pi. This will also ensure that the estimated phase will
-    # be in the interval [-pi,pi].
-    phase = sum_res.argmax()/iter_steps *2*np.pi - np.pi
+    # phase from the demodulation with the estimated frequency, in the interval [-pi,pi]
+    phase = self._sine_phase(x_axis, data - data.mean(), frequency_max)
 
     params['frequency'].set(value=frequency_max, min=0.0, max=1/stepsize*3)
     params['phase'].set(value=phase, min=-np.pi, max=np.pi)
@@ -491,66 +524,21 @@ def estimate_sinewithoutoffset(self, x_axis, data, params):
     # estimate amplitude
     ampl_val = max(np.abs(data.min()), np.abs(data.max()))
 
+    if np.isclose(x_axis[-1] - x_axis[0], 0.0, atol=1e-12):
+        self.log.error('The passed x_axis for the sinus estimation contains the same values!'
+                       ' Cannot do the fit!')
+        return -1, params
+
     # calculate dft with zeropadding to obtain nicer interpolation between the
     # appearing peaks.
-    dft_x, dft_y = compute_ft(x_axis, data, zeropad_num=1)
+    dft_x, dft_y = self._sine_spectrum(x_axis, data, zeropad_num=1)
 
     stepsize = x_axis[1] - x_axis[0]  # for frequency axis
 
-    # remove the zero values so that it is still possible to take
-    # the logarithm. The logarithm acts as a non linear filter
-    # which decrease the noise in the dft and enhances the
-    # prominent frequencies.
-    indicies = np.where(dft_y > 0.0)
-
-    dft_x_red = dft_x[indicies]
-    dft_y_red = dft_y[indicies]
-
-    frequency_max = np.abs(dft_x_red[np.log(dft_y_red).argmax()])
-
-    # find minimal distance to the next meas point in the corresponding time value>
-    diff_array = np.ediff1d(x_axis)
-    min_x_diff = diff_array.min()
-
-    # if at least two identical values are in the array, then the difference is of course zero,
-    # catch that case.
-    for tries, diff_array_step in enumerate(diff_array):
-        if np.isclose(min_x_diff, 0.0, atol=1e-12):
-            index = np.argmin(diff_array)
-            diff_array = np.delete(diff_array, index)
-            min_x_diff = diff_array.min()
-
-        else:
-            if len(diff_array) == 0:
-                self.log.error(
-                    'The passed x_axis for the sinus estimation contains the same values!'
-                    ' Cannot do the fit!')
-
-                return -1, params
-            else:
-                min_x_diff = diff_array.min()
-            break
-
-    # How many points are used to sample the estimated frequency with min_x_diff:
-    iter_steps = int(1/(frequency_max*min_x_diff))
-    if iter_steps < 1:
-        iter_steps = 1
-
-    sum_res = np.zeros(iter_steps)
-
-    # Procedure: Create sin waves with different phases and perform a summation.
-    #            The sum shows how well the sine was fitting to the actual data.
-    #            The best fitting sine should be a maximum of the summed time
-    #            trace.
-
-    for iter_s in range(iter_steps):
-        func_val = ampl_val * np.sin(2*np.pi*frequency_max*x_axis + iter_s/iter_steps*2*np.pi)
-        sum_res[iter_s] = np.abs(data - func_val).sum()
-
-    # The minimum indicates where the sine function was fitting the worst,
-    # therefore subtract pi. This will also ensure that the estimated phase will
-    # be in the interval [-pi,pi].
-    phase = sum_res.argmax()/iter_steps *2*np.pi - np.pi
+    frequency_max = self._sine_peak_frequency(dft_x, dft_y)
+
+    # phase from the demodulation with the estimated frequency, in the interval [-pi,pi]
+    phase = self._sine_phase(x_axis, data, frequency_max)
 
     # values and bounds of initial parameters
     params['amplitude'].set(value=ampl_val)
@@ -594,9 +582,9 @@ def make_sine_fit(self, x_axis, data, estimator, units=None, add_params=None, **
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = sine.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(sine, data, x=x_axis, params=params, **kwargs)
     except:
-        result = sine.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(sine, data, x=x_axis, params=params, **kwargs)
         self.log.error('The sine fit did not work.\n'
                        'Error message: {0}\n'.format(result.message))
 
@@ -703,10 +691,10 @@ def make_sineexponentialdecay_fit(self, x_axis, data, estimator, units=None, add
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = sine_exp_decay_offset.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(sine_exp_decay_offset, data, x=x_axis, params=params, **kwargs)
     except:
 
-        result = sine_exp_decay_offset.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(sine_exp_decay_offset, data, x=x_axis, params=params, **kwargs)
         self.log.error('The sineexponentialdecayoffset fit did not work.\n'
                        'Error message: {0}'.format(result.message))
 
@@ -795,47 +783,22 @@ def estimate_sineexponentialdecay(self, x_axis, data, params=None):
     # estimate amplitude
     ampl_val = max(np.abs(data_level.min()), np.abs(data_level.max()))
 
-    dft_x, dft_y = compute_ft(x_axis, data_level, zeropad_num=1)
+    dft_x, dft_y = self._sine_spectrum(x_axis, data_level, zeropad_num=1)
 
     stepsize = x_axis[1] - x_axis[0]  # for frequency axis
 
-    frequency_max = np.abs(dft_x[dft_y.argmax()])
+    frequency_max = self._sine_peak_frequency(dft_x, dft_y)
 
     # remove noise
     a = np.std(dft_y)
-    for i in range(0, len(dft_x)):
-        if dft_y[i] <= a:
-            dft_y[i] = 0
+    dft_y[dft_y <= a] = 0
 
     # calculating the width of the FT peak for the estimation of lifetime
-    s = 0
-    for i in range(0, len(dft_x)):
-        s += dft_y[i]*abs(dft_x[1]-dft_x[0])/max(dft_y)
+    s = dft_y.sum()*abs(dft_x[1]-dft_x[0])/dft_y.max()
     lifetime_val = 0.5/s
 
-    # find minimal distance to the next meas point in the corresponding x value
-    min_x_diff = np.ediff1d(x_axis).min()
-
-    # How many points are used to sample the estimated frequency with min_x_diff:
-    iter_steps = int(1/(frequency_max*min_x_diff))
-    if iter_steps < 1:
-        iter_steps = 1
-
-    sum_res = np.zeros(iter_steps)
-
-    # Procedure: Create sin waves with different phases and perform a summation.
-    #            The sum shows how well the sine was fitting to the actual data.
-    #            The best fitting sine should be a maximum of the summed time
-    #            trace.
-
-    for iter_s in range(iter_steps):
-        func_val = ampl_val * np.sin(2*np.pi*frequency_max*x_axis + iter_s/iter_steps *2*np.pi)
-        sum_res[iter_s] = np.abs(data_level - func_val).sum()
-
-    # The minimum indicates where the sine function was fittng the worst,
-    # therefore subtract pi. This will also ensure that the estimated phase will
-    # be in the interval [-pi,pi].
-    phase = (sum_res.argmax()/iter_steps *2*np.pi - np.pi)%(2*np.pi)
+    # phase from the demodulation with the estimated frequency, in the interval [0, 2pi]
+    phase = self._sine_phase(x_axis, data_level, frequency_max) % (2*np.pi)
 
     # values and bounds of initial parameters
     params['frequency'].set(value=frequency_max,
@@ -879,9 +842,9 @@ def make_sinestretchedexponentialdecay_fit(self, x_axis, data, estimator, units=
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = sine_stretched_exp_decay.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(sine_stretched_exp_decay, data, x=x_axis, params=params, **kwargs)
     except:
-        result = sine_stretched_exp_decay.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(sine_stretched_exp_decay, data, x=x_axis, params=params, **kwargs)
         self.log.error('The sineexponentialdecay fit did not work.\n'
                        'Error message: {0}'.format(result.message))
 
@@ -988,11 +951,11 @@ def make_sinedouble_fit(self, x_axis, data, estimator, units=None, add_params=No
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = two_sine_offset.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(two_sine_offset, data, x=x_axis, params=params, **kwargs)
     except:
         self.log.warning('The twosineexpdecayoffset fit did not work. '
                          'Error message: {}'.format(str(result.message)))
-        result = two_sine_offset.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(two_sine_offset, data, x=x_axis, params=params, **kwargs)
 
     if units is None:
         units = ['arb. unit', 'arb. unit']
@@ -1143,11 +1106,13 @@ def make_sinedoublewithexpdecay_fit(self, x_axis, data, estimator, units=None, a
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = two_sine_exp_decay_offset.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(two_sine_exp_decay_offset, data,
+                                 x=x_axis, params=params, **kwargs)
     except:
         self.log.warning('The sinedoublewithexpdecay fit did not work. '
                          'Error message: {}'.format(str(result.message)))
-        result = two_sine_exp_decay_offset.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(two_sine_exp_decay_offset, data,
+                                 x=x_axis, params=params, **kwargs)
 
     if units is None:
         units = ['arb. unit', 'arb. unit']
@@ -1313,11 +1278,13 @@ def make_sinedoublewithtwoexpdecay_fit(self, x_axis, data, estimator, units=None
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = two_sine_two_exp_decay_offset.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(two_sine_two_exp_decay_offset, data,
+                                 x=x_axis, params=params, **kwargs)
     except:
         self.log.warning('The sinedoublewithtwoexpdecay fit did not work. '
                          'Error message: {}'.format(str(result.message)))
-        result = two_sine_two_exp_decay_offset.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(two_sine_two_exp_decay_offset, data,
+                                 x=x_axis, params=params, **kwargs)
 
     if units is None:
         units = ['arb. unit', 'arb. unit']
@@ -1486,11 +1453,11 @@ def make_sinetriple_fit(self, x_axis, data, estimator, units=None, add_params=No
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = two_sine_offset.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(two_sine_offset, data, x=x_axis, params=params, **kwargs)
     except:
         self.log.warning('The threesineexpdecayoffset fit did not work. '
                          'Error message: {}'.format(str(result.message)))
-        result = two_sine_offset.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(two_sine_offset, data, x=x_axis, params=params, **kwargs)
 
     if units is None:
         units = ['arb. unit', 'arb. unit']
@@ -1681,11 +1648,13 @@ def make_sinetriplewithexpdecay_fit(self, x_axis, data, estimator, units=None, a
 
     params = self._substitute_params(initial_params=params, update_params=add_params)
     try:
-        result = three_sine_exp_decay_offset.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(three_sine_exp_decay_offset, data,
+                                 x=x_axis, params=params, **kwargs)
     except:
         self.log.warning('The sinetriplewithexpdecay fit did not work. '
                          'Error message: {}'.format(str(result.message)))
-        result = three_sine_exp_decay_offset.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(three_sine_exp_decay_offset, data,
+                                 x=x_axis, params=params, **kwargs)
 
     if units is None:
         units = ['arb. unit', 'arb. unit']
@@ -1896,11 +1865,13 @@ def make_sinetriplewiththreeexpdecay_fit(self, x_axis, data, estimator, units=No
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = three_sine_three_exp_decay_offset.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(three_sine_three_exp_decay_offset, data,
+                                 x=x_axis, params=params, **kwargs)
     except:
         self.log.warning('The twosinetwoexpdecayoffset fit did not work. '
                          'Error message: {}'.format(str(result.message)))
-        result = three_sine_three_exp_decay_offset.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(three_sine_three_exp_decay_offset, data,
+                                 x=x_axis, params=params, **kwargs)
 
     if units is None:
         units = ['arb. unit', 'arb. unit']
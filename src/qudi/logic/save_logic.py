@@ -21,19 +21,26 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 from cycler import cycler
 import datetime
-import inspect
+import io
+import json
 import logging
 import matplotlib.pyplot as plt
 import numpy as np
 import os
+import shutil
+import struct
 import sys
+import tempfile
+import threading
 import time
+import zipfile
 import bz2
 import pickle
 # import _pickle as cPickle
 
 
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import Future
 from qudi.core.configoption import ConfigOption
 from qudi.util import units
 from qudi.util.mutex import Mutex
@@ -43,6 +50,11 @@ from PIL import Image
 from PIL import PngImagePlugin
 from qudi.core.module import LogicBase
 
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
 
 
 class DailyLogHandler(logging.FileHandler):
@@ -111,6 +123,585 @@ class DailyLogHandler(logging.FileHandler):
             super().emit(record)
 
 
+class WriteBehindQueue:
+    """ Bounded queue of save jobs, which are written to disk by background writer threads.
+
+    Each job is a call of the save routine with the arguments handed to submit, or of any
+    callable handed to submit_call. The caller hands over the ownership of the arrays, i.e. they
+    must not be modified after submission. With a single writer thread the jobs are executed in
+    the order of submission.
+
+    If the queue is full, the backpressure mode decides what happens to a new job:
+        block:       the caller waits until a writer has taken a job from the queue
+        drop_oldest: the oldest waiting job is cancelled and counted as dropped
+        spill:       the arrays of the new job are dumped as raw .npy files into a spill
+                     directory and are memory mapped again when the job is written, so the
+                     queue holds no more than its size of jobs in memory. Jobs of submit_call
+                     are not spilled, they wait like with block.
+    """
+
+    backpressure_modes = ('block', 'drop_oldest', 'spill')
+
+    def __init__(self, save_method, log, size=16, writers=1, backpressure='block'):
+        """
+        @param callable save_method: save routine, called with the data dict and the keyword
+                                     arguments passed to submit. Its return value becomes the
+                                     result of the future.
+        @param log: logger to report failing and dropped jobs to
+        @param int size: maximum number of jobs held in memory
+        @param int writers: number of writer threads
+        @param str backpressure: behaviour if the queue is full, see backpressure_modes
+        """
+        if backpressure not in self.backpressure_modes:
+            raise ValueError('Unknown backpressure mode "{0}", valid modes are {1}.'
+                             ''.format(backpressure, self.backpressure_modes))
+        self._save_method = save_method
+        self.log = log
+        self._size = max(1, int(size))
+        self._backpressure = backpressure
+        self._jobs = deque()
+        # number of jobs in _jobs holding their arrays in memory
+        self._in_memory = 0
+        # number of jobs taken by a writer and not finished yet
+        self._active = 0
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._spill_dir = None
+        self._spill_count = 0
+        # jobs cancelled by the drop_oldest backpressure
+        self.dropped = 0
+        self._threads = [threading.Thread(target=self._run, name='save writer {0:d}'.format(ii),
+                                          daemon=True)
+                         for ii in range(max(1, int(writers)))]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def pending(self):
+        """ Number of jobs waiting or being written. """
+        with self._condition:
+            return len(self._jobs) + self._active
+
+    def submit(self, data, **kwargs):
+        """ Schedule a save job. Can be called from any thread.
+
+        @param dict data: data dict of the save routine, ownership is handed over to the queue
+        @param kwargs: keyword arguments for the save routine
+
+        @return concurrent.futures.Future: future of the return value of the save routine
+        """
+        return self._submit(self._save_method, (data,), kwargs)
+
+    def submit_call(self, func, *args, **kwargs):
+        """ Schedule a call of func with args and kwargs. Can be called from any thread.
+
+        @return concurrent.futures.Future: future of the return value of func
+        """
+        return self._submit(func, args, kwargs)
+
+    def _submit(self, func, args, kwargs):
+        future = Future()
+        backpressure = self._backpressure
+        if backpressure == 'spill' and func is not self._save_method:
+            backpressure = 'block'
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError('The save writer has been stopped.')
+            spill_files = None
+            if self._in_memory >= self._size:
+                if backpressure == 'block':
+                    while self._in_memory >= self._size and not self._stopped:
+                        self._condition.wait()
+                    if self._stopped:
+                        raise RuntimeError('The save writer has been stopped.')
+                elif backpressure == 'drop_oldest':
+                    self._drop_oldest()
+                else:
+                    spill_files = self._spill(args[0])
+            self._jobs.append((future, func, args, kwargs, spill_files))
+            if spill_files is None:
+                self._in_memory += 1
+            self._condition.notify_all()
+        return future
+
+    def flush(self, timeout=None):
+        """ Wait until all submitted jobs are written.
+
+        @param float timeout: optional, maximum time to wait in s
+
+        @return bool: True if the queue is empty, False on timeout
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._jobs and not self._active,
+                                            timeout)
+
+    def stop(self, timeout=None):
+        """ Write the remaining jobs and stop the writer threads.
+
+        @param float timeout: optional, maximum time to wait for each writer thread in s
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+    def _drop_oldest(self):
+        """ Cancel the oldest job held in memory. Must be called with the condition held. """
+        for ii, job in enumerate(self._jobs):
+            if job[4] is None:
+                del self._jobs[ii]
+                self._in_memory -= 1
+                job[0].cancel()
+                self.dropped += 1
+                self.log.warning('Save queue is full, dropped the oldest save job ({0:d} '
+                                 'dropped so far).'.format(self.dropped))
+                return
+
+    def _spill(self, data):
+        """ Dump the numeric arrays of data into the spill directory and drop them from data.
+
+        @return dict: file paths of the spilled arrays by key of data
+        """
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix='qudi_save_spill_')
+        spill_files = dict()
+        for key, value in data.items():
+            value = np.asarray(value)
+            if value.dtype.hasobject:
+                continue
+            self._spill_count += 1
+            path = os.path.join(self._spill_dir, '{0:d}.npy'.format(self._spill_count))
+            np.save(path, value)
+            spill_files[key] = path
+            data[key] = None
+        return spill_files
+
+    def _run(self):
+        """ Writer thread, takes jobs from the queue until it is stopped and empty. """
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._jobs or self._stopped)
+                if not self._jobs:
+                    return
+                future, func, args, kwargs, spill_files = self._jobs.popleft()
+                if spill_files is None:
+                    self._in_memory -= 1
+                self._active += 1
+                self._condition.notify_all()
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        if spill_files:
+                            for key, path in spill_files.items():
+                                args[0][key] = np.load(path, mmap_mode='r')
+                        future.set_result(func(*args, **kwargs))
+                    except Exception as e:
+                        self.log.exception('Writing save job failed:')
+                        future.set_exception(e)
+            finally:
+                del args
+                if spill_files:
+                    for path in spill_files.values():
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                with self._condition:
+                    self._active -= 1
+                    self._condition.notify_all()
+
+
+class H5RunStore:
+    """ Single HDF5 file collecting the records of a measurement run, e.g. a night of traces.
+
+    All datasets are chunked and extendable, so appending a record is O(1) and the file stays
+    open for the whole run. Layout:
+
+        /time_axes/<k>          distinct axes, each stored once
+        /axis_index             (N,) index k of the axis of each record
+        /traces/<label>         (N, M) float32 per data label, NaN padded to the longest record
+        /trace_length           (N,) number of samples of each record
+        /timestamp              (N,) POSIX timestamp of each record in s
+        /record_id              (N,) id of each record, e.g. the trace id of the caller
+        /metadata               (N,) JSON string of the parameters of each record
+        /fits/<fit name>/record_id, values, errors
+                                (n,), (n, P), (n, P) fit results, attribute param_names holds
+                                the names of the P columns
+
+    The file attributes hold format, version, creation date, module and the JSON parameters of
+    the run. Appending is thread safe.
+    """
+
+    format_name = 'qudi run store'
+    format_version = 1
+
+    def __init__(self, path, compression='lzf', chunk_rows=64, module_name='', parameters=None,
+                 chunk_bytes=2 * 1024 ** 2):
+        """
+        @param str path: path of the HDF5 file, an existing file is overwritten
+        @param str compression: optional, HDF5 compression filter ('lzf', 'gzip' or None)
+        @param int chunk_rows: optional, maximum number of records per chunk
+        @param str module_name: optional, name of the module recording the run
+        @param dict parameters: optional, parameters of the whole run
+        @param int chunk_bytes: optional, maximum size of a chunk in bytes. Long records get
+                                fewer rows per chunk and records longer than chunk_bytes are
+                                split into several chunks.
+        """
+        if h5py is None:
+            raise ImportError('h5py module not found. Please install from "pip install h5py" to '
+                              'save runs as HDF5.')
+        self.path = path
+        self._compression = compression
+        self._chunk_rows = max(1, int(chunk_rows))
+        self._chunk_bytes = max(1, int(chunk_bytes))
+        self._lock = threading.Lock()
+        self._file = h5py.File(path, 'w')
+        self._file.attrs['format'] = self.format_name
+        self._file.attrs['version'] = self.format_version
+        self._file.attrs['created'] = datetime.datetime.now().isoformat()
+        self._file.attrs['module'] = module_name
+        self._file.attrs['parameters'] = json.dumps(parameters or dict(), default=str)
+        self._axes = self._file.create_group('time_axes')
+        self._traces = self._file.create_group('traces')
+        self._fits = self._file.create_group('fits')
+        self._axis_index = self._create_rows('axis_index', np.int32)
+        self._trace_length = self._create_rows('trace_length', np.int64)
+        self._timestamp = self._create_rows('timestamp', np.float64)
+        self._record_id = self._create_rows('record_id', np.int64)
+        self._metadata = self._create_rows('metadata', h5py.string_dtype())
+        # index of each distinct axis by its bytes
+        self._axis_keys = dict()
+        self._n_records = 0
+        # open datasets are kept, since closing a dataset flushes its chunk cache
+        self._trace_sets = dict()
+        self._fit_tables = dict()
+
+    @property
+    def n_records(self):
+        return self._n_records
+
+    @property
+    def closed(self):
+        return not self._file
+
+    def _create_rows(self, name, dtype, width=None, group=None):
+        """ Create an empty dataset extendable in its first (and second) dimension.
+
+        The chunks hold at most chunk_rows rows and chunk_bytes bytes.
+        """
+        group = self._file if group is None else group
+        itemsize = np.dtype(dtype).itemsize
+        if width is None:
+            shape, maxshape = (0,), (None,)
+            chunks = (max(1, min(self._chunk_rows, self._chunk_bytes // itemsize)), )
+            chunks_per_row = 1
+        else:
+            shape, maxshape = (0, width), (None, None)
+            columns = max(1, min(width, self._chunk_bytes // itemsize))
+            chunks = (max(1, min(self._chunk_rows, self._chunk_bytes // (columns * itemsize))),
+                      columns)
+            chunks_per_row = -(-max(1, width) // columns)
+        # the partially filled chunks of a row must stay in the chunk cache of the dataset,
+        # otherwise every appended record reads, decompresses and compresses them again. One
+        # more chunk is kept for records growing wider than the first one.
+        kwargs = {'rdcc_nbytes': (chunks_per_row + 1) * int(np.prod(chunks)) * itemsize,
+                  'rdcc_nslots': 521,
+                  'rdcc_w0': 1}
+        if np.dtype(dtype).kind == 'f':
+            kwargs['fillvalue'] = np.nan
+        if self._compression is not None and np.dtype(dtype).kind != 'O':
+            kwargs['compression'] = self._compression
+        return group.create_dataset(name, shape=shape, maxshape=maxshape, chunks=chunks,
+                                    dtype=dtype, **kwargs)
+
+    def _reserve(self, dataset, row, width=None):
+        """ Make sure dataset has the row and, for 2D datasets, width columns.
+
+        The rows grow by whole chunks, so resizing is amortized over chunk_rows records.
+        """
+        rows = dataset.shape[0]
+        if row >= rows:
+            rows = (row // self._chunk_rows + 1) * self._chunk_rows
+        if width is None:
+            if rows != dataset.shape[0]:
+                dataset.resize((rows,))
+        elif rows != dataset.shape[0] or width > dataset.shape[1]:
+            dataset.resize((rows, max(width, dataset.shape[1])))
+
+    def _axis(self, axis):
+        """ Index of axis in /time_axes, the axis is stored if it is new. """
+        axis = np.ascontiguousarray(axis)
+        key = (axis.dtype.str, axis.tobytes())
+        index = self._axis_keys.get(key)
+        if index is None:
+            index = len(self._axis_keys)
+            self._axes.create_dataset(str(index), data=axis)
+            self._axis_keys[key] = index
+        return index
+
+    def append(self, data, timestamp=None, metadata=None, record_id=None):
+        """ Append a record.
+
+        @param dict data: 1D arrays of the record. The first item is the axis of the record,
+                          e.g. the time axis, and stored once per distinct axis. The further
+                          items are appended to /traces/<label> as float32.
+        @param datetime timestamp: optional, time of the record, defaults to now
+        @param dict metadata: optional, parameters of the record
+        @param int record_id: optional, id of the record, defaults to the record index
+
+        @return int: index of the record
+        """
+        if timestamp is None:
+            timestamp = datetime.datetime.now()
+        items = iter(data.items())
+        with self._lock:
+            row = self._n_records
+            try:
+                axis_label, axis = next(items)
+            except StopIteration:
+                axis_label, axis = None, None
+            length = 0
+            if axis is not None:
+                axis = np.asarray(axis)
+                self._reserve(self._axis_index, row)
+                self._axis_index[row] = self._axis(axis)
+                if 'label' not in self._axes.attrs:
+                    self._axes.attrs['label'] = axis_label
+                length = axis.size
+            for label, trace in items:
+                trace = np.asarray(trace, dtype=np.float32).ravel()
+                dataset = self._trace_sets.get(label)
+                if dataset is None:
+                    dataset = self._create_rows(label.replace('/', '_'), np.float32,
+                                                width=trace.size, group=self._traces)
+                    dataset.attrs['label'] = label
+                    self._trace_sets[label] = dataset
+                self._reserve(dataset, row, trace.size)
+                dataset[row, :trace.size] = trace
+                length = max(length, trace.size)
+            for dataset, value in ((self._trace_length, length),
+                                   (self._timestamp, timestamp.timestamp()),
+                                   (self._record_id, row if record_id is None else record_id),
+                                   (self._metadata, json.dumps(metadata or dict(), default=str))):
+                self._reserve(dataset, row)
+                dataset[row] = value
+            self._n_records += 1
+        return row
+
+    def append_fit(self, record_id, fit_name, result_str_dict):
+        """ Append the result of a fit of a record to the table of the fit.
+
+        @param int record_id: id of the fitted record
+        @param str fit_name: name of the fit, selects the table
+        @param dict result_str_dict: fit result, {name: {'value': v, 'error': e, 'unit': u}}
+        """
+        with self._lock:
+            table = self._fit_tables.get(fit_name)
+            if table is None:
+                group = self._fits.create_group(fit_name.replace('/', '_'))
+                width = len(result_str_dict)
+                table = {'group': group,
+                         'record_id': self._create_rows('record_id', np.int64, group=group),
+                         'values': self._create_rows('values', np.float64, width, group),
+                         'errors': self._create_rows('errors', np.float64, width, group),
+                         'param_names': list(),
+                         'units': list(),
+                         'rows': 0}
+                self._fit_tables[fit_name] = table
+            param_names = table['param_names']
+            n_names = len(param_names)
+            columns = list()
+            for param, entry in result_str_dict.items():
+                if param not in param_names:
+                    param_names.append(param)
+                    table['units'].append(str(entry.get('unit', '')))
+                columns.append(param_names.index(param))
+            if len(param_names) != n_names:
+                table['group'].attrs['param_names'] = json.dumps(param_names)
+                table['group'].attrs['units'] = json.dumps(table['units'])
+            values = np.full(len(param_names), np.nan)
+            errors = np.full(len(param_names), np.nan)
+            for column, entry in zip(columns, result_str_dict.values()):
+                values[column] = _to_float(entry.get('value'))
+                errors[column] = _to_float(entry.get('error'))
+            row = table['rows']
+            self._reserve(table['record_id'], row)
+            table['record_id'][row] = record_id
+            for key, row_values in (('values', values), ('errors', errors)):
+                self._reserve(table[key], row, len(param_names))
+                table[key][row, :len(param_names)] = row_values
+            table['rows'] = row + 1
+
+    def flush(self):
+        """ Write the number of records to the file and flush it to disk. """
+        with self._lock:
+            self._file.attrs['n_records'] = self._n_records
+            self._file.flush()
+
+    def close(self):
+        """ Trim the datasets to the records written and close the file. """
+        with self._lock:
+            if not self._file:
+                return
+            for dataset in (self._axis_index, self._trace_length, self._timestamp,
+                            self._record_id, self._metadata, *self._trace_sets.values()):
+                if dataset.shape[0] != self._n_records:
+                    dataset.resize(self._n_records, axis=0)
+            for table in self._fit_tables.values():
+                for key in ('record_id', 'values', 'errors'):
+                    table[key].resize(table['rows'], axis=0)
+            self._file.attrs['n_records'] = self._n_records
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+_BUNDLE_FORMAT = 'qudi bundle'
+_BUNDLE_VERSION = 1
+_BUNDLE_HEADER = 'header.json'
+_BUNDLE_ALIGN = 64
+# id of the zip extra field padding the members of a bundle
+_BUNDLE_PADDING_ID = 0x7164
+
+
+def load_bundle(path, mmap_mode='r'):
+    """ Load a bundle written with SaveLogic.save_data(..., filetype='bundle').
+
+    The arrays are memory mapped from the bundle, so only the parts accessed are read from disk.
+    Arrays that can not be mapped, e.g. of empty shape, are read into memory.
+
+    @param str path: path of the bundle
+    @param str mmap_mode: optional, mode of numpy.memmap ('r', 'c' or 'r+'), None to read all
+                          arrays into memory
+
+    @return (OrderedDict, dict): arrays by name and the header with the entries format, version,
+                                 created, module, numpy, arrays, parameters and header (text)
+    """
+    data = OrderedDict()
+    with zipfile.ZipFile(path) as bundle:
+        header = json.loads(bundle.read(_BUNDLE_HEADER).decode('utf-8'),
+                            object_pairs_hook=OrderedDict)
+        if header.get('format') != _BUNDLE_FORMAT:
+            raise ValueError('"{0}" is not a bundle.'.format(path))
+        if header.get('version', 0) > _BUNDLE_VERSION:
+            raise ValueError('Bundle "{0}" has version {1}, only versions up to {2:d} are '
+                             'supported.'.format(path, header.get('version'), _BUNDLE_VERSION))
+        with open(path, 'rb') as file:
+            for key, member in header['arrays'].items():
+                info = bundle.getinfo(member)
+                array = None
+                if mmap_mode is not None and info.compress_type == zipfile.ZIP_STORED:
+                    # skip the local file header, whose extra field may differ from the one in
+                    # the central directory
+                    file.seek(info.header_offset + 26)
+                    name_length, extra_length = struct.unpack('<HH', file.read(4))
+                    file.seek(info.header_offset + 30 + name_length + extra_length)
+                    version = np.lib.format.read_magic(file)
+                    if version == (1, 0):
+                        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+                    else:
+                        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+                    if not dtype.hasobject and np.prod(shape) > 0:
+                        array = np.memmap(path, dtype=dtype, mode=mmap_mode, offset=file.tell(),
+                                          shape=shape, order='F' if fortran_order else 'C')
+                if array is None:
+                    with bundle.open(member) as member_file:
+                        array = np.lib.format.read_array(member_file, allow_pickle=False)
+                data[key] = array
+    return data, header
+
+
+def _json_default(value):
+    """ Convert numpy values for json, anything else is stored as string. """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _write_text(file, data, fmt='%.18e', delimiter=' ', header='', comments='# ',
+                newline='\n', block_size=2 ** 12):
+    """ Write a 1D or 2D array to a binary file in the text layout of numpy.savetxt.
+
+    Instead of formatting row by row, each column of a block of about block_size values is
+    formatted at once by numpy.char.mod and the formatted columns are joined. The GIL is held
+    while formatting a column, so blocks are kept small enough (a few ms) not to stall other
+    threads.
+
+    @param file: file object opened in binary mode
+    @param data: 1D or 2D array, or a 1D structured array
+    @param str fmt: format of one value, of a whole row or list of formats of the columns
+    @param str delimiter: column delimiter
+    @param str header: header, each line is prepended with comments
+    @param str comments: comment marker of the header lines
+    @param str newline: line separator
+    @param int block_size: number of values formatted at once
+    """
+    data = np.asarray(data)
+    if np.iscomplexobj(data):
+        np.savetxt(file, data, fmt=fmt, delimiter=delimiter, header=header, comments=comments,
+                   newline=newline)
+        return
+    if data.ndim == 0 or data.ndim > 2:
+        raise ValueError('Expected 1D or 2D array, got {0:d}D array instead'.format(data.ndim))
+    if data.ndim == 1:
+        if data.dtype.names is None:
+            data = np.atleast_2d(data).T
+            ncol = 1
+        else:
+            ncol = len(data.dtype.names)
+    else:
+        ncol = data.shape[1]
+
+    # format of each column and the text between the columns
+    if isinstance(fmt, (list, tuple)):
+        if len(fmt) != ncol:
+            raise AttributeError('fmt has wrong shape.  {0}'.format(fmt))
+        column_formats, separator = list(fmt), delimiter
+    elif fmt.count('%') == 1:
+        column_formats, separator = [fmt] * ncol, delimiter
+    elif fmt.count('%') != ncol:
+        raise ValueError('fmt has wrong number of % formats:  {0}'.format(fmt))
+    else:
+        # a whole row format already holds the delimiters, split it in front of each %
+        parts = fmt.split('%')
+        column_formats, separator = ['%' + part for part in parts[1:]], ''
+        column_formats[0] = parts[0] + column_formats[0]
+
+    if len(header) > 0:
+        file.write((comments + header.replace('\n', '\n' + comments) + newline).encode('latin1'))
+    block_rows = max(1, block_size // max(1, ncol))
+    for start in range(0, data.shape[0], block_rows):
+        block = data[start:start + block_rows]
+        if data.dtype.names is None:
+            columns = block.T
+        else:
+            columns = [block[name] for name in data.dtype.names]
+        texts = [np.char.mod(column_format, column).tolist()
+                 for column_format, column in zip(column_formats, columns)]
+        lines = newline.join(map(separator.join, zip(*texts)))
+        file.write((lines + newline).encode('latin1'))
+
+
+def _to_float(value):
+    """ Float of value, NaN for None and values that are not numbers. """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
 class FunctionImplementationError(Exception):
 
     def __init__(self, value):
@@ -134,6 +725,11 @@ class SaveLogic(LogicBase):
         log_into_daily_directory: True
         save_pdf: True
         save_png: True
+        write_queue_size: 16            # jobs held in memory by submit_data, 0: save synchronously
+        writer_threads: 1
+        write_backpressure: 'block'     # if the queue is full: 'block', 'drop_oldest' or 'spill'
+        run_compression: 'lzf'          # HDF5 filter of run files: 'lzf', 'gzip' or None
+        run_chunk_rows: 64
     """
 
     _win_data_dir = ConfigOption('win_data_directory', 'C:/Data/')
@@ -141,6 +737,11 @@ class SaveLogic(LogicBase):
     log_into_daily_directory = ConfigOption('log_into_daily_directory', False, missing='warn')
     save_pdf = ConfigOption('save_pdf', False)
     save_png = ConfigOption('save_png', True)
+    _write_queue_size = ConfigOption('write_queue_size', 16)
+    _writer_threads = ConfigOption('writer_threads', 1)
+    _write_backpressure = ConfigOption('write_backpressure', 'block')
+    _run_compression = ConfigOption('run_compression', 'lzf')
+    _run_chunk_rows = ConfigOption('run_chunk_rows', 64)
 
     # Matplotlib style definition for saving plots
     mpl_qd_style = {
@@ -207,6 +808,13 @@ class SaveLogic(LogicBase):
 
         self._daily_loghandler = None
 
+        # durations of the phases of the last save_data call in s
+        self.last_save_timing = OrderedDict()
+        self._write_queue = None
+        # open HDF5 run stores by file path, and the ones opened by save_data by path and label
+        self._runs = dict()
+        self._implicit_runs = dict()
+
     def on_activate(self):
         """ Definition, configuration and initialisation of the SaveLogic.
         """
@@ -222,7 +830,23 @@ class SaveLogic(LogicBase):
         else:
             self._daily_loghandler = None
 
+        if self._write_backpressure not in WriteBehindQueue.backpressure_modes:
+            self.log.warning('Unknown write_backpressure "{0}" in configuration. Falling back to '
+                             'default setting: block.'.format(self._write_backpressure))
+            self._write_backpressure = 'block'
+        if self._write_queue_size > 0:
+            self._write_queue = WriteBehindQueue(self.save_data, self.log,
+                                                 size=self._write_queue_size,
+                                                 writers=self._writer_threads,
+                                                 backpressure=self._write_backpressure)
+
     def on_deactivate(self):
+        if self._write_queue is not None:
+            # pending jobs are written before the module goes down
+            self._write_queue.stop()
+            self._write_queue = None
+        for run in list(self._runs.values()):
+            self.close_run(run)
         if self._daily_loghandler != None:
             # removes the log handler logging into the daily directory
             logging.getLogger().removeHandler(self._daily_loghandler)
@@ -242,8 +866,65 @@ class SaveLogic(LogicBase):
         """
         self._daily_loghandler.setLevel(level)
 
+    def submit_data(self, data, **kwargs):
+        """ Save data in the background, see save_data for the arguments.
+
+        The data is written by the writer threads of the write-behind queue, so the caller does
+        not wait for formatting and disk I/O. The ownership of the arrays in data is handed over,
+        i.e. they must not be modified afterwards. The calling module and the timestamp are
+        determined at submission. If the queue is disabled (write_queue_size 0), the data is
+        saved right away.
+
+        @param dict data: data dict, see save_data
+        @param kwargs: keyword arguments of save_data
+
+        @return concurrent.futures.Future: future of the return value of save_data, i.e. the
+                                          path of the saved data file or -1
+        """
+        if kwargs.get('module_name') is None:
+            kwargs['module_name'] = self._caller_module_name()
+        if kwargs.get('timestamp') is None:
+            kwargs['timestamp'] = datetime.datetime.now()
+        if self._write_queue is not None:
+            return self._write_queue.submit(data, **kwargs)
+        future = Future()
+        try:
+            future.set_result(self.save_data(data, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def submit_call(self, func, *args, **kwargs):
+        """ Call func with args and kwargs in the writer thread, in line with submit_data.
+
+        This is meant for writes that are not covered by save_data, e.g. appending fit results
+        to a run store. If the queue is disabled, func is called right away.
+
+        @return concurrent.futures.Future: future of the return value of func
+        """
+        if self._write_queue is not None:
+            return self._write_queue.submit_call(func, *args, **kwargs)
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def flush(self, timeout=None):
+        """ Wait until all data submitted with submit_data is written.
+
+        @param float timeout: optional, maximum time to wait in s
+
+        @return bool: True if all data is written, False on timeout
+        """
+        if self._write_queue is None:
+            return True
+        return self._write_queue.flush(timeout)
+
     def save_data(self, data, filepath=None, parameters=None, filename=None, filelabel=None,
-                  timestamp=None, filetype='text', fmt='%.15e', delimiter='\t', plotfig=None):
+                  timestamp=None, filetype='text', fmt='%.15e', delimiter='\t', plotfig=None,
+                  module_name=None, run=None):
         """
         General save routine for data.
 
@@ -289,7 +970,17 @@ class SaveLogic(LogicBase):
                                    filename and a timestamp, because then the timestamp will be
                                    ignored.
         @param string filetype: optional, the file format the data should be saved in. Valid inputs
-                                are 'text', 'xml' and 'npz'. Default is 'text'.
+                                are 'text', 'npy', 'npz', 'bundle', 'p' and 'h5'. Default is
+                                'text'.
+                                'npy' writes the array of the text file as raw .npy and the header
+                                into <filename>_params.dat next to it.
+                                'bundle' writes all arrays and the parameters into one .npz file,
+                                which can be memory mapped with load_bundle. Use it instead of the
+                                pickle file of 'p'.
+                                With 'h5' the data is appended as a record to a run store, see
+                                open_run. The first data item is taken as the axis of the record.
+                                Without a run, the run of filepath and filelabel is used and
+                                opened if necessary; it stays open until close_run.
         @param string or list of strings fmt: optional, format specifier for saved data. See python
                                               documentation for
                                               "Format Specification Mini-Language". If you want for
@@ -304,6 +995,13 @@ class SaveLogic(LogicBase):
                                               behaviour or failure to save right away.
         @param string delimiter: optional, insert here the delimiter, like '\n' for new line, '\t'
                                  for tab, ',' for a comma ect.
+        @param string module_name: optional, name of the calling module used for the default
+                                   filepath, the default filelabel and the header. If not given,
+                                   it is taken from the globals of the calling frame.
+        @param H5RunStore run: optional, run store to append to with filetype 'h5'
+
+        The duration of each save phase (prepare, header, write, figure) and the total are stored
+        in seconds in the dict last_save_timing.
 
         1D data
         =======
@@ -333,8 +1031,11 @@ class SaveLogic(LogicBase):
 
         YOU ARE RESPONSIBLE FOR THE IDENTIFIER! DO NOT FORGET THE UNITS FOR THE SAVED TIME
         TRACE/MATRIX.
+
+        @return str: path of the saved data file, -1 if saving failed
         """
-        start_time = time.time()
+        start_time = time.perf_counter()
+        timing = OrderedDict()
         # Create timestamp if none is present
         if timestamp == None:
             timestamp = datetime.datetime.now()
@@ -389,17 +1090,10 @@ class SaveLogic(LogicBase):
                            'arrays only. Saving data failed!')
             return -1
 
-        # try to trace back the functioncall to the class which was calling it.
-        try:
-            frm = inspect.stack()[1]
-            # this will get the object, which called the save_data function.
-            mod = inspect.getmodule(frm[0])
-            # that will extract the name of the class.
-            module_name = mod.__name__.split('.')[-1]
-        except:
-            # Sometimes it is not possible to get the object which called the save_data function
-            # (such as when calling this from the console).
-            module_name = 'UNSPECIFIED'
+        # Name of the calling module. Only the globals of the calling frame are looked at, since
+        # inspect.stack() builds the source context of the whole stack on every call.
+        if module_name is None:
+            module_name = self._caller_module_name()
 
         # determine proper file path
         if filepath == None:
@@ -426,6 +1120,9 @@ class SaveLogic(LogicBase):
                            'data arrays.')
             return -1
 
+        timing['prepare'] = time.perf_counter() - start_time
+        phase_start = time.perf_counter()
+
         # Create header string for the file
         header = 'Saved Data from the class {0} on {1}.\n' \
                  ''.format(module_name, timestamp.strftime('%d.%m.%Y at %Hh%Mm%Ss'))
@@ -450,11 +1147,22 @@ class SaveLogic(LogicBase):
                                'try to save the parameters nevertheless.')
                 header += 'not specified parameters: {0}\n'.format(parameters)
         header += '\nData:\n=====\n'
+        timing['header'] = time.perf_counter() - phase_start
+        phase_start = time.perf_counter()
 
         # write data to file
         # FIXME: Implement other file formats
-        # write to textfile
-        if filetype == 'text':
+        # write to textfile, or to a raw .npy file with the header in a text file next to it
+        if filetype in ('text', 'npy'):
+            if filetype == 'npy':
+                # multiple 1D arrays are combined right in the memory mapped file
+                saved_path = os.path.join(filepath, filename + '.npy')
+
+                def allocate(shape, dtype):
+                    return np.lib.format.open_memmap(saved_path, mode='w+', dtype=dtype,
+                                                     shape=tuple(np.atleast_1d(shape)))
+            else:
+                allocate = np.empty
             # Reshape data if multiple 1D arrays have been passed to this method.
             # If a 2D array has been passed, reformat the specifier
             if len(data) != 1:
@@ -462,7 +1170,7 @@ class SaveLogic(LogicBase):
                 if multiple_dtypes:
                     field_dtypes = list(zip(['f{0:d}'.format(i) for i in range(len(arr_dtype))],
                                             arr_dtype))
-                    new_array = np.empty(max_line_num, dtype=field_dtypes)
+                    new_array = allocate(max_line_num, dtype=field_dtypes)
                     for i, keyname in enumerate(data):
                         identifier_str += keyname + delimiter
                         field = 'f{0:d}'.format(i)
@@ -474,7 +1182,7 @@ class SaveLogic(LogicBase):
                             else:
                                 new_array[field][length:] = np.nan
                 else:
-                    new_array = np.empty([max_line_num, max_row_num], arr_dtype[0])
+                    new_array = allocate([max_line_num, max_row_num], dtype=arr_dtype[0])
                     for i, keyname in enumerate(data):
                         identifier_str += keyname + delimiter
                         length = data[keyname].size
@@ -493,26 +1201,68 @@ class SaveLogic(LogicBase):
             else:
                 identifier_str = list(data)[0]
             header += list(data)[0]
-            self.save_array_as_text(data=data[identifier_str], filename=filename  + '.dat',
-                                    filepath=filepath,fmt=fmt, header=header, delimiter=delimiter, comments='#', append=False)
+            if filetype == 'text':
+                saved_path = os.path.join(filepath, filename + '.dat')
+                self.save_array_as_text(data=data[identifier_str], filename=filename  + '.dat',
+                                        filepath=filepath,fmt=fmt, header=header, delimiter=delimiter, comments='#', append=False)
+            else:
+                if isinstance(data[identifier_str], np.memmap):
+                    data[identifier_str].flush()
+                else:
+                    self.save_array_as_npy(data=data[identifier_str], filename=filename + '.npy',
+                                           filepath=filepath)
+                self.save_array_as_text(data=[], filename=filename + '_params.dat',
+                                        filepath=filepath, fmt=fmt, header=header,
+                                        delimiter=delimiter, comments='#', append=False)
         # write npz file and save parameters in textfile
         elif filetype == 'npz':
             header += str(list(data.keys()))[1:-1]
-            np.savez_compressed(filepath + '/' + filename, **data)
+            saved_path = os.path.join(filepath, filename + '.npz')
+            np.savez_compressed(saved_path, **data)
             self.save_array_as_text(data=[], filename=filename+'_params.dat', filepath=filepath,
                                     fmt=fmt, header=header, delimiter=delimiter, comments='#',
                                     append=False)
+        elif filetype == 'h5':
+            if found_2d:
+                self.log.error('Saving 2D arrays as HDF5 run record is not supported.')
+                return -1
+            try:
+                if run is None:
+                    run = self._implicit_runs.get((filepath, filelabel))
+                    if run is None or run.closed:
+                        run = self.open_run(filelabel=filelabel, filepath=filepath,
+                                            timestamp=timestamp, module_name=module_name)
+                        self._implicit_runs[(filepath, filelabel)] = run
+                run.append(data, timestamp=timestamp, metadata=parameters)
+            except ImportError as e:
+                self.log.error('Could not save data as HDF5: {0}'.format(e))
+                return -1
+            saved_path = run.path
+        elif filetype == 'bundle':
+            try:
+                saved_path = self.save_array_as_bundle(data=data, filename=filename + '.npz',
+                                                       filepath=filepath, parameters=parameters,
+                                                       header=header, module_name=module_name,
+                                                       timestamp=timestamp)
+            except ValueError as e:
+                self.log.error('Could not save data as bundle: {0}'.format(e))
+                return -1
         elif filetype == 'p':
             export = {**data, **parameters}
+            saved_path = os.path.join(filepath, filename + '.p')
             self.save_array_as_pickle(data=export, filename=filename, filepath=filepath)
         
         else:
             self.log.error('Only saving of data as textfile and npz-file is implemented. Filetype "{0}" is not '
                            'supported yet. Saving as textfile.'.format(filetype))
+            saved_path = os.path.join(filepath, filename)
             self.save_array_as_text(data=data[identifier_str], filename=filename, filepath=filepath,
                                     fmt=fmt, header=header, delimiter=delimiter, comments='#',
                                     append=False)
 
+        timing['write'] = time.perf_counter() - phase_start
+        phase_start = time.perf_counter()
+
         #--------------------------------------------------------------------------------------------
         # Save thumbnail figure of plot
         if plotfig != None:
@@ -571,9 +1321,135 @@ class SaveLogic(LogicBase):
 
             # close matplotlib figure
             plt.close(plotfig)
-            self.log.debug('Time needed to save data: {0:.2f}s'.format(time.time()-start_time))
+            timing['figure'] = time.perf_counter() - phase_start
             #----------------------------------------------------------------------------------
-        
+
+        timing['total'] = time.perf_counter() - start_time
+        self.last_save_timing = timing
+        self.log.debug('Time needed to save data: {0}'.format(
+            ', '.join('{0} {1:.1f} ms'.format(phase, 1e3 * duration)
+                      for phase, duration in timing.items())))
+        return saved_path
+
+    @staticmethod
+    def _caller_module_name(depth=2):
+        """ Name of the module the save routine was called from, without its package path.
+
+        @param int depth: number of frames between this method and the caller of interest
+
+        @return str: last component of the module name or 'UNSPECIFIED'
+        """
+        try:
+            name = sys._getframe(depth).f_globals['__name__']
+        except (AttributeError, KeyError, ValueError):
+            # e.g. when called from the console or from an interpreter without _getframe
+            return 'UNSPECIFIED'
+        return name.rsplit('.', 1)[-1]
+
+    def open_run(self, filelabel=None, filepath=None, parameters=None, timestamp=None,
+                 module_name=None):
+        """ Open an HDF5 run store to append the records of a measurement run to.
+
+        The file is named like the files of save_data with the ending .h5. Records are appended
+        with save_data(..., filetype='h5', run=run) or submit_call(run.append, ...).
+
+        @param str filelabel: optional, label of the file name, defaults to the module name
+        @param str filepath: optional, directory of the file, see save_data
+        @param dict parameters: optional, parameters of the whole run
+        @param datetime timestamp: optional, timestamp of the file name, defaults to now
+        @param str module_name: optional, name of the recording module, see save_data
+
+        @return H5RunStore: the opened run store
+        """
+        if module_name is None:
+            module_name = self._caller_module_name()
+        if timestamp is None:
+            timestamp = datetime.datetime.now()
+        if filepath is None:
+            filepath = self.get_path_for_module(module_name)
+        elif not os.path.exists(filepath):
+            os.makedirs(filepath)
+        if filelabel is None:
+            filelabel = module_name
+        filename = timestamp.strftime('%Y%m%d-%H%M-%S' + '_' + filelabel) + '.h5'
+        run = H5RunStore(os.path.join(filepath, filename), compression=self._run_compression,
+                         chunk_rows=self._run_chunk_rows, module_name=module_name,
+                         parameters=parameters)
+        self._runs[run.path] = run
+        return run
+
+    def close_run(self, run):
+        """ Write the records still queued and close a run store.
+
+        @param H5RunStore run: run store opened by open_run
+        """
+        self.flush()
+        run.close()
+        self._runs.pop(run.path, None)
+        for key, implicit_run in list(self._implicit_runs.items()):
+            if implicit_run is run:
+                del self._implicit_runs[key]
+
+    def save_array_as_bundle(self, data, filename, filepath='', parameters=None, header='',
+                             module_name='', timestamp=None):
+        """
+        Save a dict of arrays and the parameters as bundle, see load_bundle.
+
+        The bundle is an uncompressed .npz file, i.e. a zip archive of .npy members, with an
+        additional member header.json holding the parameters. The .npy data are aligned, so
+        load_bundle can memory map them in place. numpy.load reads the arrays as well.
+
+        @param dict data: arrays by name, objects arrays are not supported
+        @param str filename: file name including the ending .npz
+        @param str filepath: optional, directory of the file
+        @param dict parameters: optional, parameters to store in the header
+        @param str header: optional, text header as written into text files
+        @param str module_name: optional, name of the saving module
+        @param datetime timestamp: optional, time of the measurement
+
+        @return str: path of the file
+        """
+        path = os.path.join(filepath, filename)
+        members = OrderedDict()
+        for key in data:
+            member = key.replace('/', '_').replace('\\', '_') + '.npy'
+            while member in members.values() or member == _BUNDLE_HEADER:
+                member = '_' + member
+            members[key] = member
+        bundle_header = OrderedDict()
+        bundle_header['format'] = _BUNDLE_FORMAT
+        bundle_header['version'] = _BUNDLE_VERSION
+        bundle_header['created'] = (datetime.datetime.now() if timestamp is None
+                                    else timestamp).isoformat()
+        bundle_header['module'] = module_name
+        bundle_header['numpy'] = np.__version__
+        bundle_header['arrays'] = members
+        bundle_header['parameters'] = parameters if isinstance(parameters, dict) else dict()
+        bundle_header['header'] = header
+
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED,
+                             allowZip64=True) as bundle:
+            for key, member in members.items():
+                array = np.asanyarray(data[key])
+                info = zipfile.ZipInfo(member, date_time=time.localtime()[:6])
+                # the member holds the .npy header as well, whose version 2.0 layout is the
+                # longest the array can get
+                npy_header = io.BytesIO()
+                np.lib.format.write_array_header_2_0(
+                    npy_header, np.lib.format.header_data_from_array_1_0(array))
+                force_zip64 = array.nbytes + npy_header.tell() > zipfile.ZIP64_LIMIT
+                # pad the local file header with an extra field, so the .npy member (and thus
+                # its data, since the .npy header is padded as well) starts aligned
+                header_length = (30 + len(member.encode('utf-8')) + 4
+                                 + (20 if force_zip64 else 0))
+                padding = -(bundle.fp.tell() + header_length) % _BUNDLE_ALIGN
+                info.extra = struct.pack('<HH', _BUNDLE_PADDING_ID, padding) + bytes(padding)
+                with bundle.open(info, 'w', force_zip64=force_zip64) as file:
+                    np.lib.format.write_array(file, array, allow_pickle=False)
+            bundle.writestr(_BUNDLE_HEADER, json.dumps(bundle_header, indent=1,
+                                                       default=_json_default))
+        return path
+
     def save_array_as_pickle(self, data, filename, filepath=''):
         with open(os.path.join(filepath, filename + '.p'), 'wb') as fp:
             pickle.dump(data, fp)
@@ -582,19 +1458,31 @@ class SaveLogic(LogicBase):
                            delimiter='\t', comments='#', append=False):
         """
         An Independent method, which can save a 1D or 2D numpy.ndarray as textfile.
-        Can append to files.
+        Can append to files. The file has the same layout as written by numpy.savetxt.
         """
         # write to file. Append if requested.
-        if append:
-            with open(os.path.join(filepath, filename), 'ab') as file:
-                np.savetxt(file, data, fmt=fmt, delimiter=delimiter, header=header,
-                           comments=comments)
-        else:
-            with open(os.path.join(filepath, filename), 'wb') as file:
-                np.savetxt(file, data, fmt=fmt, delimiter=delimiter, header=header,
-                           comments=comments)
+        with open(os.path.join(filepath, filename), 'ab' if append else 'wb') as file:
+            _write_text(file, data, fmt=fmt, delimiter=delimiter, header=header,
+                        comments=comments)
         return
 
+    def save_array_as_npy(self, data, filename, filepath=''):
+        """
+        Save a numpy.ndarray as raw .npy file, written through a memory map.
+
+        @return str: path of the file
+        """
+        path = os.path.join(filepath, filename)
+        if data.size == 0:
+            # empty arrays can not be memory mapped
+            np.save(path, data)
+            return path
+        array = np.lib.format.open_memmap(path, mode='w+', dtype=data.dtype, shape=data.shape)
+        array[...] = data
+        array.flush()
+        del array
+        return path
+
     def get_daily_directory(self):
         """ Gets or creates daily save directory.
 